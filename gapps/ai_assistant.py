@@ -1,62 +1,158 @@
 import re
 import json
-from datetime import datetime, timedelta
-from typing import Dict, Any, List
-from unsloth import FastModel
-from transformers import TextStreamer
-import torch
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional, Tuple
 import gc
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from config import Config
+import metrics
+import tracing
 from gmail_service import GmailService
+from attachment_export import AttachmentExporter
+import mail_import
+from email_digest import EmailDigest, format_digest
 from calendar_service import CalendarService
 from datetime import datetime
 
+# Imported with the model, so INFERENCE_BACKEND=stub runs without torch installed
+torch = None
+
 today_date = datetime.today().date()
 date_str = today_date.isoformat()  # '2025-07-31'
 
 class AIAssistant:
     def __init__(self):
-        # Initialize the Gemma3n model
-        self.model, self.tokenizer = FastModel.from_pretrained(
-            model_name=Config.MODEL_NAME,
-            dtype=None,
-            max_seq_length=Config.MAX_SEQ_LENGTH,
-            load_in_4bit=True,
-            full_finetuning=False,
-        )
+        if Config.INFERENCE_BACKEND == 'stub':
+            # Canned responses with simulated latency, for load testing without a GPU
+            self.model, self.tokenizer = None, None
+        else:
+            global torch
+            from unsloth import FastModel
+            import torch
+
+            torch._dynamo.config.cache_size_limit = 1024
+
+            # Initialize the Gemma3n model
+            self.model, self.tokenizer = FastModel.from_pretrained(
+                model_name=Config.MODEL_NAME,
+                dtype=None,
+                max_seq_length=Config.MAX_SEQ_LENGTH,
+                load_in_4bit=True,
+                full_finetuning=False,
+            )
         
         # Initialize services
         self.gmail_service = GmailService()
         self.calendar_service = CalendarService()
-        
-        # Set up torch configuration
-        torch._dynamo.config.cache_size_limit = 1024
-       
+
+        # The model can only run one generate() at a time
+        self._generate_lock = threading.Lock()
 
         
     def process_user_query(self, user_query: str) -> str:
         """Process user query and return appropriate response"""
         try:
-            # Analyze the query to determine the action
-            action = self._analyze_query(user_query)
+            with metrics.count_request_tokens(), tracing.span('process_user_query') as query_span:
+                # Analyze the query to determine the action
+                with metrics.ROUTING_SECONDS.time(), tracing.span('route'):
+                    action = self._analyze_query(user_query)
+                query_span.set_attribute('intent', f"{action['type']}.{action['action']}")
             
-            if action['type'] == 'calendar':
-                return self._handle_calendar_action(action, user_query)
-            elif action['type'] == 'email':
-                return self._handle_email_action(action, user_query)
-            elif action['type'] == 'telegram':
-                return self._handle_telegram_action(action, user_query)
-            elif action['type'] == 'general':
-                return self._handle_general_query(user_query)
-            elif action['type'] == 'geeta':
-                return self._handle_geeta_action(action, user_query)
-            elif action['type'] == 'bible':
-                return self._handle_bible_action(action, user_query)
-            else:
-                return "I'm not sure how to help with that. Please try rephrasing your request."
+                if action['type'] == 'calendar':
+                    return self._handle_calendar_action(action, user_query)
+                elif action['type'] == 'email':
+                    return self._handle_email_action(action, user_query)
+                elif action['type'] == 'telegram':
+                    return self._handle_telegram_action(action, user_query)
+                elif action['type'] == 'general':
+                    return self._handle_general_query(user_query)
+                elif action['type'] == 'geeta':
+                    return self._handle_geeta_action(action, user_query)
+                elif action['type'] == 'bible':
+                    return self._handle_bible_action(action, user_query)
+                else:
+                    return "I'm not sure how to help with that. Please try rephrasing your request."
                 
         except Exception as e:
             return f"Sorry, I encountered an error: {str(e)}"
+
+    def process_user_queries(self, user_queries: List[str]) -> List[str]:
+        """Process a batch of user queries and return responses in input order"""
+        responses = [None] * len(user_queries)
+        for index, response in self.iter_process_user_queries(user_queries):
+            responses[index] = response
+        return responses
+
+    def iter_process_user_queries(self, user_queries: List[str]):
+        """Process a batch of user queries, yielding (index, response) as each one finishes.
+
+        Queries are grouped by intent. Intents whose first step is a model pass
+        get their prompts generated together in batches of Config.BATCH_SIZE,
+        while Google/Telegram work runs on a thread pool so it overlaps with
+        the next generation batch.
+        """
+        generation_groups: Dict[tuple, List[tuple]] = {}
+        with ThreadPoolExecutor(max_workers=Config.BATCH_IO_WORKERS) as executor:
+            futures = {}
+            for index, query in enumerate(user_queries):
+                try:
+                    with metrics.ROUTING_SECONDS.time(), tracing.span('route'):
+                        action = self._analyze_query(query)
+                    step = self._batch_step(action, query)
+                except Exception as e:
+                    yield index, f"Sorry, I encountered an error: {str(e)}"
+                    continue
+                if step is None:
+                    # No upfront model pass: run the whole query on the I/O pool
+                    futures[executor.submit(tracing.wrap(self.process_user_query), query)] = index
+                else:
+                    key = (action['type'], action['action'])
+                    generation_groups.setdefault(key, []).append((index, step))
+
+            for items in generation_groups.values():
+                for start in range(0, len(items), Config.BATCH_SIZE):
+                    chunk = items[start:start + Config.BATCH_SIZE]
+                    outputs, counts = self._generate_with_counts([prompt for _, (prompt, _) in chunk])
+                    for (index, (_, finish)), output, count in zip(chunk, outputs, counts):
+                        future = executor.submit(tracing.wrap(self._finish_batch_step), finish, output, count)
+                        futures[future] = index
+
+                # Hand back whatever I/O already completed before the next group
+                for future in [f for f in futures if f.done()]:
+                    yield futures.pop(future), future.result()
+
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def _batch_step(self, action: Dict[str, Any], query: str):
+        """Return (prompt, finish) for intents that start with a model pass, else None"""
+        if action['type'] == 'general':
+            return query, lambda response: response
+        elif action['type'] == 'geeta' and action['action'] == 'guidance':
+            return self._geeta_prompt(query), lambda response: f"📖Bhagavad Gita Guidance\n\n{response}"
+        elif action['type'] == 'bible' and action['action'] == 'guidance':
+            return self._bible_prompt(query), lambda response: f"Bible Guidance\n\n{response}"
+        elif action['type'] == 'email' and action['action'] == 'send':
+            return self._email_details_prompt(query), \
+                lambda response: self._send_extracted_email(self._parse_email_details(response))
+        elif action['type'] == 'email' and action['action'] == 'search':
+            return self._search_query_prompt(query), lambda response: self._search_emails(response.strip())
+        elif action['type'] == 'email' and action['action'] == 'summarize_thread':
+            return self._search_query_prompt(query), lambda response: self._summarize_thread(response.strip())
+        elif action['type'] == 'calendar' and action['action'] == 'create':
+            return self._event_details_prompt(query), \
+                lambda response: self._create_extracted_event(self._parse_event_details(response))
+        return None
+
+    def _finish_batch_step(self, finish, response: str, generated_tokens: int = 0) -> str:
+        """Run the post-generation step of a batched query, counting its tokens with the batched pass"""
+        try:
+            with metrics.count_request_tokens(generated_tokens):
+                return finish(response)
+        except Exception as e:
+            return f"Sorry, I encountered an error: {str(e)}"
     
     def _analyze_query(self, query: str) -> Dict[str, Any]:
         # """Analyze user query to determine the intended action using LLM"""
@@ -116,11 +212,20 @@ class AIAssistant:
         calendar_today_keywords = ['today events','today\'s events','what\'s on today','today\'s schedule']
         calendar_yesterday_keywords = ['yesterday events','yesterday\'s events','what\'s on yesterday','yesterday\'s schedule']
         calendar_delete_keywords = ['delete event', 'remove event', 'cancel event']
+        calendar_free_keywords = ['free slot', 'free time', 'when am i free', 'when are we free', 'when is everyone free',
+                                  'find a time', 'find time', 'available slot', 'availability', 'when can i meet']
         
         # Email actions with more comprehensive keywords
         email_send_keywords = ['send a mail', 'write an email', 'compose an email', 'mail to', 'email to']
         email_get_keywords = ['inbox', 'check mail','get me my 5 recent mails', 'read email', 'get emails', 'show messages', 'view inbox', 'check inbox', 'my emails']
         email_search_keywords = ['search emails', 'find emails', 'look for emails', 'filter emails', 'query emails']
+        email_thread_summary_keywords = ['summarize thread', 'summarise thread', 'summarize the thread',
+                                         'summarize conversation', 'summarise conversation', 'thread summary']
+        email_digest_keywords = ['digest', 'summarize my inbox', 'summarise my inbox', 'summarize my emails',
+                                 'summarise my emails', 'inbox summary']
+        email_threads_keywords = ['email threads', 'mail threads', 'my threads', 'conversations', 'show threads']
+        email_semantic_keywords = ['email about', 'mail about', 'emails about', 'the email where', 'the mail where',
+                                   'that email', 'email regarding', 'email mentioning']
         
         # Telegram actions with more comprehensive keywords
         telegram_send_keywords = ['telegram', 'telegram message','tele','chat','chat with']
@@ -131,7 +236,9 @@ class AIAssistant:
         # Bible actions with comprehensive keywords
         bible_keywords = ['bible', 'christian guidance', 'biblical wisdom', 'gospel', 'jesus']
         # Check calendar actions
-        if any(word in query_lower for word in calendar_create_keywords):
+        if any(word in query_lower for word in calendar_free_keywords):
+            return {'type': 'calendar', 'action': 'find_slots', 'confidence': 0.8}
+        elif any(word in query_lower for word in calendar_create_keywords):
             return {'type': 'calendar', 'action': 'create', 'confidence': 0.8}
         elif any(word in query_lower for word in calendar_today_keywords):
             return {'type': 'calendar', 'action': 'get_today', 'confidence': 0.8}
@@ -141,8 +248,16 @@ class AIAssistant:
             return {'type': 'calendar', 'action': 'delete', 'confidence': 0.8}
         
         # Check email actions
+        elif any(word in query_lower for word in email_thread_summary_keywords):
+            return {'type': 'email', 'action': 'summarize_thread', 'confidence': 0.8}
+        elif any(word in query_lower for word in email_digest_keywords):
+            return {'type': 'email', 'action': 'digest', 'confidence': 0.8}
+        elif any(word in query_lower for word in email_threads_keywords):
+            return {'type': 'email', 'action': 'get_threads', 'confidence': 0.8}
         elif any(word in query_lower for word in email_send_keywords):
             return {'type': 'email', 'action': 'send', 'confidence': 0.7}
+        elif any(word in query_lower for word in email_semantic_keywords):
+            return {'type': 'email', 'action': 'semantic_search', 'confidence': 0.7}
         elif any(word in query_lower for word in email_get_keywords):
             return {'type': 'email', 'action': 'get_emails', 'confidence': 0.8}
         elif any(word in query_lower for word in email_search_keywords):
@@ -178,27 +293,78 @@ class AIAssistant:
         elif action['action'] == 'create':
             # Extract event details using AI
             event_details = self._extract_event_details(query)
-            if event_details:
-                try:
-                    event = self.calendar_service.create_event(
-                        summary=event_details['summary'],
-                        start_time=event_details['start_time'],
-                        end_time=event_details['end_time'],
-                        description=event_details.get('description', ''),
-                        location=event_details.get('location', ''),
-                        attendees=event_details.get('attendees', [])
-                    )
-                    return f"✅ Event created successfully: {event_details['summary']}"
-                except Exception as e:
-                    return f"❌ Failed to create event: {str(e)}"
-            else:
-                return "❌ Could not extract event details from your request."
+            return self._create_extracted_event(event_details)
+        
+        elif action['action'] == 'find_slots':
+            return self._find_free_slots(query)
         
         elif action['action'] == 'delete':
             # This would need more sophisticated event identification
             return "❌ Event deletion requires specific event identification. Please provide more details."
         
         return "❌ Unknown calendar action."
+
+    def _find_free_slots(self, query: str) -> str:
+        """Propose meeting times when the user and everyone mentioned are free"""
+        duration = self._meeting_minutes(query)
+        attendees = re.findall(r'[\w.+-]+@[\w-]+\.[\w.-]*\w', query)
+        time_min = time_max = None
+        if re.search(r'\b(today|tomorrow)\b', query, re.IGNORECASE):
+            tz = self.calendar_service.scheduling_timezone()
+            day = datetime.now(tz).replace(hour=0, minute=0, second=0, microsecond=0)
+            if re.search(r'\btomorrow\b', query, re.IGNORECASE):
+                day += timedelta(days=1)
+            time_min, time_max = day, day + timedelta(days=1)
+        result = self.calendar_service.find_free_slots(duration, attendees=attendees,
+                                                       time_min=time_min, time_max=time_max)
+        return f"⏱️ {duration}-minute meeting" + (f" with {', '.join(attendees)}" if attendees else "") + \
+               "\n\n" + self.calendar_service.format_slots_for_display(result)
+
+    def _meeting_minutes(self, query: str) -> int:
+        """Meeting length asked for in a query, an hour by default"""
+        if re.search(r'\bhalf an hour\b', query, re.IGNORECASE):
+            return 30
+        match = re.search(r'(\d+(?:\.\d+)?)\s*(minutes?|mins?|hours?|hrs?|h)\b', query, re.IGNORECASE)
+        if not match:
+            return 60
+        amount = float(match.group(1))
+        return max(int(amount if match.group(2).lower().startswith('m') else amount * 60), 1)
+
+    def _schedule_clash(self, event_details: Dict[str, Any]) -> Optional[str]:
+        """A reply offering free times if the event would clash with busy time, else None"""
+        # Events are created in UTC (see CalendarService.create_event)
+        start, end = (event_details[key] if event_details[key].tzinfo else event_details[key].replace(tzinfo=timezone.utc)
+                      for key in ('start_time', 'end_time'))
+        attendees = event_details.get('attendees', [])
+        busy = self.calendar_service.busy_calendars(start, end, attendees)
+        if not busy:
+            return None
+        minutes = max(int((end - start).total_seconds() // 60), 1)
+        result = self.calendar_service.find_free_slots(minutes, attendees=attendees, time_min=start)
+        return f"⚠️ {event_details['summary']} was not created: {', '.join(busy)} already busy at " \
+               f"{start.strftime('%a %d %b, %H:%M')}.\n\n" + self.calendar_service.format_slots_for_display(result)
+
+    def _create_extracted_event(self, event_details: Dict[str, Any]) -> str:
+        """Create a calendar event from extracted details"""
+        if event_details:
+            try:
+                clash = self._schedule_clash(event_details) if Config.SCHEDULING_AVOID_CONFLICTS else None
+                if clash:
+                    return clash
+                event = self.calendar_service.create_event(
+                    summary=event_details['summary'],
+                    start_time=event_details['start_time'],
+                    end_time=event_details['end_time'],
+                    description=event_details.get('description', ''),
+                    location=event_details.get('location', ''),
+                    attendees=event_details.get('attendees', [])
+                )
+                return f"✅ Event created successfully: {event_details['summary']}"
+            except Exception as e:
+                return f"❌ Failed to create event: {str(e)}"
+        else:
+            return "❌ Could not extract event details from your request."
+
     def _extract_telegram_details(self, query: str) -> str:
         """Extract person's name from user query for telegram chat analysis"""
         # Hardcoded logic: return the last word of the query as the name
@@ -229,40 +395,122 @@ class AIAssistant:
             if not person_name:
                 return "❌ Could not identify the person's name from your request. Please specify who you want to analyze (e.g., 'analyze telegram chat with nisha')."
             
+            return self.analyze_telegram_chat(person_name)
+        
+        return "❌ Unknown telegram action. Try: 'analyze telegram chat with [person_name]'."
+
+    def analyze_telegram_chat(self, person_name: str, progress=None) -> str:
+        """Analyze a telegram chat with a person and generate advice"""
+        progress = progress or (lambda fraction, message: None)
+        try:
+            # Import and run the tele_parser function
+            from tele_parser import preprocess_chat
+            
+            # Run the preprocess_chat function
+            progress(0.1, "Preprocessing chat")
+            with tracing.span('telegram.preprocess_chat', person=person_name):
+                preprocess_chat(folder_path="telegram", name=person_name, length=20)
+            
+            # Read the preprocessed chat data
+            preprocessed_file = f"telegram/preprocessed_{person_name}.txt"
             try:
-                # Import and run the tele_parser function
-                from tele_parser import preprocess_chat
+                with open(preprocessed_file, 'r', encoding='utf-8') as f:
+                    chat_data = f.read().strip()
                 
-                # Run the preprocess_chat function
-                preprocess_chat(folder_path="telegram", name=person_name, length=20)
+                if not chat_data:
+                    return f"❌ No chat data found for {person_name}. Please check if the telegram chat file exists."
                 
-                # Read the preprocessed chat data
-                preprocessed_file = f"telegram/preprocessed_{person_name}.txt"
-                try:
-                    with open(preprocessed_file, 'r', encoding='utf-8') as f:
-                        chat_data = f.read().strip()
-                    
-                    if not chat_data:
-                        return f"❌ No chat data found for {person_name}. Please check if the telegram chat file exists."
-                    
-                    # Generate advice using the chat data
-                    advice = self._handle_telegram_query(chat_data, person_name)
-                    return f"📱 **Telegram Chat Analysis for {person_name}**\n\n{advice}"
-                    
-                except FileNotFoundError:
-                    return f"❌ Could not find preprocessed chat data for {person_name}. Please check if the telegram chat file exists."
-                    
-            except ImportError:
-                return "❌ Could not import tele_parser module. Please ensure tele_parser.py is available."
-            except Exception as e:
-                return f"❌ Error processing telegram chat: {str(e)}"
-        
-        return "❌ Unknown telegram action. Try: 'analyze telegram chat with [person_name]'."
+                # Generate advice using the chat data
+                progress(0.5, "Generating advice")
+                advice = self._handle_telegram_query(chat_data, person_name)
+                return f"📱 **Telegram Chat Analysis for {person_name}**\n\n{advice}"
+                
+            except FileNotFoundError:
+                return f"❌ Could not find preprocessed chat data for {person_name}. Please check if the telegram chat file exists."
+                
+        except ImportError:
+            return "❌ Could not import tele_parser module. Please ensure tele_parser.py is available."
+        except Exception as e:
+            return f"❌ Error processing telegram chat: {str(e)}"
     
+    def archive_emails(self, max_results: Optional[int] = 100, query: str = None, filename: str = None,
+                       append: bool = True, progress=None) -> Dict[str, Any]:
+        """Stream emails into a markdown archive, page by page; max_results=None archives everything"""
+        progress = progress or (lambda fraction, message: None)
+        progress(0.0, "Fetching emails")
+        
+        def report(written, skipped):
+            fraction = min((written + skipped) / max_results, 0.99) if max_results else 0.0
+            progress(fraction, f"Archived {written} emails ({skipped} already archived)")
+        
+        pages = self.gmail_service.iter_email_pages(query=query or 'in:inbox',
+                                                    page_size=min(max_results or 500, 500), limit=max_results)
+        result = self.gmail_service.archive_to_markdown(pages, filename=filename or "email_archive.md",
+                                                        append=append, progress=report)
+        return {'count': result['written'], 'skipped': result['skipped'], 'filepath': result['filepath']}
+
+    def export_attachments(self, query: str = 'has:attachment', max_results: Optional[int] = None,
+                           progress=None) -> Dict[str, Any]:
+        """Download the attachments of matching emails into the content-addressed attachment store"""
+        progress = progress or (lambda fraction, message: None)
+        progress(0.0, "Listing emails")
+        
+        def report(totals):
+            fraction = min(totals['messages'] / max_results, 0.99) if max_results else 0.0
+            progress(fraction, f"{totals['messages']} emails, {totals['attachments']} attachments "
+                               f"({totals['deduplicated']} duplicates), {totals['failed']} failed")
+        
+        exporter = AttachmentExporter(self.gmail_service)
+        return exporter.export(self.gmail_service.iter_message_ids(query=query, limit=max_results), progress=report)
+
+    def import_mailbox(self, path: str, progress=None) -> Dict[str, Any]:
+        """Load an mbox export or a directory of .eml files into the mailbox cache, without the Gmail API"""
+        progress = progress or (lambda fraction, message: None)
+        if self.gmail_service.store is None:
+            raise RuntimeError("Importing mail needs the mailbox cache (MAIL_CACHE_ENABLED)")
+        
+        def report(fraction, totals):
+            progress(min(fraction, 0.99), f"{totals['imported']} emails imported, {totals['duplicates']} duplicates, "
+                                          f"{totals['failed']} unreadable")
+        
+        # The sync daemon, if running, embeds the imported mail for semantic search
+        embed = self.gmail_service.index is not None and not self.gmail_service.index.background_update
+        return mail_import.run_in_subprocess(path, self.gmail_service.store.path, embed=embed, progress=report)
+
+    def send_bulk_emails(self, messages: List[Dict[str, str]], progress=None) -> Dict[str, Any]:
+        """Send a list of {'to', 'subject', 'body'} emails within the Gmail quota"""
+        progress = progress or (lambda fraction, message: None)
+        total = len(messages)
+        results = self.gmail_service.send_emails(
+            messages, progress=lambda done: progress(done / total, f"Sent {done}/{total} emails")
+        )
+        return {
+            'sent': sum(result['status'] == 'sent' for result in results),
+            'failed': sum(result['status'] != 'sent' for result in results),
+            'results': results,
+        }
+
+    def email_digest(self, max_results: int = None, query: str = None, progress=None) -> Dict[str, Any]:
+        """One-line summaries of the latest emails, several emails per prompt and prompts batched"""
+        progress = progress or (lambda fraction, message: None)
+        digest = EmailDigest(self.gmail_service, self._generate_responses, count_tokens=self._count_tokens)
+        return digest.build(
+            max_results=max_results, query=query,
+            progress=lambda done, total: progress(min(done / total, 0.99), f"Summarized {done} of {total} batches")
+        )
+
+    def _count_tokens(self, text: str) -> int:
+        """Prompt tokens for text, from the model's tokenizer when one is loaded"""
+        if self.tokenizer is None:
+            return len(text) // 4 + 1
+        tokenizer = getattr(self.tokenizer, 'tokenizer', self.tokenizer)
+        return len(tokenizer.encode(text, add_special_tokens=False))
+
     def _handle_email_action(self, action: Dict[str, Any], query: str) -> str:
         """Handle email-related actions"""
         if action['action'] == 'get_emails':
-            emails = self.gmail_service.get_emails(max_results=5)
+            # Headers only; bodies are fetched when the emails are archived
+            emails = self.gmail_service.list_emails(max_results=5)
             if emails:
                 # Save to markdown
                 filepath = self.gmail_service.save_emails_to_markdown(emails)
@@ -274,38 +522,123 @@ class AIAssistant:
         elif action['action'] == 'send':
             # Extract email details using AI
             email_details = self._extract_email_details(query)
-            if email_details:
-                success = self.gmail_service.send_email(
-                    to=email_details['to'],
-                    subject=email_details['subject'],
-                    body=email_details['body']
-                )
-                if success:
-                    return f"✅ Email sent successfully to {email_details['to']}\nSubject: {email_details['subject']}"
-                else:
-                    return "❌ Failed to send email. Please check your credentials and try again."
-            else:
-                return "❌ Could not extract email details from your request. Please provide recipient, subject, and message."
+            return self._send_extracted_email(email_details)
         
         elif action['action'] == 'search':
             # Extract search query from user input
             search_query = self._extract_search_query(query)
-            if search_query:
-                emails = self.gmail_service.get_emails(max_results=10, query=search_query)
-                if emails:
-                    filepath = self.gmail_service.save_emails_to_markdown(emails, f"search_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.md")
-                    return f"🔍 Found {len(emails)} emails matching '{search_query}' and saved to {filepath}\n\n" + \
-                           "\n".join([f"• {email['subject']} (from {email['sender']})" for email in emails[:5]])
-                else:
-                    return f"🔍 No emails found matching '{search_query}'"
+            return self._search_emails(search_query)
+        
+        elif action['action'] == 'semantic_search':
+            # Matches by meaning from the local index; no model call to rewrite the query
+            return self._semantic_search_emails(self._semantic_query(query))
+        
+        elif action['action'] == 'get_threads':
+            # One entry per conversation instead of one per message
+            threads = self.gmail_service.list_threads(max_results=5)
+            if threads:
+                filepath = self.gmail_service.save_threads_to_markdown(threads)
+                return f"🧵 Retrieved {len(threads)} conversations and saved to {filepath}\n\nRecent conversations:\n" + \
+                       "\n".join([f"• {thread['subject']} ({thread['message_count']} messages, "
+                                  f"{', '.join(thread['participants'][:3])})" for thread in threads])
             else:
-                return "❌ Please specify what you want to search for in your emails."
+                return "🧵 No conversations found in inbox."
         
-        return "❌ Unknown email action. Try: 'send email', 'check inbox', or 'search emails'."
+        elif action['action'] == 'summarize_thread':
+            return self._summarize_thread(self._extract_search_query(query))
+        
+        elif action['action'] == 'digest':
+            result = self.email_digest()
+            if result['emails']:
+                return f"📬 Digest of your {len(result['emails'])} latest emails\n\n" + format_digest(result['emails'])
+            else:
+                return "📬 No emails found in inbox."
+        
+        return "❌ Unknown email action. Try: 'send email', 'check inbox', 'search emails', 'find the email about ...' or 'summarize thread'."
+
+    def _send_extracted_email(self, email_details: Dict[str, Any]) -> str:
+        """Send an email from extracted details"""
+        if email_details:
+            success = self.gmail_service.send_email(
+                to=email_details['to'],
+                subject=email_details['subject'],
+                body=email_details['body']
+            )
+            if success:
+                return f"✅ Email sent successfully to {email_details['to']}\nSubject: {email_details['subject']}"
+            else:
+                return "❌ Failed to send email. Please check your credentials and try again."
+        else:
+            return "❌ Could not extract email details from your request. Please provide recipient, subject, and message."
+
+    def _search_emails(self, search_query: str) -> str:
+        """Search emails with an extracted Gmail query"""
+        if search_query:
+            emails = self.gmail_service.search_emails(search_query, max_results=10)
+            if emails:
+                filepath = self.gmail_service.save_emails_to_markdown(emails, f"search_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.md")
+                return f"🔍 Found {len(emails)} emails matching '{search_query}' and saved to {filepath}\n\n" + \
+                       "\n".join([f"• {email['subject']} (from {email['sender']})" +
+                                  (f"\n  {email['match']}" if email.get('match') else '')
+                                  for email in emails[:5]])
+            else:
+                return f"🔍 No emails found matching '{search_query}'"
+        else:
+            return "❌ Please specify what you want to search for in your emails."
     
+    def _semantic_search_emails(self, text: str) -> str:
+        """Find emails by meaning rather than exact words"""
+        if not text:
+            return "❌ Please describe the email you are looking for, e.g. 'the email about rescheduling the offsite'."
+        emails = self.gmail_service.semantic_search(text, max_results=10)
+        if emails:
+            filepath = self.gmail_service.save_emails_to_markdown(emails, f"semantic_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.md")
+            return f"🔎 Closest emails to '{text}', saved to {filepath}\n\n" + \
+                   "\n".join([f"• {email['subject']} (from {email['sender']}, {email['date']})\n  {email['snippet'][:120]}"
+                              for email in emails[:5]])
+        else:
+            return f"🔎 No emails found about '{text}'"
+
+    def _semantic_query(self, query: str) -> str:
+        """What the user is looking for, without the request around it"""
+        match = re.search(r'\be?-?mails?\s+(?:about|where|regarding|mentioning|on)\s+(.+)', query, re.IGNORECASE)
+        text = match.group(1) if match else query
+        return text.strip(' ?.!"\'')
+
+    def _summarize_thread(self, search_query: str) -> str:
+        """Summarize the conversation containing the best match for a Gmail query"""
+        if not search_query:
+            return "❌ Please say which conversation to summarize, e.g. 'summarize the thread about the offsite'."
+        emails = self.gmail_service.search_emails(search_query, max_results=1)
+        if not emails or not emails[0].get('thread_id'):
+            return f"🔍 No conversation found matching '{search_query}'"
+        thread = self.gmail_service.get_thread(emails[0]['thread_id'])
+        if not thread:
+            return "❌ Could not load that conversation. Please try again."
+        
+        # Quoted history is collapsed, so each message is sent to the model once
+        transcript = self.gmail_service.format_thread(thread, max_chars=Config.THREAD_SUMMARY_MAX_CHARS)
+        summary = self._generate_response(self._thread_summary_prompt(thread, transcript))
+        return f"🧵 {thread['subject']} ({thread['message_count']} messages)\n\n{summary}"
+
+    def _thread_summary_prompt(self, thread: Dict[str, Any], transcript: str) -> str:
+        """Build the prompt that summarizes an email thread"""
+        return f"""Summarize this email conversation "{thread['subject']}" between {', '.join(thread['participants'])}.
+Give the main points, any decisions made, and open questions or action items with who owns them.
+
+{transcript}
+
+Summary:
+"""
+
     def _extract_search_query(self, query: str) -> str:
         """Extract search query from user input"""
-        prompt = f"""
+        response = self._generate_response(self._search_query_prompt(query))
+        return response.strip()
+
+    def _search_query_prompt(self, query: str) -> str:
+        """Build the prompt that turns user input into a Gmail search query"""
+        return f"""
         Extract a Gmail search query from this user input: "{query}"
         
         Return only the search query that can be used with Gmail's search syntax.
@@ -318,9 +651,6 @@ class AIAssistant:
         
         If no clear search terms, return an empty string.
         """
-        
-        response = self._generate_response(prompt)
-        return response.strip()
     
     def _handle_general_query(self, query: str) -> str:
         """Handle general queries using the AI model"""
@@ -331,15 +661,7 @@ class AIAssistant:
         if action['action'] == 'guidance':
             try:
                 # Create the Gita guidance prompt similar to bhagwad_geeta.py
-                prompt = f"""You are a wise and compassionate guide who answers life questions using the teachings of the Bhagavad Gita.
-
-The user will share a personal or emotional concern. Respond with empathy, clarity, and quotes or summaries from the Gita that can help the user reflect and find peace.
-
-User's message:
-\"\"\"{query}\"\"\"
-
-Your response (include relevant verses, chapter numbers if possible, and practical reflection):
-"""
+                prompt = self._geeta_prompt(query)
                 
                 # Generate guidance using the model
                 guidance = self._generate_response(prompt)
@@ -349,21 +671,25 @@ Your response (include relevant verses, chapter numbers if possible, and practic
                 return f"❌ Error generating Gita guidance: {str(e)}"
         
         return "❌ Unknown Gita action. Try asking for spiritual guidance or life advice."
-    
-    def _handle_bible_action(self, action: Dict[str, Any], query: str) -> str:
-        """Handle Bible-related actions"""
-        if action['action'] == 'guidance':
-            try:
-                # Create the Bible guidance prompt similar to bhagwad_geeta.py
-                prompt = f"""You are a wise and compassionate guide who answers life questions using the teachings of the Bible.
 
-The user will share a personal or emotional concern. Respond with empathy, clarity, and quotes or summaries from the Bible that can help the user reflect and find peace.
+    def _geeta_prompt(self, query: str) -> str:
+        """Build the Bhagavad Gita guidance prompt"""
+        return f"""You are a wise and compassionate guide who answers life questions using the teachings of the Bhagavad Gita.
+
+The user will share a personal or emotional concern. Respond with empathy, clarity, and quotes or summaries from the Gita that can help the user reflect and find peace.
 
 User's message:
 \"\"\"{query}\"\"\"
 
 Your response (include relevant verses, chapter numbers if possible, and practical reflection):
 """
+    
+    def _handle_bible_action(self, action: Dict[str, Any], query: str) -> str:
+        """Handle Bible-related actions"""
+        if action['action'] == 'guidance':
+            try:
+                # Create the Bible guidance prompt similar to bhagwad_geeta.py
+                prompt = self._bible_prompt(query)
                 
                 # Generate guidance using the model
                 guidance = self._generate_response(prompt)
@@ -373,10 +699,27 @@ Your response (include relevant verses, chapter numbers if possible, and practic
                 return f"❌ Error generating Bible guidance: {str(e)}"
         
         return "❌ Unknown Bible action. Try asking for spiritual guidance or life advice."
+
+    def _bible_prompt(self, query: str) -> str:
+        """Build the Bible guidance prompt"""
+        return f"""You are a wise and compassionate guide who answers life questions using the teachings of the Bible.
+
+The user will share a personal or emotional concern. Respond with empathy, clarity, and quotes or summaries from the Bible that can help the user reflect and find peace.
+
+User's message:
+\"\"\"{query}\"\"\"
+
+Your response (include relevant verses, chapter numbers if possible, and practical reflection):
+"""
     
     def _extract_event_details(self, query: str) -> Dict[str, Any]:
         """Extract event details from user query using AI"""
-        prompt = f"""
+        response = self._generate_response(self._event_details_prompt(query))
+        return self._parse_event_details(response)
+
+    def _event_details_prompt(self, query: str) -> str:
+        """Build the prompt that extracts event details from a user query"""
+        return f"""
         Extract event details from this query: "{query}"
         consider current date as "{date_str}", based on this date, figure out date tommorow  and day after tomorrow and later as well.
         convert the time to iso format as well. For example if user says "tommorow at 10 am" then return the date as tommorow and time as 10 am.
@@ -393,9 +736,9 @@ Your response (include relevant verses, chapter numbers if possible, and practic
         
         If any information is missing, use reasonable defaults.
         """
-        
-        response = self._generate_response(prompt)
-        
+
+    def _parse_event_details(self, response: str) -> Dict[str, Any]:
+        """Parse model output into event details, falling back to a default event"""
         try:
             # Try to extract JSON from response
             json_match = re.search(r'\{.*\}', response, re.DOTALL)
@@ -424,7 +767,12 @@ Your response (include relevant verses, chapter numbers if possible, and practic
     
     def _extract_email_details(self, query: str) -> Dict[str, Any]:
         """Extract email details from user query using AI"""
-        prompt = f"""
+        response = self._generate_response(self._email_details_prompt(query))
+        return self._parse_email_details(response)
+
+    def _email_details_prompt(self, query: str) -> str:
+        """Build the prompt that extracts email details from a user query"""
+        return f"""
         Extract email details from this query: "{query}"
         
         Return a JSON object with:
@@ -434,9 +782,9 @@ Your response (include relevant verses, chapter numbers if possible, and practic
         
         If any information is missing, use reasonable defaults.
         """
-        
-        response = self._generate_response(prompt)
-        
+
+    def _parse_email_details(self, response: str) -> Dict[str, Any]:
+        """Parse model output into email details, falling back to a default email"""
         try:
             # Try to extract JSON from response
             json_match = re.search(r'\{.*\}', response, re.DOTALL)
@@ -454,22 +802,45 @@ Your response (include relevant verses, chapter numbers if possible, and practic
     
     def _generate_response(self, prompt: str) -> str:
         """Generate response using the Gemma3n model"""
+        return self._generate_responses([prompt])[0]
+
+    def _generate_responses(self, prompts: List[str]) -> List[str]:
+        """Generate responses for several prompts in a single padded model pass"""
+        responses, counts = self._generate_with_counts(prompts)
+        for count in counts:
+            metrics.record_generated_tokens(count)
+        return responses
+
+    def _generate_with_counts(self, prompts: List[str]) -> Tuple[List[str], List[int]]:
+        """Responses and the number of tokens generated for each, without recording the counts"""
+        if self.model is None:
+            return self._stub_generate(prompts), [Config.STUB_TOKENS] * len(prompts)
+        if len(prompts) == 1:
+            response, count = self._generate_single(prompts[0])
+            return [response], [count]
+        return self._generate_padded(prompts)
+
+    def _generate_single(self, prompt: str) -> Tuple[str, int]:
         try:
             messages = [{
                 "role": "user",
                 "content": [{"type": "text", "text": prompt}]
             }]
             
-            inputs = self.tokenizer.apply_chat_template(
-                messages,
-                add_generation_prompt=True,
-                tokenize=True,
-                return_dict=True,
-                return_tensors="pt",
-            ).to("cuda")
+            with metrics.TOKENIZE_SECONDS.time(), tracing.span('model.tokenize'):
+                inputs = self.tokenizer.apply_chat_template(
+                    messages,
+                    add_generation_prompt=True,
+                    tokenize=True,
+                    return_dict=True,
+                    return_tensors="pt",
+                ).to("cuda")
             
             # Generate response
-            with torch.no_grad():
+            with tracing.span('model.generate', batch_size=1) as generate_span, \
+                    self._generate_lock, torch.no_grad():
+                # Started once the lock is held, so prefill does not include time queued behind other generations
+                timer = metrics.GenerationTimer()
                 outputs = self.model.generate(
                     **inputs,
                     max_new_tokens=Config.MAX_NEW_TOKENS,
@@ -477,12 +848,14 @@ Your response (include relevant verses, chapter numbers if possible, and practic
                     top_p=0.95,
                     top_k=64,
                     do_sample=True,
-                    pad_token_id=self.tokenizer.eos_token_id
+                    pad_token_id=self.tokenizer.eos_token_id,
+                    streamer=timer
                 )
             
             # Extract only the newly generated tokens (exclude the input prompt)
             input_length = inputs['input_ids'].shape[1]
             generated_tokens = outputs[0][input_length:]
+            self._record_generation(generate_span, timer, input_length, len(generated_tokens))
             response = self.tokenizer.decode(generated_tokens, skip_special_tokens=True)
             
             # Clean up
@@ -490,7 +863,80 @@ Your response (include relevant verses, chapter numbers if possible, and practic
             torch.cuda.empty_cache()
             gc.collect()
             
-            return response
+            return response, len(generated_tokens)
             
         except Exception as e:
-            return f"Error generating response: {str(e)}" 
+            return f"Error generating response: {str(e)}", 0
+
+    def _generate_padded(self, prompts: List[str]) -> Tuple[List[str], List[int]]:
+        try:
+            conversations = [[{
+                "role": "user",
+                "content": [{"type": "text", "text": prompt}]
+            }] for prompt in prompts]
+
+            # Decoder-only generation needs the padding on the left
+            tokenizer = getattr(self.tokenizer, 'tokenizer', self.tokenizer)
+            tokenizer.padding_side = 'left'
+
+            with metrics.TOKENIZE_SECONDS.time(), tracing.span('model.tokenize'):
+                inputs = self.tokenizer.apply_chat_template(
+                    conversations,
+                    add_generation_prompt=True,
+                    tokenize=True,
+                    padding=True,
+                    return_dict=True,
+                    return_tensors="pt",
+                ).to("cuda")
+
+            with tracing.span('model.generate', batch_size=len(prompts)) as generate_span, \
+                    self._generate_lock, torch.no_grad():
+                # Started once the lock is held, so prefill does not include time queued behind other generations
+                timer = metrics.GenerationTimer()
+                outputs = self.model.generate(
+                    **inputs,
+                    max_new_tokens=Config.MAX_NEW_TOKENS,
+                    temperature=0.7,
+                    top_p=0.95,
+                    top_k=64,
+                    do_sample=True,
+                    pad_token_id=self.tokenizer.eos_token_id,
+                    streamer=timer
+                )
+
+            input_length = inputs['input_ids'].shape[1]
+            generated = outputs[:, input_length:]
+            # Padding after EOS is not generated text
+            counts = (generated != self.tokenizer.eos_token_id).sum(dim=1).tolist()
+            self._record_generation(generate_span, timer, input_length, sum(counts))
+            responses = self.tokenizer.batch_decode(generated, skip_special_tokens=True)
+
+            # Clean up
+            del inputs, outputs
+            torch.cuda.empty_cache()
+            gc.collect()
+
+            return responses, counts
+
+        except Exception as e:
+            return [f"Error generating response: {str(e)}"] * len(prompts), [0] * len(prompts)
+
+    def _record_generation(self, generate_span, timer, input_tokens: int, generated_tokens: int):
+        """Attach token counts and prefill/decode timings to a generation span"""
+        generate_span.set_attribute('input_tokens', input_tokens)
+        generate_span.set_attribute('generated_tokens', generated_tokens)
+        if timer.prefill_seconds is not None:
+            generate_span.set_attribute('prefill_ms', round(timer.prefill_seconds * 1000, 3))
+        if timer.decode_seconds is not None:
+            generate_span.set_attribute('decode_ms', round(timer.decode_seconds * 1000, 3))
+
+    def _stub_generate(self, prompts: List[str]) -> List[str]:
+        """Stand-in for model.generate() that costs a fixed prefill plus per-token decode time"""
+        with tracing.span('model.generate', batch_size=len(prompts), backend='stub'), self._generate_lock:
+            prefill = Config.STUB_PREFILL_MS / 1000
+            decode = Config.STUB_TOKENS * Config.STUB_MS_PER_TOKEN / 1000
+            time.sleep(prefill)
+            metrics.PREFILL_SECONDS.observe(prefill)
+            time.sleep(decode)
+            metrics.DECODE_SECONDS.observe(decode)
+        return [f"Stub response to a {len(prompt)}-character prompt." for prompt in prompts]
@@ -0,0 +1,188 @@
+"""
+Bulk attachment export
+
+Downloads the attachments of many messages with a bounded pool of workers
+sharing the Gmail quota bucket. Each attachment is streamed to a temporary
+file while it is hashed, then renamed into a content-addressed store
+(objects/<sha256[:2]>/<sha256>), so an attachment sent many times is stored
+once whatever it was called. Every finished message and attachment, with
+its filename and extension, is appended to manifest.jsonl; an interrupted
+export skips whatever the manifest already records when it is started again.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Optional, Set, Tuple
+from config import Config
+import rate_limit
+import tracing
+
+
+class _HashingWriter:
+    """File wrapper that hashes everything written through it"""
+
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data: bytes) -> int:
+        self.sha256.update(data)
+        return self.f.write(data)
+
+
+class AttachmentExporter:
+    def __init__(self, gmail_service, output_dir: str = None, max_workers: int = None,
+                 quota: rate_limit.TokenBucket = None):
+        self.gmail = gmail_service
+        self.output_dir = output_dir or Config.ATTACHMENT_DIR
+        self.max_workers = max_workers or Config.ATTACHMENT_EXPORT_WORKERS
+        self.quota = quota or rate_limit.GMAIL_QUOTA
+        self.manifest_path = os.path.join(self.output_dir, 'manifest.jsonl')
+        self._objects_dir = os.path.join(self.output_dir, 'objects')
+        self._tmp_dir = os.path.join(self.output_dir, 'tmp')
+        self._manifest_lock = threading.Lock()
+
+    def export(self, message_ids: Iterable[str], progress: Callable[[Dict[str, int]], None] = None) -> Dict[str, Any]:
+        """Download every attachment of message_ids; returns counts and the manifest path"""
+        for directory in (self._objects_dir, self._tmp_dir):
+            os.makedirs(directory, exist_ok=True)
+        done_messages, done_attachments = self._read_manifest()
+
+        totals = {'messages': 0, 'skipped_messages': 0, 'attachments': 0, 'deduplicated': 0,
+                  'bytes': 0, 'failed': 0}
+        totals_lock = threading.Lock()
+
+        def finished(result: Dict[str, int]):
+            with totals_lock:
+                for key, value in result.items():
+                    totals[key] += value
+                snapshot = dict(totals)
+            if progress:
+                progress(snapshot)
+
+        with tracing.span('attachments.export', workers=self.max_workers), \
+                ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='attachment-export') as pool:
+            # Bounded window: ids are pulled from the (possibly huge) iterable only as workers free up
+            pending = set()
+            for message_id in message_ids:
+                if message_id in done_messages:
+                    totals['skipped_messages'] += 1
+                    continue
+                if len(pending) >= self.max_workers * 2:
+                    completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in completed:
+                        finished(future.result())
+                pending.add(pool.submit(tracing.wrap(self._export_message), message_id, done_attachments))
+            for future in pending:
+                finished(future.result())
+
+        totals['manifest'] = self.manifest_path
+        return totals
+
+    def _read_manifest(self) -> Tuple[Set[str], Set[Tuple[str, str]]]:
+        """Messages fully exported, and individual attachments already stored"""
+        done_messages, done_attachments = set(), set()
+        if not os.path.exists(self.manifest_path):
+            return done_messages, done_attachments
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn last line from an interrupted run
+                    continue
+                if entry.get('status') == 'message_done':
+                    done_messages.add(entry['message_id'])
+                elif entry.get('status') == 'stored':
+                    done_attachments.add((entry['message_id'], entry['part_id']))
+        return done_messages, done_attachments
+
+    def _record(self, entry: Dict[str, Any]):
+        with self._manifest_lock, open(self.manifest_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _export_message(self, message_id: str, done_attachments: Set[Tuple[str, str]]) -> Dict[str, int]:
+        result = {'messages': 0, 'attachments': 0, 'deduplicated': 0, 'bytes': 0, 'failed': 0}
+        try:
+            attachments = self._with_retries(
+                'messages.get', lambda: self.gmail.get_attachments(message_id)
+            )
+        except Exception as e:
+            print(f"Error listing attachments of {message_id}: {e}")
+            self._record({'message_id': message_id, 'status': 'failed', 'error': str(e)})
+            result['failed'] += 1
+            return result
+
+        complete = True
+        for attachment in attachments:
+            if (message_id, attachment['part_id']) in done_attachments:
+                continue
+            try:
+                entry = self._export_attachment(message_id, attachment)
+            except Exception as e:
+                print(f"Error downloading {attachment['filename']} from {message_id}: {e}")
+                self._record({'message_id': message_id, 'part_id': attachment['part_id'],
+                              'filename': attachment['filename'], 'status': 'failed', 'error': str(e)})
+                result['failed'] += 1
+                complete = False
+                continue
+            self._record(entry)
+            result['attachments'] += 1
+            result['bytes'] += entry['size']
+            result['deduplicated'] += int(entry['deduplicated'])
+
+        if complete:
+            self._record({'message_id': message_id, 'status': 'message_done', 'attachments': len(attachments)})
+        result['messages'] += 1
+        return result
+
+    def _export_attachment(self, message_id: str, attachment: Dict[str, Any]) -> Dict[str, Any]:
+        def download() -> Tuple[str, str, int]:
+            fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir, suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    writer = _HashingWriter(f)
+                    size = self.gmail.write_attachment(message_id, attachment, writer)
+                    f.flush()
+                    os.fsync(f.fileno())
+                return tmp_path, writer.sha256.hexdigest(), size
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+
+        cost = 0 if attachment.get('data') is not None else None
+        tmp_path, digest, size = self._with_retries('messages.attachments.get', download, cost=cost)
+
+        path = os.path.join(self._objects_dir, digest[:2], digest)
+        deduplicated = os.path.exists(path)
+        if deduplicated:
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Atomic: the object appears complete or not at all
+            os.replace(tmp_path, path)
+
+        return {
+            'message_id': message_id,
+            'part_id': attachment['part_id'],
+            'filename': attachment['filename'],
+            'extension': re.sub(r'[^a-z0-9.]', '', os.path.splitext(attachment['filename'])[1].lower())[:16],
+            'mime_type': attachment['mime_type'],
+            'size': size,
+            'sha256': digest,
+            'path': os.path.relpath(path, self.output_dir),
+            'deduplicated': deduplicated,
+            'status': 'stored',
+        }
+
+    def _with_retries(self, method: str, fn: Callable, cost: Optional[float] = None):
+        """Call fn under the quota bucket, backing off and retrying on 429/5xx"""
+        cost = rate_limit.GMAIL_QUOTA_COSTS[method] if cost is None else cost
+        return rate_limit.call_with_retries(fn, cost, self.quota)
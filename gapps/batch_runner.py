@@ -0,0 +1,102 @@
+"""
+Offline JSONL batch runner for the Personal Assistant
+
+Each input line is a JSON object with a "query" and an optional "id"
+(defaults to the line number). Results are appended to the output file as
+soon as they are ready, so an interrupted run can be resumed: ids already
+present in the output file are skipped.
+"""
+
+import json
+import os
+from itertools import islice
+from typing import Any, Dict, Iterator, Optional, Set
+from config import Config
+
+
+def default_output_path(input_path: str) -> str:
+    """Return the output path used when none is given"""
+    root, _ = os.path.splitext(input_path)
+    return f"{root}.results.jsonl"
+
+
+def _read_done_ids(output_path: str) -> Set[str]:
+    """Collect the ids already written to an output file"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                done.add(str(json.loads(line)['id']))
+            except (ValueError, KeyError):
+                # A partial line left behind by an interrupted run
+                continue
+    return done
+
+
+def _iter_requests(input_path: str) -> Iterator[Dict[str, Any]]:
+    """Stream requests from a JSONL file"""
+    with open(input_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                print(f"Skipping invalid JSON on line {line_number}")
+                continue
+            if isinstance(record, str):
+                record = {'query': record}
+            if not record.get('query'):
+                print(f"Skipping line {line_number}: no query")
+                continue
+            yield {'id': str(record.get('id', line_number)), 'query': record['query']}
+
+
+def run_batch_file(assistant, input_path: str, output_path: Optional[str] = None,
+                   resume: bool = True) -> Dict[str, int]:
+    """Run every query in a JSONL file through the assistant and stream results to disk"""
+    output_path = output_path or default_output_path(input_path)
+    done = _read_done_ids(output_path) if resume else set()
+    stats = {'processed': 0, 'skipped': 0}
+
+    mode = 'a' if resume else 'w'
+    with open(output_path, mode, encoding='utf-8') as out:
+        if resume and out.tell() > 0:
+            # Make sure we never append onto a half-written line
+            with open(output_path, 'rb') as check:
+                check.seek(-1, os.SEEK_END)
+                if check.read(1) != b'\n':
+                    out.write('\n')
+
+        def pending_requests():
+            for record in _iter_requests(input_path):
+                if record['id'] in done:
+                    stats['skipped'] += 1
+                    continue
+                yield record
+
+        pending = pending_requests()
+        while True:
+            # Bounded chunks keep memory flat on very large inputs
+            chunk = list(islice(pending, Config.BATCH_CHUNK_SIZE))
+            if not chunk:
+                break
+
+            queries = [r['query'] for r in chunk]
+            for index, response in assistant.iter_process_user_queries(queries):
+                record = chunk[index]
+                out.write(json.dumps({
+                    'id': record['id'],
+                    'query': record['query'],
+                    'response': response
+                }, ensure_ascii=False) + '\n')
+                out.flush()
+                stats['processed'] += 1
+
+            print(f"Processed {stats['processed']} queries ({stats['skipped']} already done)")
+
+    return stats
@@ -1,73 +1,330 @@
+import heapq
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from datetime import datetime, timedelta, timezone
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from config import Config
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from event_store import EventStore, calendar_timezone, event_bounds, event_time
+import google_clients
+import metrics
+import slot_finder
+import tracing
 from googleapiclient.errors import HttpError
-import os
+
+_DONE = object()
+
+
+def event_start(event: Dict[str, Any], tz=timezone.utc) -> datetime:
+    """When an event starts, as an aware datetime; all-day events start at midnight in tz"""
+    return event_time(event.get('start', {}), tz)
+
 
 class CalendarService:
-    def __init__(self, scopes=None, token_file="token_calendar.json", credentials_file="credentials.json"):
-        if scopes is None:
-            scopes = Config.CALENDAR_SCOPES
-        self.creds = None
-        if os.path.exists(token_file):
-            self.creds = Credentials.from_authorized_user_file(token_file, scopes)
-        if not self.creds or not self.creds.valid:
-            if self.creds and self.creds.expired and self.creds.refresh_token:
-                self.creds.refresh(Request())
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(credentials_file, scopes)
-                self.creds = flow.run_local_server(port=0)
-            with open(token_file, "w") as token:
-                token.write(self.creds.to_json())
-        self.service = build("calendar", "v3", credentials=self.creds)
+    # Partial responses: only the parts of events and calendars we read
+    EVENT_FIELDS = ('timeZone,nextPageToken,items(id,status,summary,description,location,start,end,transparency,'
+                    'attendees(email,responseStatus,self),organizer(email),htmlLink,updated)')
+    CALENDAR_FIELDS = 'nextPageToken,items(id,summary,primary,selected,hidden,timeZone,accessRole)'
+    SYNC_FIELDS = 'nextSyncToken,' + EVENT_FIELDS
+    # Calendars per freebusy.query request
+    FREEBUSY_MAX_ITEMS = 50
+    
+    def __init__(self):
+        # Credentials, discovery document and transport are shared with GmailService
+        self.creds = google_clients.get_credentials()
+        self.service = google_clients.build_service('calendar', 'v3')
+        self._calendars: Optional[List[Dict[str, Any]]] = None
+        self._calendars_fetched = 0.0
+        self._calendars_lock = threading.Lock()
+        # Local event cache, kept current with sync tokens
+        self.store = EventStore() if Config.EVENT_CACHE_ENABLED else None
+        self._sync_lock = threading.Lock()
+        self._last_sync = None
+        # Set by SyncDaemon.register_calendar(): the daemon keeps the store current
+        self.background_sync = False
         
-    def get_events(self, calendar_id: str = 'primary', max_results: int = 10, 
-                   time_min: Optional[datetime] = None, time_max: Optional[datetime] = None) -> List[Dict[str, Any]]:
-        """Get calendar events"""
+    def list_calendars(self) -> List[Dict[str, Any]]:
+        """Calendars shown in the user's calendar list, primary first; cached for CALENDAR_LIST_TTL seconds"""
         try:
-            if not time_min:
-                time_min = datetime.now(timezone.utc)
-            if not time_max:
-                time_max = time_min + timedelta(days=30)
+            return self._listed_calendars()
+        except Exception as e:
+            print(f"Error listing calendars: {e}")
+            # Keep serving the last list we had, or at least the primary calendar
+            return self._calendars or [{'id': 'primary', 'primary': True}]
+    
+    def _listed_calendars(self) -> List[Dict[str, Any]]:
+        with self._calendars_lock:
+            if self._calendars is not None and time.monotonic() - self._calendars_fetched < Config.CALENDAR_LIST_TTL:
+                return self._calendars
+            calendars, page_token = [], None
+            while True:
+                result = self.service.calendarList().list(
+                    pageToken=page_token, fields=self.CALENDAR_FIELDS
+                ).execute()
+                calendars.extend(c for c in result.get('items', []) if c.get('selected') or c.get('primary'))
+                page_token = result.get('nextPageToken')
+                if not page_token:
+                    break
+            calendars.sort(key=lambda c: not c.get('primary'))
+            self._calendars, self._calendars_fetched = calendars, time.monotonic()
+            return calendars
+    
+    def sync(self, max_age: float = 0) -> Dict[str, Any]:
+        """Bring the local event cache up to date.
+        
+        Each listed calendar applies the changes since its stored sync token, so the cost is
+        proportional to what changed; a calendar is fully synced on first use or when Google has
+        expired its token (HTTP 410). Calendars removed from the list are dropped with their events.
+        Skipped if the last sync finished less than max_age seconds ago.
+        """
+        if self.store is None:
+            raise RuntimeError("The calendar cache is disabled (EVENT_CACHE_ENABLED=false)")
+        
+        with self._sync_lock:
+            if self._last_sync is not None and time.monotonic() - self._last_sync < max_age:
+                metrics.record_cache('calendar', True)
+                return {'mode': 'skipped'}
+            metrics.record_cache('calendar', False)
             
-            events_result = self.service.events().list(
+            with tracing.span('calendar.sync') as span:
+                # Raises rather than falling back, so a failed listing never drops cached calendars
+                calendars = self._listed_calendars()
+                result = {'mode': 'incremental', 'added': 0, 'updated': 0,
+                          'deleted': self.store.set_calendars(calendars), 'requests': 0}
+                workers = max(1, min(Config.CALENDAR_FETCH_WORKERS, len(calendars)))
+                with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='calendar-sync') as pool:
+                    futures = [pool.submit(tracing.wrap(self._sync_calendar), calendar) for calendar in calendars]
+                failed = []
+                for calendar, future in zip(calendars, futures):
+                    try:
+                        counts = future.result()
+                    except Exception as e:
+                        # The other calendars are still brought up to date
+                        print(f"Error syncing calendar {calendar['id']}: {e}")
+                        failed.append(e)
+                        continue
+                    if counts['mode'] == 'full':
+                        result['mode'] = 'full'
+                    for key in ('added', 'updated', 'deleted', 'requests'):
+                        result[key] += counts[key]
+                span.set_attribute('calendars', len(calendars))
+                span.set_attribute('failed', len(failed))
+                span.set_attribute('changes', result['added'] + result['updated'] + result['deleted'])
+            if calendars and len(failed) == len(calendars):
+                raise failed[0]
+            
+            self._last_sync = time.monotonic()
+            return result
+    
+    def _sync_for_read(self):
+        """Sync before answering from the store, unless the sync daemon already keeps it current"""
+        if self.background_sync and self._last_sync is not None:
+            return
+        self.sync(max_age=Config.EVENT_SYNC_MAX_AGE)
+    
+    def _sync_calendar(self, calendar: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply one calendar's changes since its sync token, or reload it if there is none"""
+        sync_token = self.store.sync_token(calendar['id'])
+        if sync_token:
+            try:
+                events, sync_token, time_zone, requests = self._list_all(calendar['id'], syncToken=sync_token)
+                counts = self.store.apply_changes(calendar['id'], events, sync_token, time_zone)
+                return dict(counts, mode='incremental', requests=requests)
+            except HttpError as e:
+                if e.resp.status != 410:
+                    raise
+                print(f"Sync token of calendar {calendar['id']} expired, running a full resync")
+        
+        # Listed without timeMin: sync tokens are only promised for listings an incremental sync
+        # can repeat, and a bounded one could leave the calendar without a token and never cached
+        window_start = (datetime.now(timezone.utc) - timedelta(days=Config.EVENT_SYNC_PAST_DAYS)).timestamp()
+        events, sync_token, time_zone, requests = self._list_all(calendar['id'])
+        if not sync_token:
+            print(f"No sync token for calendar {calendar['id']}; its events will be read from the API")
+        tz = calendar_timezone(time_zone)
+        events = [event for event in events
+                  if event.get('status') != 'cancelled' and event_bounds(event, tz)[1] > window_start]
+        counts = self.store.replace_events(calendar['id'], events, sync_token, window_start, time_zone)
+        return dict(counts, mode='full', requests=requests)
+    
+    def _list_all(self, calendar_id: str, **params) -> Tuple[List[Dict[str, Any]], Optional[str], Optional[str], int]:
+        """(events, nextSyncToken, time zone, requests made) for every page of an events.list query"""
+        events, page_token, requests = [], None, 0
+        while True:
+            result = self.service.events().list(
                 calendarId=calendar_id,
-                timeMin=time_min.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
-                timeMax=time_max.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
-                maxResults=max_results,
+                maxResults=Config.CALENDAR_PAGE_SIZE,
                 singleEvents=True,
-                orderBy='startTime'
+                pageToken=page_token,
+                fields=self.SYNC_FIELDS,
+                **params
             ).execute()
+            requests += 1
+            events.extend(result.get('items', []))
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                return events, result.get('nextSyncToken'), result.get('timeZone'), requests
+    
+    def get_events(self, calendar_id: Optional[str] = 'primary', max_results: Optional[int] = 10,
+                   time_min: Optional[datetime] = None, time_max: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Get calendar events in start order, following every page (max_results=None for all of them).
+        
+        calendar_id=None reads every calendar in the calendar list. Answered from the local event
+        cache when it covers the range, otherwise from the API.
+        """
+        if not time_min:
+            time_min = datetime.now(timezone.utc)
+        if not time_max:
+            time_max = time_min + timedelta(days=30)
+        calendar_ids = None if calendar_id is None else [calendar_id]
+        with tracing.span('calendar.get_events', calendar=calendar_id or 'all') as span:
+            events = self._cached_events(calendar_ids, time_min, time_max, max_results)
+            span.set_attribute('cached', events is not None)
+            if events is None:
+                with closing(self.iter_events(time_min, time_max, calendar_ids=calendar_ids,
+                                              max_results=max_results)) as stream:
+                    events = list(stream)
+            span.set_attribute('events', len(events))
+        return events
+    
+    def _cached_events(self, calendar_ids: Optional[List[str]], time_min: datetime, time_max: datetime,
+                       max_results: Optional[int]) -> Optional[List[Dict[str, Any]]]:
+        """Events from the local cache, or None if it does not cover the calendars and range"""
+        if self.store is None:
+            return None
+        try:
+            self._sync_for_read()
+        except Exception as e:
+            print(f"Error syncing calendars: {e}")
+            return None
+        try:
+            if calendar_ids is None:
+                calendar_ids = [calendar['id'] for calendar in self.store.calendars()]
+            else:
+                primary = self.store.primary_id()
+                calendar_ids = [primary if calendar_id == 'primary' and primary else calendar_id
+                                for calendar_id in calendar_ids]
+            if not self.store.covers(calendar_ids, time_min):
+                return None
+            return self.store.events_between(time_min, time_max, calendar_ids, max_results)
+        except Exception as e:
+            # e.g. a locked or corrupt cache file: the API can still answer
+            print(f"Error reading the event cache, falling back to the API: {e}")
+            return None
+    
+    def _store_changes(self, calendar_id: str, events: List[Dict[str, Any]]):
+        """Apply a change made through the API to the local cache now rather than at the next sync"""
+        if self.store is None:
+            return
+        if calendar_id == 'primary':
+            calendar_id = self.store.primary_id()
+        if calendar_id:
+            self.store.apply_changes(calendar_id, events)
+    
+    def iter_events(self, time_min: Optional[datetime] = None, time_max: Optional[datetime] = None,
+                    calendar_ids: Optional[List[str]] = None, max_results: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """Events of several calendars (default: all listed), merged by start time as pages arrive.
+        
+        The calendars are fetched concurrently, at most CALENDAR_FETCH_WORKERS at a time, and
+        each event gets a 'calendar_id'. A calendar that cannot be read is reported and skipped.
+        """
+        if not time_min:
+            time_min = datetime.now(timezone.utc)
+        if not time_max:
+            time_max = time_min + timedelta(days=30)
+        if calendar_ids is None:
+            calendars = self.list_calendars()
+        else:
+            listed = {c['id']: c for c in self._calendars or []}
+            calendars = [listed.get(calendar_id, {'id': calendar_id}) for calendar_id in calendar_ids]
+        
+        cancelled = threading.Event()
+        workers = max(1, min(Config.CALENDAR_FETCH_WORKERS, len(calendars)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='calendar-fetch') as pool:
+            # Unbounded queues: a fetch still waiting for a worker must never block the ones running
+            streams = []
+            for calendar in calendars:
+                pages = queue.Queue()
+                pool.submit(tracing.wrap(self._fetch_pages), calendar['id'], time_min, time_max,
+                            max_results, pages, cancelled)
+                streams.append(self._read_pages(calendar, pages))
             
-            events = events_result.get('items', [])
-            return events
-            
+            count = 0
+            try:
+                # Each calendar's events arrive in start order, so a k-way merge orders them all
+                for _, event in heapq.merge(*streams, key=lambda item: item[0]):
+                    yield event
+                    count += 1
+                    if max_results is not None and count >= max_results:
+                        break
+            finally:
+                # Stop fetching further pages once the caller has what it needs
+                cancelled.set()
+    
+    def _fetch_pages(self, calendar_id: str, time_min: datetime, time_max: datetime,
+                     max_results: Optional[int], pages: queue.Queue, cancelled: threading.Event):
+        """Put each page of a calendar's events on `pages`, then _DONE (or the exception that stopped it)"""
+        try:
+            page_token, fetched = None, 0
+            while not cancelled.is_set():
+                size = Config.CALENDAR_PAGE_SIZE if max_results is None else min(Config.CALENDAR_PAGE_SIZE,
+                                                                                  max_results - fetched)
+                result = self.service.events().list(
+                    calendarId=calendar_id,
+                    timeMin=time_min.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                    timeMax=time_max.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                    maxResults=size,
+                    singleEvents=True,
+                    orderBy='startTime',
+                    pageToken=page_token,
+                    fields=self.EVENT_FIELDS
+                ).execute()
+                pages.put(result)
+                fetched += len(result.get('items', []))
+                page_token = result.get('nextPageToken')
+                if not page_token or (max_results is not None and fetched >= max_results):
+                    break
+            pages.put(_DONE)
         except Exception as e:
-            print(f"Error fetching calendar events: {e}")
-            return []
+            pages.put(e)
+    
+    def _read_pages(self, calendar: Dict[str, Any], pages: queue.Queue) -> Iterator[Tuple[datetime, Dict[str, Any]]]:
+        """(start, event) for one calendar's events, as its pages arrive"""
+        tz = calendar_timezone(calendar.get('timeZone'))
+        while True:
+            page = pages.get()
+            if page is _DONE:
+                return
+            if isinstance(page, Exception):
+                print(f"Error fetching events of calendar {calendar['id']}: {page}")
+                return
+            tz = calendar_timezone(page.get('timeZone')) if page.get('timeZone') else tz
+            for event in page.get('items', []):
+                event['calendar_id'] = calendar['id']
+                yield event_start(event, tz), event
     
-    def get_today_events(self, calendar_id: str = 'primary') -> List[Dict[str, Any]]:
-        """Get today's events"""
+    def get_today_events(self, calendar_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get today's events (from every calendar by default)"""
         today = datetime.now(timezone.utc)
         tomorrow = today + timedelta(days=1)
         
         return self.get_events(
             calendar_id=calendar_id,
+            max_results=None,
             time_min=today,
             time_max=tomorrow
         )
     
-    def get_yesterday_events(self, calendar_id: str = 'primary') -> List[Dict[str, Any]]:
-        """Get yesterday's events"""
+    def get_yesterday_events(self, calendar_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get yesterday's events (from every calendar by default)"""
         yesterday = datetime.now(timezone.utc) - timedelta(days=1)
         today = datetime.now(timezone.utc)
         
         return self.get_events(
             calendar_id=calendar_id,
+            max_results=None,
             time_min=yesterday,
             time_max=today
         )
@@ -98,6 +355,7 @@ class CalendarService:
                 body=event,
                 sendUpdates='all'
             ).execute()
+            self._store_changes('primary', [event])
             
             return event
             
@@ -113,6 +371,7 @@ class CalendarService:
                 eventId=event_id,
                 sendUpdates='all'
             ).execute()
+            self._store_changes(calendar_id, [{'id': event_id, 'status': 'cancelled'}])
             return True
             
         except Exception as e:
@@ -138,6 +397,7 @@ class CalendarService:
                 body=event,
                 sendUpdates='all'
             ).execute()
+            self._store_changes(calendar_id, [updated_event])
             
             return updated_event
             
@@ -145,6 +405,110 @@ class CalendarService:
             print(f"Error updating event: {e}")
             return {}
     
+    def scheduling_timezone(self):
+        """Time zone for working hours: SCHEDULING_TIME_ZONE, else the primary calendar's"""
+        if Config.SCHEDULING_TIME_ZONE:
+            return calendar_timezone(Config.SCHEDULING_TIME_ZONE)
+        calendars = self.store.calendars() if self.store is not None else []
+        calendars = calendars or [{'time_zone': c.get('timeZone'), 'is_primary': c.get('primary')}
+                                  for c in self._calendars or []]
+        primary = next((c for c in calendars if c['is_primary']), {})
+        return calendar_timezone(primary.get('time_zone'))
+    
+    def busy_intervals(self, time_min: datetime, time_max: datetime) -> Dict[str, List[Tuple[float, float]]]:
+        """Busy (start, end) epoch seconds in each calendar the user owns, from the event cache when it has them"""
+        own = self._owned_calendar_ids()
+        busy: Dict[str, List[Tuple[float, float]]] = {}
+        for event in self.get_events(calendar_id=None, max_results=None, time_min=time_min, time_max=time_max):
+            if event['calendar_id'] in own and slot_finder.is_busy(event):
+                busy.setdefault(event['calendar_id'], []).append(event_bounds(event))
+        return busy
+    
+    def _owned_calendar_ids(self) -> set:
+        """The primary calendar and any other the user owns; shared and subscribed ones are not their busy time"""
+        own = {c['id'] for c in self.list_calendars() if c.get('primary') or c.get('accessRole') == 'owner'}
+        if 'primary' in own and self.store is not None:
+            # Calendar list unavailable: events cached under the primary calendar's real id still count
+            own.add(self.store.primary_id())
+        return own
+    
+    def query_free_busy(self, calendar_ids: List[str], time_min: datetime,
+                        time_max: datetime) -> Dict[str, List[Tuple[float, float]]]:
+        """Busy (start, end) epoch seconds of other people's calendars (usually their email addresses).
+        
+        Calendars Google has no free/busy information for are reported and left out.
+        """
+        busy: Dict[str, List[Tuple[float, float]]] = {}
+        for start in range(0, len(calendar_ids), self.FREEBUSY_MAX_ITEMS):
+            try:
+                result = self.service.freebusy().query(body={
+                    'timeMin': time_min.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                    'timeMax': time_max.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+                    'items': [{'id': calendar_id} for calendar_id in calendar_ids[start:start + self.FREEBUSY_MAX_ITEMS]],
+                }).execute()
+            except Exception as e:
+                print(f"Error querying free/busy: {e}")
+                continue
+            for calendar_id, info in result.get('calendars', {}).items():
+                if info.get('errors'):
+                    print(f"No free/busy information for {calendar_id}: {info['errors'][0].get('reason')}")
+                    continue
+                busy[calendar_id] = [(event_time({'dateTime': period['start']}).timestamp(),
+                                      event_time({'dateTime': period['end']}).timestamp())
+                                     for period in info.get('busy', [])]
+        return busy
+    
+    def _other_attendees(self, attendees: Optional[List[str]]) -> List[str]:
+        """Attendees that are not one of the user's own calendars, without duplicates"""
+        own = {c['id'] for c in self.store.calendars()} if self.store is not None else set()
+        own.update(c['id'] for c in self._calendars or [])
+        return [email for email in dict.fromkeys(attendees or []) if email not in own]
+    
+    def _busy(self, attendees: Optional[List[str]], time_min: datetime,
+              time_max: datetime) -> Dict[str, List[Tuple[float, float]]]:
+        busy = self.busy_intervals(time_min, time_max)
+        others = self._other_attendees(attendees)
+        if others:
+            busy.update(self.query_free_busy(others, time_min, time_max))
+        return busy
+    
+    def find_free_slots(self, duration_minutes: int = 60, attendees: List[str] = None,
+                        time_min: Optional[datetime] = None, time_max: Optional[datetime] = None,
+                        max_results: Optional[int] = None) -> Dict[str, Any]:
+        """The earliest times, within working hours, when the user and every attendee are free.
+        
+        Returns {'slots': [{'start', 'end'}], 'time_zone', 'unknown'}, where 'unknown' lists
+        attendees whose calendars could not be read (their conflicts are not taken into account).
+        """
+        tz = self.scheduling_timezone()
+        now = datetime.now(timezone.utc)
+        time_min = max(time_min or now, now)
+        time_max = time_max or time_min + timedelta(days=Config.SCHEDULING_SEARCH_DAYS)
+        with tracing.span('calendar.find_free_slots', attendees=len(attendees or []),
+                          duration_minutes=duration_minutes) as span:
+            busy = self._busy(attendees, time_min, time_max)
+            slots = slot_finder.find_slots(
+                busy, time_min, time_max, timedelta(minutes=duration_minutes), tz,
+                slot_finder.parse_clock(Config.WORKING_HOURS_START), slot_finder.parse_clock(Config.WORKING_HOURS_END),
+                Config.WORKING_DAYS, timedelta(minutes=Config.SCHEDULING_STEP_MINUTES),
+                max_results or Config.SCHEDULING_MAX_SLOTS
+            )
+            span.set_attribute('busy_intervals', sum(len(intervals) for intervals in busy.values()))
+            span.set_attribute('slots', len(slots))
+        return {
+            'slots': [{'start': datetime.fromtimestamp(start, tz), 'end': datetime.fromtimestamp(end, tz)}
+                      for start, end in slots],
+            'time_zone': str(tz),
+            'unknown': [email for email in self._other_attendees(attendees) if email not in busy],
+        }
+    
+    def busy_calendars(self, start_time: datetime, end_time: datetime, attendees: List[str] = None) -> List[str]:
+        """The user's calendars and attendees that already have something between start_time and end_time"""
+        busy = self._busy(attendees, start_time, end_time)
+        start, end = start_time.timestamp(), end_time.timestamp()
+        return [calendar_id for calendar_id, intervals in busy.items()
+                if any(busy_start < end and busy_end > start for busy_start, busy_end in intervals)]
+    
     def schedule_meeting(self, summary: str, start_time: datetime, duration_minutes: int = 60,
                         attendees: List[str] = None, description: str = "") -> Dict[str, Any]:
         """Schedule a meeting with attendees"""
@@ -169,7 +533,7 @@ class CalendarService:
             start = event['start'].get('dateTime', event['start'].get('date'))
             end = event['end'].get('dateTime', event['end'].get('date'))
             
-            formatted += f"**{event['summary']}**\n"
+            formatted += f"**{event.get('summary', '(busy)')}**\n"
             formatted += f"📅 {start} - {end}\n"
             
             if event.get('location'):
@@ -183,4 +547,16 @@ class CalendarService:
             
             formatted += "\n"
         
+        return formatted
+    
+    def format_slots_for_display(self, result: Dict[str, Any]) -> str:
+        """Format find_free_slots() results for display"""
+        if not result['slots']:
+            formatted = "❌ No free time found in working hours."
+        else:
+            formatted = f"🗓️ **Free times ({result['time_zone']}):**\n\n"
+            for slot in result['slots']:
+                formatted += f"• {slot['start'].strftime('%a %d %b, %H:%M')} - {slot['end'].strftime('%H:%M')}\n"
+        if result['unknown']:
+            formatted += f"\n⚠️ Could not see the calendars of: {', '.join(result['unknown'])}"
         return formatted 
\ No newline at end of file
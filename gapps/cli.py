@@ -6,12 +6,16 @@ Command Line Interface for Personal Assistant
 import argparse
 import sys
 from ai_assistant import AIAssistant
+from batch_runner import run_batch_file, default_output_path
 from config import Config
 
 def main():
     parser = argparse.ArgumentParser(description="Personal Assistant CLI")
     parser.add_argument("--query", "-q", help="Your query to the assistant")
     parser.add_argument("--interactive", "-i", action="store_true", help="Run in interactive mode")
+    parser.add_argument("--batch", "-b", help="Run every query in a JSONL file")
+    parser.add_argument("--output", "-o", help="Where to write batch results (JSONL)")
+    parser.add_argument("--no-resume", action="store_true", help="Overwrite batch output instead of resuming")
     
     args = parser.parse_args()
     
@@ -27,6 +31,14 @@ def main():
             response = assistant.process_user_query(args.query)
             print(f"\n🤖 Response:\n{response}")
             
+        elif args.batch:
+            # Batch mode
+            output_path = args.output or default_output_path(args.batch)
+            print(f"\n📂 Batch input: {args.batch}")
+            print(f"📝 Results: {output_path}")
+            stats = run_batch_file(assistant, args.batch, output_path, resume=not args.no_resume)
+            print(f"\n✅ Batch complete: {stats['processed']} processed, {stats['skipped']} skipped")
+            
         elif args.interactive:
             # Interactive mode
             print("\n🤖 Personal Assistant is ready!")
@@ -60,7 +72,7 @@ def main():
                     print(f"❌ Error: {e}")
                     
         else:
-            print("❌ Please provide a query with --query or run in interactive mode with --interactive")
+            print("❌ Please provide a query with --query, a file with --batch, or run in interactive mode with --interactive")
             print_help()
             sys.exit(1)
             
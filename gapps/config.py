@@ -14,11 +14,136 @@ class Config:
     MAX_SEQ_LENGTH = int(os.getenv('MAX_SEQ_LENGTH', '4096'))
     MAX_NEW_TOKENS = int(os.getenv('MAX_NEW_TOKENS', '1024'))
     
+    # Inference backend: 'unsloth' loads the model, 'stub' fakes it for load testing
+    INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'unsloth')
+    STUB_PREFILL_MS = float(os.getenv('STUB_PREFILL_MS', '50'))
+    STUB_MS_PER_TOKEN = float(os.getenv('STUB_MS_PER_TOKEN', '2'))
+    STUB_TOKENS = int(os.getenv('STUB_TOKENS', '64'))
+    
+    # Batch processing
+    BATCH_SIZE = int(os.getenv('BATCH_SIZE', '8'))
+    BATCH_IO_WORKERS = int(os.getenv('BATCH_IO_WORKERS', '4'))
+    BATCH_CHUNK_SIZE = int(os.getenv('BATCH_CHUNK_SIZE', '256'))
+    
+    # Background jobs
+    JOB_DIR = os.getenv('JOB_DIR', 'jobs')
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+    # Needed (as X-Job-Token) to submit jobs that send mail or read server files; those kinds are off unless set
+    JOB_TOKEN = os.getenv('JOB_TOKEN')
+    
+    # Tracing ('jsonl', 'otlp' or 'none')
+    TRACE_EXPORTER = os.getenv('TRACE_EXPORTER', 'jsonl')
+    TRACE_FILE = os.getenv('TRACE_FILE', 'traces/spans.jsonl')
+    TRACE_FILE_MAX_BYTES = int(os.getenv('TRACE_FILE_MAX_BYTES', str(20 * 1024 * 1024)))
+    TRACE_FILE_BACKUPS = int(os.getenv('TRACE_FILE_BACKUPS', '3'))
+    TRACE_OTLP_ENDPOINT = os.getenv('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
+    TRACE_SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'personal-assistant')
+    
+    # On-demand profiler (disabled unless PROFILER_TOKEN is set)
+    PROFILER_TOKEN = os.getenv('PROFILER_TOKEN')
+    PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+    PROFILER_INTERVAL_MS = float(os.getenv('PROFILER_INTERVAL_MS', '5'))
+    PROFILER_MAX_SECONDS = float(os.getenv('PROFILER_MAX_SECONDS', '120'))
+    PROFILER_MAX_PER_MINUTE = int(os.getenv('PROFILER_MAX_PER_MINUTE', '6'))
+    PROFILER_TTL_SECONDS = int(os.getenv('PROFILER_TTL_SECONDS', '600'))
+    
     # File paths
     CREDENTIALS_FILE = os.getenv('CREDENTIALS_FILE', 'credentials.json')
-    #TOKEN_FILE = os.getenv('TOKEN_FILE', 'token.json')
+    # One token with the Gmail and Calendar scopes, shared by both services
+    TOKEN_FILE = os.getenv('TOKEN_FILE', 'token.json')
+    # Refresh the access token in the background this many seconds before it expires
+    TOKEN_REFRESH_MARGIN = float(os.getenv('TOKEN_REFRESH_MARGIN', '600'))
+    DISCOVERY_CACHE_DIR = os.getenv('DISCOVERY_CACHE_DIR', '.discovery_cache')
+    GOOGLE_HTTP_TIMEOUT = float(os.getenv('GOOGLE_HTTP_TIMEOUT', '60'))
+    # Concurrent connections to Google APIs shared by all request threads
+    GOOGLE_HTTP_POOL_SIZE = int(os.getenv('GOOGLE_HTTP_POOL_SIZE', '10'))
+    # Seconds a request waits for a free connection when all of them are busy
+    GOOGLE_HTTP_POOL_WAIT = float(os.getenv('GOOGLE_HTTP_POOL_WAIT', '30'))
     EMAIL_MARKDOWN_DIR = os.getenv('EMAIL_MARKDOWN_DIR', 'emails')
     
+    # Gmail batch requests (Gmail accepts up to 100, but rate-limits large batches)
+    GMAIL_BATCH_SIZE = int(os.getenv('GMAIL_BATCH_SIZE', '50'))
+
+    # Gmail allows 250 quota units per user per second; bulk operations share this budget
+    GMAIL_QUOTA_UNITS_PER_SECOND = float(os.getenv('GMAIL_QUOTA_UNITS_PER_SECOND', '250'))
+    GMAIL_QUOTA_BURST = float(os.getenv('GMAIL_QUOTA_BURST', '250'))
+    RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', '5'))
+    RETRY_BASE_SECONDS = float(os.getenv('RETRY_BASE_SECONDS', '1'))
+    RETRY_MAX_SECONDS = float(os.getenv('RETRY_MAX_SECONDS', '32'))
+    BULK_SEND_WORKERS = int(os.getenv('BULK_SEND_WORKERS', '4'))
+    
+    # Attachment downloads are streamed to disk in chunks of this many bytes
+    ATTACHMENT_CHUNK_SIZE = int(os.getenv('ATTACHMENT_CHUNK_SIZE', str(256 * 1024)))
+    ATTACHMENT_TIMEOUT = float(os.getenv('ATTACHMENT_TIMEOUT', '120'))
+    ATTACHMENT_DIR = os.getenv('ATTACHMENT_DIR', 'attachments')
+    ATTACHMENT_EXPORT_WORKERS = int(os.getenv('ATTACHMENT_EXPORT_WORKERS', '8'))
+    
+    # Calendar reads: every calendar in the calendar list is fetched concurrently, all pages
+    CALENDAR_FETCH_WORKERS = int(os.getenv('CALENDAR_FETCH_WORKERS', '8'))
+    CALENDAR_PAGE_SIZE = int(os.getenv('CALENDAR_PAGE_SIZE', '2500'))  # the API maximum
+    CALENDAR_LIST_TTL = float(os.getenv('CALENDAR_LIST_TTL', '300'))
+
+    # Local calendar cache, kept current with Calendar API sync tokens
+    EVENT_CACHE_ENABLED = os.getenv('EVENT_CACHE_ENABLED', 'true').lower() == 'true'
+    EVENT_CACHE_PATH = os.getenv('EVENT_CACHE_PATH', 'event_cache.sqlite3')
+    EVENT_SYNC_MAX_AGE = float(os.getenv('EVENT_SYNC_MAX_AGE', '30'))
+    # A full sync keeps events from this many days back onwards; older ranges go to the API
+    EVENT_SYNC_PAST_DAYS = int(os.getenv('EVENT_SYNC_PAST_DAYS', '365'))
+
+    # Meeting slot finder: working hours in SCHEDULING_TIME_ZONE (default: the primary calendar's)
+    WORKING_HOURS_START = os.getenv('WORKING_HOURS_START', '09:00')
+    WORKING_HOURS_END = os.getenv('WORKING_HOURS_END', '17:00')
+    # Days with working hours, Monday = 0
+    WORKING_DAYS = [int(day) for day in os.getenv('WORKING_DAYS', '0,1,2,3,4').split(',') if day.strip()]
+    SCHEDULING_TIME_ZONE = os.getenv('SCHEDULING_TIME_ZONE')
+    SCHEDULING_SEARCH_DAYS = int(os.getenv('SCHEDULING_SEARCH_DAYS', '7'))
+    SCHEDULING_STEP_MINUTES = int(os.getenv('SCHEDULING_STEP_MINUTES', '15'))
+    SCHEDULING_MAX_SLOTS = int(os.getenv('SCHEDULING_MAX_SLOTS', '5'))
+    # Offer free times instead of creating an event that clashes with busy time
+    SCHEDULING_AVOID_CONFLICTS = os.getenv('SCHEDULING_AVOID_CONFLICTS', 'true').lower() == 'true'
+
+    # Local mailbox cache, kept current from the Gmail history
+    MAIL_CACHE_ENABLED = os.getenv('MAIL_CACHE_ENABLED', 'true').lower() == 'true'
+    MAIL_CACHE_PATH = os.getenv('MAIL_CACHE_PATH', 'mail_cache.sqlite3')
+    MAIL_SYNC_MAX_MESSAGES = int(os.getenv('MAIL_SYNC_MAX_MESSAGES', '500'))
+    MAIL_SYNC_MAX_AGE = float(os.getenv('MAIL_SYNC_MAX_AGE', '15'))
+    # Download bodies while syncing so full-text search covers them
+    MAIL_SYNC_BODIES = os.getenv('MAIL_SYNC_BODIES', 'true').lower() == 'true'
+    # Characters of de-quoted thread text sent to the model for a thread summary
+    THREAD_SUMMARY_MAX_CHARS = int(os.getenv('THREAD_SUMMARY_MAX_CHARS', '6000'))
+    
+    # Mailbox import from mbox/.eml exports (0 workers: one per CPU)
+    IMPORT_WORKERS = int(os.getenv('IMPORT_WORKERS', '0'))
+    IMPORT_BATCH_BYTES = int(os.getenv('IMPORT_BATCH_BYTES', str(1024 * 1024)))
+    
+    # Email digest: emails are summarized several to a prompt
+    DIGEST_MAX_EMAILS = int(os.getenv('DIGEST_MAX_EMAILS', '50'))
+    DIGEST_BATCH_TOKENS = int(os.getenv('DIGEST_BATCH_TOKENS', '2048'))
+    DIGEST_BATCH_EMAILS = int(os.getenv('DIGEST_BATCH_EMAILS', '12'))
+    DIGEST_EMAIL_MAX_TOKENS = int(os.getenv('DIGEST_EMAIL_MAX_TOKENS', '300'))
+    
+    # Semantic email search: embeddings of cached mail in a memory-mapped float16 matrix
+    # ('sentence-transformers' runs EMBEDDING_MODEL, 'hashing' needs no model, for load testing;
+    # 'auto' uses sentence-transformers when it is installed and hashing otherwise)
+    EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'auto')
+    EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'sentence-transformers/all-MiniLM-L6-v2')
+    EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '64'))
+    EMBEDDING_MAX_CHARS = int(os.getenv('EMBEDDING_MAX_CHARS', '2000'))
+    VECTOR_INDEX_DIR = os.getenv('VECTOR_INDEX_DIR', 'mail_vectors')
+    # Brute-force search below this many vectors, clustered (IVF) search above it
+    VECTOR_IVF_MIN_VECTORS = int(os.getenv('VECTOR_IVF_MIN_VECTORS', '50000'))
+    VECTOR_IVF_PROBES = int(os.getenv('VECTOR_IVF_PROBES', '16'))
+    VECTOR_IVF_ITERATIONS = int(os.getenv('VECTOR_IVF_ITERATIONS', '10'))
+    # Rewrite the matrix once this share of its rows belong to deleted or re-embedded mail
+    VECTOR_COMPACT_RATIO = float(os.getenv('VECTOR_COMPACT_RATIO', '0.25'))
+    
+    # Background sync daemon keeping the local stores warm (web servers)
+    SYNC_DAEMON_ENABLED = os.getenv('SYNC_DAEMON_ENABLED', 'true').lower() == 'true'
+    SYNC_MIN_INTERVAL = float(os.getenv('SYNC_MIN_INTERVAL', '15'))
+    SYNC_MAX_INTERVAL = float(os.getenv('SYNC_MAX_INTERVAL', '300'))
+    # Share of the Gmail quota background sync may use
+    SYNC_QUOTA_UNITS_PER_SECOND = float(os.getenv('SYNC_QUOTA_UNITS_PER_SECOND', '25'))
+    
     # API scopes
     GMAIL_SCOPES = [
         'https://www.googleapis.com/auth/gmail.readonly',
@@ -30,7 +155,13 @@ class Config:
         'https://www.googleapis.com/auth/calendar',
         'https://www.googleapis.com/auth/calendar.events'
     ]
+    GOOGLE_SCOPES = GMAIL_SCOPES + CALENDAR_SCOPES
+    
+    # Point Gmail/Calendar at a local fake API (load testing); skips OAuth when set
+    GOOGLE_API_ENDPOINT = os.getenv('GOOGLE_API_ENDPOINT')
     
     # Server configuration
     HOST = os.getenv('HOST', 'localhost')
-    PORT = int(os.getenv('PORT', '8000')) 
+    PORT = int(os.getenv('PORT', '8000'))
+    BRIDGE_PORT = int(os.getenv('BRIDGE_PORT', '5000'))  # run.py (Flask bridge for the frontend)
+
@@ -0,0 +1,219 @@
+"""
+OAuth credential manager
+
+Owns the Google user token for the whole process. A background thread
+refreshes the access token TOKEN_REFRESH_MARGIN seconds before it expires
+(earlier than google-auth's own refresh threshold), so API calls always
+find a valid token and never refresh on the request path. Refreshes are
+single-flight: threads that need one while another is in progress wait
+for it instead of starting their own. Tokens are written to the token
+file atomically, so a crash mid-write cannot leave it truncated.
+"""
+
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime, timezone
+from typing import List, Optional
+from google.auth.exceptions import RefreshError
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+from config import Config
+import metrics
+import rate_limit
+
+# Upper bound on one background sleep, so a token without an expiry is still rechecked
+MAX_REFRESH_WAIT = 3600
+# Per-service tokens written by older versions of oauth.py, each with only that service's scopes
+LEGACY_TOKEN_FILES = ('token_gmail.json', 'token_calendar.json')
+
+
+class ManagedCredentials(Credentials):
+    """User credentials whose refreshes are serialized and reported to the manager"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._single_flight = threading.Lock()
+        self.on_refresh = None
+
+    def refresh(self, request):
+        token = self.token
+        with self._single_flight:
+            if self.token != token and self.valid:
+                # Another thread refreshed while this one was waiting
+                return
+            try:
+                super().refresh(request)
+            except Exception:
+                metrics.OAUTH_REFRESHES.inc(result='failed')
+                raise
+            metrics.OAUTH_REFRESHES.inc(result='ok')
+            if self.on_refresh:
+                self.on_refresh(self)
+
+
+class CredentialManager:
+    def __init__(self, scopes: List[str] = None, token_file: str = None, refresh_margin: float = None):
+        self.scopes = scopes or Config.GOOGLE_SCOPES
+        self.token_file = token_file or Config.TOKEN_FILE
+        self.refresh_margin = Config.TOKEN_REFRESH_MARGIN if refresh_margin is None else refresh_margin
+        self.credentials: Optional[ManagedCredentials] = None
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def authenticate(self) -> ManagedCredentials:
+        """Valid credentials from the token file, refreshing them if needed; runs the OAuth flow only
+        when there is no token yet"""
+        with self._lock:
+            if self.credentials is None:
+                creds = self.load()
+                if creds is None:
+                    self._check_legacy_tokens()
+                    print("Getting new credentials...")
+                    creds = self.run_flow()
+                self.credentials = creds
+            if not self.credentials.valid:
+                try:
+                    self.refresh(force=True)
+                except RefreshError as e:
+                    # The refresh token was revoked or has expired; only a new consent can fix that,
+                    # and a server may have no browser to give it in
+                    raise RuntimeError(
+                        f"The Google token in {self.token_file} can no longer be refreshed ({e}). "
+                        "Run `python oauth.py` to sign in again."
+                    ) from e
+            return self.credentials
+
+    def _check_legacy_tokens(self):
+        """Refuse to start a browser flow when only the old per-service tokens exist, e.g. on a headless server"""
+        directory = os.path.dirname(os.path.abspath(self.token_file))
+        legacy = [name for name in LEGACY_TOKEN_FILES if os.path.exists(os.path.join(directory, name))]
+        if legacy:
+            raise RuntimeError(
+                f"Found {', '.join(legacy)} from an older version, but Gmail and Calendar now share one token "
+                f"with both scopes in {self.token_file}. Run `python oauth.py` to create it."
+            )
+
+    def load(self) -> Optional[ManagedCredentials]:
+        """Credentials from the token file, or None if it is missing or has no refresh token"""
+        if not os.path.exists(self.token_file):
+            return None
+        try:
+            creds = ManagedCredentials.from_authorized_user_file(self.token_file, self.scopes)
+        except Exception as e:
+            print(f"Error loading credentials from {self.token_file}: {e}")
+            return None
+        if not creds.refresh_token:
+            print(f"No refresh token found in {self.token_file}, regenerating...")
+            return None
+        print(f"Loaded credentials from {self.token_file}")
+        creds.on_refresh = self.save
+        return creds
+
+    def run_flow(self, port: int = 0) -> ManagedCredentials:
+        """Run the browser OAuth flow and save the resulting token"""
+        if not os.path.exists(Config.CREDENTIALS_FILE):
+            raise FileNotFoundError(
+                f"Credentials file '{Config.CREDENTIALS_FILE}' not found. "
+                "Please download it from Google Cloud Console."
+            )
+        flow = InstalledAppFlow.from_client_secrets_file(Config.CREDENTIALS_FILE, self.scopes)
+        # Ensure we get refresh tokens
+        flow_creds = flow.run_local_server(port=port, access_type='offline', prompt='consent')
+        creds = ManagedCredentials.from_authorized_user_info(json.loads(flow_creds.to_json()), self.scopes)
+        creds.on_refresh = self.save
+        self.save(creds)
+        print(f"Saved new credentials to {self.token_file}")
+        self.credentials = creds
+        return creds
+
+    def save(self, creds: Credentials):
+        """Write the token file atomically (temporary file, fsync, rename), readable only by the owner"""
+        directory = os.path.dirname(os.path.abspath(self.token_file))
+        with self._save_lock:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.token-', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(creds.to_json())
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.chmod(tmp_path, 0o600)
+                os.replace(tmp_path, self.token_file)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    def seconds_until_refresh(self) -> float:
+        """How long until the token should be refreshed; 0 when it is due now"""
+        creds = self.credentials
+        if creds is None or not creds.token:
+            return 0
+        if creds.expiry is None:
+            return float('inf')
+        # google-auth keeps expiry as naive UTC
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return max((creds.expiry - now).total_seconds() - self.refresh_margin, 0)
+
+    def refresh(self, force: bool = False):
+        """Refresh the access token if it is within the refresh margin of expiring (or always if force)"""
+        if force or self.seconds_until_refresh() == 0:
+            self.credentials.refresh(Request())
+
+    def start(self) -> 'CredentialManager':
+        """Start refreshing in the background; the first refresh happens before this returns if one is due"""
+        self.authenticate()
+        with self._lock:
+            if self._thread is None:
+                self.refresh()
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='credential-refresh', daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        failures = 0
+        while not self._stop.is_set():
+            if self._stop.wait(min(self.seconds_until_refresh(), MAX_REFRESH_WAIT)):
+                return
+            try:
+                self.refresh()
+                failures = 0
+            except Exception as e:
+                # The token is still good until it expires; keep retrying with backoff
+                print(f"Error refreshing Google credentials: {e}")
+                self._stop.wait(rate_limit.backoff_delay(failures))
+                failures += 1
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager(start: bool = True) -> CredentialManager:
+    """The process-wide manager for Config.TOKEN_FILE, with background refresh running unless start=False"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = CredentialManager()
+            metrics.OAUTH_TOKEN_TTL.set_function(lambda: _token_ttl(_manager))
+        if start:
+            _manager.start()
+        return _manager
+
+
+def _token_ttl(manager: CredentialManager) -> Optional[float]:
+    creds = manager.credentials
+    if creds is None or creds.expiry is None:
+        return None
+    return (creds.expiry - datetime.now(timezone.utc).replace(tzinfo=None)).total_seconds()
@@ -0,0 +1,138 @@
+"""
+Batched email digest
+
+Summarizes many emails in a few model passes. Bodies are cleaned first
+(quoted history, signatures, links and extra whitespace removed), then
+packed into prompts of at most DIGEST_BATCH_TOKENS tokens and
+DIGEST_BATCH_EMAILS emails, each asking for one numbered line per email.
+The prompts are generated together in batches of BATCH_SIZE, so a 50-email
+digest costs one or two model passes. Summaries are cached per message id
+and model in the mailbox cache, so a repeated digest only summarizes new
+mail.
+"""
+
+import re
+from typing import Any, Callable, Dict, List, Tuple
+from config import Config
+import metrics
+import mime_utils
+import tracing
+
+# Signature delimiters and mobile footers; everything from here on is dropped
+SIGNATURE = re.compile(r'^(-- ?|__+|Sent from my .+|Get Outlook for .+)\s*$', re.MULTILINE)
+URL = re.compile(r'https?://\S+')
+
+PROMPT_HEADER = (
+    "Summarize each email below in one short sentence: what it is about and anything the reader "
+    "needs to do. Answer with exactly one line per email, in the form \"<number>: <summary>\".\n\n"
+)
+SUMMARY_LINE = re.compile(r'^\W*(\d+)\s*[:.)\]-]\s*(.+)$')
+
+
+def clean_body(text: str) -> str:
+    """The part of an email body worth summarizing"""
+    text = mime_utils.collapse_quotes(text or '')
+    text = text.replace(mime_utils.QUOTED_MARKER, '')
+    match = SIGNATURE.search(text)
+    if match:
+        text = text[:match.start()]
+    text = URL.sub('[link]', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def approximate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token) for when no tokenizer is loaded"""
+    return len(text) // 4 + 1
+
+
+class EmailDigest:
+    def __init__(self, gmail_service, generate: Callable[[List[str]], List[str]],
+                 count_tokens: Callable[[str], int] = None, model_name: str = None):
+        self.gmail = gmail_service
+        self.generate = generate
+        self.count_tokens = count_tokens or approximate_tokens
+        self.model_name = model_name or Config.MODEL_NAME
+
+    def build(self, max_results: int = None, query: str = None, progress=None) -> Dict[str, Any]:
+        """Summarize the newest emails (inbox by default); returns the emails with a 'summary' each"""
+        emails = self.gmail.list_emails(max_results=max_results or Config.DIGEST_MAX_EMAILS, query=query)
+        result = self.summarize(emails, progress=progress)
+        result['emails'] = emails
+        return result
+
+    def summarize(self, emails: List[Dict[str, Any]], progress=None) -> Dict[str, Any]:
+        """Add a 'summary' to every email, generating only those not already cached"""
+        with tracing.span('digest.summarize', emails=len(emails)) as span:
+            store = self.gmail.store
+            cached = store.get_summaries([e['id'] for e in emails], self.model_name) if store else {}
+            for email_data in emails:
+                metrics.record_cache('mail_summary', email_data['id'] in cached)
+                if email_data['id'] in cached:
+                    email_data['summary'] = cached[email_data['id']]
+
+            pending = [e for e in emails if 'summary' not in e]
+            self.gmail.fetch_bodies(pending)
+            batches = self.pack(pending)
+            passes = 0
+            for start in range(0, len(batches), Config.BATCH_SIZE):
+                chunk = batches[start:start + Config.BATCH_SIZE]
+                outputs = self.generate([self._prompt(batch) for batch in chunk])
+                passes += 1
+                generated = {}
+                for batch, output in zip(chunk, outputs):
+                    generated.update(self._parse(batch, output))
+                for email_data, _ in (entry for batch in chunk for entry in batch):
+                    # An email the model skipped falls back to its snippet and is not cached
+                    email_data['summary'] = generated.get(email_data['id'], email_data.get('snippet', ''))
+                if store and generated:
+                    store.set_summaries(generated, self.model_name)
+                if progress:
+                    progress(min(start + len(chunk), len(batches)), len(batches))
+
+            span.set_attribute('cached', len(emails) - len(pending))
+            span.set_attribute('batches', len(batches))
+            span.set_attribute('model_passes', passes)
+        return {'cached': len(emails) - len(pending), 'generated': len(pending),
+                'batches': len(batches), 'model_passes': passes}
+
+    def pack(self, emails: List[Dict[str, Any]]) -> List[List[Tuple[Dict[str, Any], str]]]:
+        """Split emails, in order, into batches of (email, prompt text) that fit the token budget"""
+        budget = Config.DIGEST_BATCH_TOKENS - self.count_tokens(PROMPT_HEADER)
+        batches, current, used = [], [], 0
+        for email_data in emails:
+            text = self._entry(email_data)
+            tokens = self.count_tokens(text)
+            if current and (used + tokens > budget or len(current) >= Config.DIGEST_BATCH_EMAILS):
+                batches.append(current)
+                current, used = [], 0
+            current.append((email_data, text))
+            used += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _entry(self, email_data: Dict[str, Any]) -> str:
+        body = clean_body(email_data.get('body') or email_data.get('snippet', ''))
+        # Long emails are cut so one message cannot take over a batch
+        limit = Config.DIGEST_EMAIL_MAX_TOKENS * 4
+        if len(body) > limit:
+            body = body[:limit].rsplit(' ', 1)[0] + ' …'
+        return f"Subject: {email_data['subject']}\nFrom: {email_data['sender']}\n{body}"
+
+    def _prompt(self, batch: List[Tuple[Dict[str, Any], str]]) -> str:
+        entries = '\n\n'.join(f"{n}. {text}" for n, (_, text) in enumerate(batch, 1))
+        return f"{PROMPT_HEADER}{entries}\n\nSummaries:\n"
+
+    def _parse(self, batch: List[Tuple[Dict[str, Any], str]], output: str) -> Dict[str, str]:
+        """Map the model's numbered lines back to message ids"""
+        summaries = {}
+        for line in output.splitlines():
+            match = SUMMARY_LINE.match(line.strip())
+            if match and 1 <= int(match.group(1)) <= len(batch):
+                summaries[batch[int(match.group(1)) - 1][0]['id']] = match.group(2).strip()
+        return summaries
+
+
+def format_digest(emails: List[Dict[str, Any]]) -> str:
+    return "\n".join(f"• {email_data['subject']} (from {email_data['sender']})\n  {email_data.get('summary', '')}"
+                     for email_data in emails)
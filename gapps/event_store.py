@@ -0,0 +1,228 @@
+"""
+Local SQLite calendar cache
+
+Holds every event of each synced calendar, keyed by (calendar id, event id),
+with its start and end as epoch seconds so time-range queries are answered
+from two indexes instead of the Calendar API. Each calendar keeps the
+syncToken that CalendarService.sync() uses for incremental updates and the
+start of the window its full sync covered.
+
+An event overlaps [a, b) when start < b and end > a. No index answers both
+bounds, so the start index is scanned from a - (the longest event's
+duration) and the end bound is checked per row; the longest duration is
+kept in memory and only grows between full syncs.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+from config import Config
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calendars (
+    id TEXT PRIMARY KEY,
+    summary TEXT,
+    time_zone TEXT,
+    is_primary INTEGER NOT NULL DEFAULT 0,
+    sync_token TEXT,
+    -- Events ending before this were not synced
+    window_start REAL,
+    synced_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS events (
+    calendar_id TEXT NOT NULL REFERENCES calendars (id) ON DELETE CASCADE,
+    id TEXT NOT NULL,
+    start_ts REAL NOT NULL,
+    end_ts REAL NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (calendar_id, id)
+);
+CREATE INDEX IF NOT EXISTS events_start ON events (start_ts);
+CREATE INDEX IF NOT EXISTS events_end ON events (end_ts);
+"""
+
+
+def calendar_timezone(name: Optional[str]):
+    try:
+        return ZoneInfo(name) if name else timezone.utc
+    except Exception:
+        return timezone.utc
+
+
+def event_time(when: Dict[str, str], tz=timezone.utc) -> datetime:
+    """An event's start or end as an aware datetime; all-day dates are midnight in tz"""
+    if 'dateTime' in when:
+        return datetime.fromisoformat(when['dateTime'].replace('Z', '+00:00'))
+    return datetime.fromisoformat(when['date']).replace(tzinfo=tz)
+
+
+def event_bounds(event: Dict[str, Any], tz=timezone.utc) -> Tuple[float, float]:
+    """(start, end) of an event in epoch seconds"""
+    start = event_time(event['start'], tz).timestamp()
+    end = event_time(event['end'], tz).timestamp() if event.get('end') else start
+    return start, max(start, end)
+
+
+class EventStore:
+    def __init__(self, path: str = None):
+        self.path = path or Config.EVENT_CACHE_PATH
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # One connection shared by all threads, serialized by a lock
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            self._conn.executescript(SCHEMA)
+            self._max_duration = self._longest_event()
+
+    def _longest_event(self) -> float:
+        row = self._conn.execute("SELECT MAX(end_ts - start_ts) AS duration FROM events").fetchone()
+        return row['duration'] or 0.0
+
+    def calendars(self) -> List[Dict[str, Any]]:
+        """Cached calendars, primary first"""
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM calendars ORDER BY is_primary DESC, id").fetchall()
+            return [dict(row) for row in rows]
+
+    def set_calendars(self, calendars: List[Dict[str, Any]]) -> int:
+        """Record the synced calendars and drop any no longer listed, with their events; returns
+        how many events were dropped"""
+        with self._lock, self._conn:
+            for calendar in calendars:
+                self._conn.execute(
+                    """
+                    INSERT INTO calendars (id, summary, time_zone, is_primary) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (id) DO UPDATE SET
+                        summary = excluded.summary,
+                        time_zone = COALESCE(excluded.time_zone, calendars.time_zone),
+                        is_primary = excluded.is_primary
+                    """,
+                    (calendar['id'], calendar.get('summary'), calendar.get('timeZone'), int(bool(calendar.get('primary'))))
+                )
+            listed = [calendar['id'] for calendar in calendars]
+            placeholders = ', '.join('?' * len(listed))
+            dropped = self._conn.execute(
+                f"SELECT COUNT(*) FROM events WHERE calendar_id NOT IN ({placeholders})", listed
+            ).fetchone()[0]
+            self._conn.execute(f"DELETE FROM calendars WHERE id NOT IN ({placeholders})", listed)
+            return dropped
+
+    def primary_id(self) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT id FROM calendars WHERE is_primary = 1").fetchone()
+            return row['id'] if row else None
+
+    def sync_token(self, calendar_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT sync_token FROM calendars WHERE id = ?", (calendar_id,)).fetchone()
+            return row['sync_token'] if row else None
+
+    def replace_events(self, calendar_id: str, events: Iterable[Dict[str, Any]], sync_token: Optional[str],
+                       window_start: float, time_zone: str = None) -> Dict[str, int]:
+        """Replace a calendar's events with the result of a full sync, in one transaction"""
+        with self._lock, self._conn:
+            before = {row['id'] for row in self._conn.execute("SELECT id FROM events WHERE calendar_id = ?",
+                                                              (calendar_id,))}
+            self._conn.execute("DELETE FROM events WHERE calendar_id = ?", (calendar_id,))
+            tz = self._set_timezone(calendar_id, time_zone)
+            events = list(events)
+            self._upsert(calendar_id, events, tz)
+            after = {event['id'] for event in events}
+            self._conn.execute("UPDATE calendars SET sync_token = ?, window_start = ?, synced_at = ? WHERE id = ?",
+                               (sync_token, window_start, time.time(), calendar_id))
+            # Deleted long events may have shrunk the longest duration
+            self._max_duration = self._longest_event()
+            return {'added': len(after - before), 'updated': len(after & before), 'deleted': len(before - after)}
+
+    def apply_changes(self, calendar_id: str, events: Iterable[Dict[str, Any]], sync_token: Optional[str] = None,
+                      time_zone: str = None) -> Dict[str, int]:
+        """Apply changed events (status 'cancelled' means deleted); the sync token is stored with them"""
+        counts = {'added': 0, 'updated': 0, 'deleted': 0}
+        with self._lock, self._conn:
+            if not self._conn.execute("SELECT 1 FROM calendars WHERE id = ?", (calendar_id,)).fetchone():
+                # Not synced yet: the first sync will bring these in
+                return counts
+            tz = self._set_timezone(calendar_id, time_zone)
+            changed = []
+            for event in events:
+                if event.get('status') == 'cancelled':
+                    counts['deleted'] += self._conn.execute(
+                        "DELETE FROM events WHERE calendar_id = ? AND id = ?", (calendar_id, event['id'])
+                    ).rowcount
+                    continue
+                exists = self._conn.execute("SELECT 1 FROM events WHERE calendar_id = ? AND id = ?",
+                                            (calendar_id, event['id'])).fetchone()
+                counts['updated' if exists else 'added'] += 1
+                changed.append(event)
+            self._upsert(calendar_id, changed, tz)
+            if sync_token:
+                self._conn.execute("UPDATE calendars SET sync_token = ?, synced_at = ? WHERE id = ?",
+                                   (sync_token, time.time(), calendar_id))
+        return counts
+
+    def _set_timezone(self, calendar_id: str, time_zone: Optional[str]):
+        if time_zone:
+            self._conn.execute("UPDATE calendars SET time_zone = ? WHERE id = ?", (time_zone, calendar_id))
+            return calendar_timezone(time_zone)
+        row = self._conn.execute("SELECT time_zone FROM calendars WHERE id = ?", (calendar_id,)).fetchone()
+        return calendar_timezone(row['time_zone'] if row else None)
+
+    def _upsert(self, calendar_id: str, events: Iterable[Dict[str, Any]], tz):
+        rows = []
+        for event in events:
+            event['calendar_id'] = calendar_id
+            start, end = event_bounds(event, tz)
+            self._max_duration = max(self._max_duration, end - start)
+            rows.append((calendar_id, event['id'], start, end, json.dumps(event)))
+        self._conn.executemany(
+            "INSERT INTO events (calendar_id, id, start_ts, end_ts, data) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (calendar_id, id) DO UPDATE SET "
+            "start_ts = excluded.start_ts, end_ts = excluded.end_ts, data = excluded.data",
+            rows
+        )
+
+    def covers(self, calendar_ids: List[str], time_min: datetime) -> bool:
+        """Whether every one of the calendars is synced back to time_min"""
+        if not calendar_ids:
+            return False
+        placeholders = ', '.join('?' * len(calendar_ids))
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT COUNT(*) AS synced FROM calendars WHERE id IN ({placeholders}) "
+                "AND sync_token IS NOT NULL AND window_start <= ?",
+                (*calendar_ids, time_min.timestamp())
+            ).fetchone()
+            return row['synced'] == len(set(calendar_ids))
+
+    def events_between(self, time_min: datetime, time_max: datetime, calendar_ids: List[str] = None,
+                       max_results: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Events overlapping [time_min, time_max), in start order"""
+        start, end = time_min.timestamp(), time_max.timestamp()
+        sql = "SELECT data FROM events WHERE start_ts >= ? AND start_ts < ? AND end_ts > ?"
+        with self._lock:
+            params: List[Any] = [start - self._max_duration, end, start]
+            if calendar_ids is not None:
+                sql += f" AND calendar_id IN ({', '.join('?' * len(calendar_ids))})"
+                params.extend(calendar_ids)
+            sql += " ORDER BY start_ts, calendar_id, id"
+            if max_results is not None:
+                sql += " LIMIT ?"
+                params.append(max_results)
+            rows = self._conn.execute(sql, params).fetchall()
+        return [json.loads(row['data']) for row in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
@@ -0,0 +1,626 @@
+#!/usr/bin/env python3
+"""
+Local fake Gmail/Calendar HTTP API for load testing
+
+Serves a synthetic mailbox and calendar on the same URL paths the Google
+API client uses, with configurable per-request latency. Point the
+assistant at it with GOOGLE_API_ENDPOINT=http://127.0.0.1:<port>.
+
+Usage:
+    python fake_google_server.py --port 8090 --messages 500 --latency-ms 40
+"""
+
+import argparse
+import base64
+import email
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, unquote, urlparse
+
+PRIMARY_CALENDAR = 'me@example.com'
+TEAM_CALENDAR = 'team@group.calendar.google.com'
+HOLIDAY_CALENDAR = 'en.usa#holiday@group.v.calendar.google.com'
+SENDERS = ['alice@example.com', 'bob@example.com', 'carol@example.org', 'dave@example.net', 'erin@example.com']
+TOPICS = ['Quarterly report', 'Team offsite', 'Invoice', 'Project update', 'Lunch plans',
+          'Code review', 'Travel itinerary', 'Meeting notes', 'Budget approval', 'Newsletter']
+
+
+def _b64(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii')
+
+
+class FakeGoogleData:
+    """Deterministic synthetic mailbox and calendar"""
+
+    def __init__(self, message_count: int = 500, event_count: int = 200, attachment_kb: int = 256):
+        self.lock = threading.Lock()
+        self.attachment_size = attachment_kb * 1024
+        self.history_id = 1000
+        now = datetime.now(timezone.utc)
+        self.messages: List[Dict[str, Any]] = []
+        def sent_at(i):
+            return now - timedelta(minutes=37 * i)
+
+        def text(i):
+            return f"Hello,\n\nHere are the details about {TOPICS[i % len(TOPICS)].lower()} number {i}.\n\n" * 5 + "Thanks"
+
+        for i in range(message_count):
+            topic = TOPICS[i % len(TOPICS)]
+            # Threads of three, oldest message last; replies quote the message before them
+            root = i - i % 3 + 2
+            subject, body = f"{topic} #{i}", text(i)
+            if i % 3 != 2 and root < message_count:
+                subject = f"Re: {TOPICS[root % len(TOPICS)]} #{root}"
+                body += (f"\n\nOn {sent_at(i + 1).strftime('%a, %d %b %Y at %H:%M')}, "
+                         f"{SENDERS[(i + 1) % len(SENDERS)]} wrote:\n" +
+                         '\n'.join(f"> {line}" for line in text(i + 1).split('\n')))
+            self.messages.append(self._message(
+                i, sent_at(i), subject, SENDERS[i % len(SENDERS)], body,
+                ['INBOX', 'UNREAD'] if i % 4 == 0 else ['INBOX'],
+                thread_index=i - i % 3,
+                snippet=f"{topic}: details for item {i}",
+            ))
+            # Some variety for MIME handling: HTML-only mail, and attachments that repeat across messages
+            self.messages[-1]['html_only'] = i % 11 == 5
+            if i % 7 == 3:
+                self.messages[-1]['attachment'] = f"{topic.lower().replace(' ', '-')}-{i % 20}.pdf"
+        self.by_id = {m['id']: m for m in self.messages}
+        self.next_index = message_count
+
+        # Mailbox changes for users.history.list; older start ids get a 404 like expired history
+        self.history: List[Dict[str, Any]] = []
+        self.history_floor = self.history_id
+
+        self.events: List[Dict[str, Any]] = []
+        start_of_day = now.replace(hour=8, minute=0, second=0, microsecond=0) - timedelta(days=7)
+        for i in range(event_count):
+            start = start_of_day + timedelta(days=i // 6, hours=(i % 6) * 2)
+            self.events.append(self._event(f"evt{i:05d}", f"{TOPICS[i % len(TOPICS)]} sync", start,
+                                           start + timedelta(minutes=45)))
+        # A busy shared calendar, and one of all-day events
+        team_events = []
+        for i in range(event_count // 2):
+            start = start_of_day + timedelta(days=i // 3, hours=(i % 3) * 3 + 1)
+            team_events.append(self._event(f"team{i:05d}", f"Team {TOPICS[i % len(TOPICS)].lower()}", start,
+                                           start + timedelta(minutes=30)))
+        holidays = [{'id': f"hol{i:03d}", 'status': 'confirmed', 'summary': f"Holiday {i}",
+                     'start': {'date': (start_of_day + timedelta(days=7 * i)).date().isoformat()},
+                     'end': {'date': (start_of_day + timedelta(days=7 * i + 1)).date().isoformat()},
+                     'updated': now.isoformat()} for i in range(max(event_count // 42, 1))]
+        self.calendars = [
+            {'id': PRIMARY_CALENDAR, 'summary': PRIMARY_CALENDAR, 'primary': True, 'selected': True, 'timeZone': 'UTC',
+             'accessRole': 'owner'},
+            {'id': TEAM_CALENDAR, 'summary': 'Team', 'selected': True, 'timeZone': 'UTC', 'accessRole': 'writer'},
+            {'id': HOLIDAY_CALENDAR, 'summary': 'Holidays', 'selected': True, 'timeZone': 'America/New_York',
+             'accessRole': 'reader'},
+        ]
+        self.calendar_events = {PRIMARY_CALENDAR: self.events, TEAM_CALENDAR: team_events, HOLIDAY_CALENDAR: holidays}
+
+        # Event changes for events.list?syncToken=; older tokens get a 410 like expired ones
+        self.calendar_version = 1
+        self.calendar_changes: List[Dict[str, Any]] = []
+        self.calendar_sync_floor = self.calendar_version
+
+    def _message(self, index: int, sent: datetime, subject: str, sender: str, body: str,
+                 labels: List[str], thread_index: int = None, snippet: str = None) -> Dict[str, Any]:
+        return {
+            'id': f"{0x18f0000000000000 + index:016x}",
+            'threadId': f"{0x18f0000000000000 + (index if thread_index is None else thread_index):016x}",
+            'labelIds': labels,
+            'snippet': snippet if snippet is not None else ' '.join(body.split())[:100],
+            'historyId': str(self.history_id),
+            'internalDate': str(int(sent.timestamp() * 1000)),
+            'subject': subject,
+            'from': sender,
+            'date': sent.strftime('%a, %d %b %Y %H:%M:%S +0000'),
+            'body': body,
+        }
+
+    def add_message(self, subject: str, sender: str, body: str, labels: List[str]) -> Dict[str, Any]:
+        """Add a message to the top of the mailbox and record it in the history"""
+        with self.lock:
+            self.history_id += 1
+            message = self._message(self.next_index, datetime.now(timezone.utc), subject, sender, body, labels)
+            self.next_index += 1
+            self.messages.insert(0, message)
+            self.by_id[message['id']] = message
+            self.history.append({
+                'id': str(self.history_id),
+                'messagesAdded': [{'message': {key: message[key] for key in ('id', 'threadId', 'labelIds')}}],
+            })
+            return message
+
+    def history_since(self, start_history_id: int) -> Optional[List[Dict[str, Any]]]:
+        """History records after start_history_id, or None if that point has expired"""
+        with self.lock:
+            if start_history_id < self.history_floor:
+                return None
+            return [record for record in self.history if int(record['id']) > start_history_id]
+
+    def record_event_change(self, calendar_id: str, event: Dict[str, Any]):
+        """Record an inserted, updated or cancelled event; call with the lock held"""
+        self.calendar_version += 1
+        self.calendar_changes.append({'version': self.calendar_version, 'calendar': calendar_id, 'event': event})
+
+    def event_changes_since(self, calendar_id: str, version: int) -> Optional[List[Dict[str, Any]]]:
+        """The latest state of each event of a calendar changed after version, or None if that point has expired"""
+        with self.lock:
+            if version < self.calendar_sync_floor:
+                return None
+            latest = {}
+            for change in self.calendar_changes:
+                if change['calendar'] == calendar_id and change['version'] > version:
+                    latest[change['event']['id']] = change['event']
+            return list(latest.values())
+
+    def _event(self, event_id: str, summary: str, start: datetime, end: datetime) -> Dict[str, Any]:
+        return {
+            'id': event_id,
+            'status': 'confirmed',
+            'summary': summary,
+            'start': {'dateTime': start.isoformat()},
+            'end': {'dateTime': end.isoformat()},
+            'updated': datetime.now(timezone.utc).isoformat(),
+        }
+
+    def message_resource(self, message: Dict[str, Any], fmt: str = 'full',
+                         metadata_headers: Optional[List[str]] = None) -> Dict[str, Any]:
+        headers = [
+            {'name': 'Subject', 'value': message['subject']},
+            {'name': 'From', 'value': message['from']},
+            {'name': 'To', 'value': 'me@example.com'},
+            {'name': 'Date', 'value': message['date']},
+            {'name': 'Message-ID', 'value': f"<{message['id']}@example.com>"},
+        ]
+        resource = {key: message[key] for key in ('id', 'threadId', 'labelIds', 'snippet', 'historyId', 'internalDate')}
+        if fmt == 'minimal':
+            return resource
+        if fmt == 'metadata':
+            if metadata_headers:
+                wanted = {h.lower() for h in metadata_headers}
+                headers = [h for h in headers if h['name'].lower() in wanted]
+            resource['payload'] = {'mimeType': 'multipart/alternative', 'headers': headers}
+            return resource
+
+        body = message['body']
+        text_part = {'mimeType': 'text/plain',
+                     'headers': [{'name': 'Content-Type', 'value': 'text/plain; charset="UTF-8"'}],
+                     'body': {'size': len(body), 'data': _b64(body)}}
+        html = '<html><head><style>p {margin: 0}</style></head><body>' + \
+               ''.join(f"<p>{paragraph}</p>" for paragraph in body.split('\n\n')) + '</body></html>'
+        html_part = {'mimeType': 'text/html',
+                     'headers': [{'name': 'Content-Type', 'value': 'text/html; charset="UTF-8"'}],
+                     'body': {'size': len(html), 'data': _b64(html)}}
+        alternative = {
+            'mimeType': 'multipart/alternative',
+            'headers': [{'name': 'Content-Type', 'value': 'multipart/alternative; boundary="alt"'}],
+            'body': {'size': 0},
+            'parts': [html_part] if message.get('html_only') else [text_part, html_part],
+        }
+        
+        if message.get('attachment'):
+            # multipart/mixed containing the text alternatives and the attachment
+            alternative['partId'] = '0'
+            for index, part in enumerate(alternative['parts']):
+                part['partId'] = f"0.{index}"
+            attachment_part = {
+                'partId': '1', 'mimeType': 'application/pdf', 'filename': message['attachment'],
+                'headers': [{'name': 'Content-Type', 'value': f'application/pdf; name="{message["attachment"]}"'},
+                            {'name': 'Content-Disposition',
+                             'value': f'attachment; filename="{message["attachment"]}"'}],
+                'body': {'size': self.attachment_size, 'attachmentId': f"att-{message['attachment']}"},
+            }
+            resource['payload'] = {
+                'mimeType': 'multipart/mixed',
+                'headers': headers + [{'name': 'Content-Type', 'value': 'multipart/mixed; boundary="mixed"'}],
+                'body': {'size': 0},
+                'parts': [alternative, attachment_part],
+            }
+        else:
+            for index, part in enumerate(alternative['parts']):
+                part['partId'] = str(index)
+            alternative['headers'] = headers + alternative['headers']
+            resource['payload'] = alternative
+        resource['sizeEstimate'] = len(body) * 2
+        return resource
+
+    def attachment_data(self, attachment_id: str) -> bytes:
+        """Deterministic content, identical for every attachment with the same id"""
+        seed = hashlib.sha256(attachment_id.encode('utf-8')).digest()
+        return (seed * (self.attachment_size // len(seed) + 1))[:self.attachment_size]
+
+    def thread_messages(self, thread_id: str) -> List[Dict[str, Any]]:
+        """A thread's messages, oldest first like the real API"""
+        return sorted((m for m in self.messages if m['threadId'] == thread_id), key=lambda m: int(m['internalDate']))
+
+    def search(self, query: str) -> List[Dict[str, Any]]:
+        """A tiny subset of Gmail search: from:, is:unread, has:attachment, in:inbox and plain words"""
+        results = self.messages
+        for token in (query or '').split():
+            lowered = token.lower()
+            if lowered.startswith('from:'):
+                results = [m for m in results if lowered[5:] in m['from']]
+            elif lowered == 'is:unread':
+                results = [m for m in results if 'UNREAD' in m['labelIds']]
+            elif lowered == 'has:attachment':
+                results = [m for m in results if m.get('attachment')]
+            elif lowered.startswith(('in:', 'is:', 'after:', 'before:', 'label:')):
+                continue
+            else:
+                results = [m for m in results if lowered in m['subject'].lower() or lowered in m['body'].lower()]
+        return results
+
+
+class FakeGoogleHandler(BaseHTTPRequestHandler):
+    data: FakeGoogleData = None
+    latency: float = 0.0
+    error_rate: float = 0.0
+    stats: Counter = Counter()
+    protocol_version = 'HTTP/1.1'
+
+    ROUTES = [
+        ('GET', r'^/gmail/v1/users/me/profile$', 'gmail_profile'),
+        ('GET', r'^/gmail/v1/users/me/messages$', 'gmail_list'),
+        ('GET', r'^/gmail/v1/users/me/messages/(?P<id>[^/]+)$', 'gmail_get'),
+        ('GET', r'^/gmail/v1/users/me/messages/(?P<id>[^/]+)/attachments/(?P<attachment_id>[^/]+)$',
+         'gmail_attachment'),
+        ('POST', r'^/gmail/v1/users/me/messages/send$', 'gmail_send'),
+        ('GET', r'^/gmail/v1/users/me/threads$', 'gmail_thread_list'),
+        ('GET', r'^/gmail/v1/users/me/threads/(?P<id>[^/]+)$', 'gmail_thread_get'),
+        ('GET', r'^/gmail/v1/users/me/history$', 'gmail_history'),
+        ('GET', r'^/calendar/v3/users/me/calendarList$', 'calendar_list_calendars'),
+        ('GET', r'^/calendar/v3/calendars/(?P<calendar>[^/]+)/events$', 'calendar_list'),
+        ('POST', r'^/calendar/v3/calendars/(?P<calendar>[^/]+)/events$', 'calendar_insert'),
+        ('DELETE', r'^/calendar/v3/calendars/(?P<calendar>[^/]+)/events/(?P<id>[^/]+)$', 'calendar_delete'),
+        ('POST', r'^/calendar/v3/freeBusy$', 'calendar_freebusy'),
+        ('POST', r'^/batch/gmail/v1$', 'gmail_batch'),
+        ('GET', r'^/__stats$', 'server_stats'),
+        ('POST', r'^/__deliver$', 'deliver_mail'),
+        ('POST', r'^/__expire_calendar_sync$', 'expire_calendar_sync'),
+    ]
+
+    def log_message(self, format, *args):
+        # Keep load-test output readable
+        pass
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def _dispatch(self, method: str):
+        parsed = urlparse(self.path)
+        self.params = {k: v if len(v) > 1 else v[0] for k, v in parse_qs(parsed.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        self.raw_body = self.rfile.read(length) if length else b''
+
+        if self.latency and not parsed.path.startswith('/__'):
+            # One simulated network round-trip per HTTP request, batched or not
+            time.sleep(self.latency)
+        if self.error_rate and not parsed.path.startswith('/__') and random.random() < self.error_rate:
+            # Simulated per-user rate limiting
+            self.stats['rate_limited'] += 1
+            return self._send_json(429, {'error': {'code': 429, 'message': 'User-rate limit exceeded.'}})
+        status, payload = self._route(method, parsed.path)
+        if isinstance(payload, (bytes, str)):
+            return self._send_raw(status, payload, self._response_content_type)
+        self._send_json(status, payload)
+
+    def _route(self, method: str, path: str):
+        for route_method, pattern, handler in self.ROUTES:
+            match = re.match(pattern, path)
+            if route_method == method and match:
+                self.stats[handler] += 1
+                try:
+                    return getattr(self, handler)(**match.groupdict())
+                except Exception as e:
+                    return 500, {'error': {'code': 500, 'message': str(e)}}
+        return 404, {'error': {'code': 404, 'message': f'No fake route for {method} {path}'}}
+
+    def _send_json(self, status: int, payload: Any):
+        body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_raw(self, status: int, body, content_type: str):
+        body = body.encode('utf-8') if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json_body(self) -> Dict[str, Any]:
+        return json.loads(self.raw_body or b'{}')
+
+    # Gmail
+
+    def gmail_profile(self):
+        return 200, {'emailAddress': 'me@example.com', 'messagesTotal': len(self.data.messages),
+                     'historyId': str(self.data.history_id)}
+
+    def gmail_list(self):
+        matches = self.data.search(self.params.get('q', ''))
+        max_results = min(int(self.params.get('maxResults', 100)), 500)
+        offset = int(self.params.get('pageToken', 0))
+        page = matches[offset:offset + max_results]
+        payload = {
+            'messages': [{'id': m['id'], 'threadId': m['threadId']} for m in page],
+            'resultSizeEstimate': len(matches),
+        }
+        if offset + max_results < len(matches):
+            payload['nextPageToken'] = str(offset + max_results)
+        return 200, payload
+
+    def gmail_get(self, id):
+        message = self.data.by_id.get(id)
+        if not message:
+            return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+        headers = self.params.get('metadataHeaders')
+        if isinstance(headers, str):
+            headers = [headers]
+        return 200, self.data.message_resource(message, self.params.get('format', 'full'), headers)
+
+    def gmail_attachment(self, id, attachment_id):
+        message = self.data.by_id.get(id)
+        if not message or f"att-{message.get('attachment')}" != attachment_id:
+            return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+        data = self.data.attachment_data(attachment_id)
+        return 200, {'size': len(data), 'data': base64.urlsafe_b64encode(data).decode('ascii')}
+
+    def gmail_thread_list(self):
+        thread_ids = list(dict.fromkeys(m['threadId'] for m in self.data.search(self.params.get('q', ''))))
+        max_results = min(int(self.params.get('maxResults', 100)), 500)
+        offset = int(self.params.get('pageToken', 0))
+        payload = {
+            'threads': [{'id': thread_id} for thread_id in thread_ids[offset:offset + max_results]],
+            'resultSizeEstimate': len(thread_ids),
+        }
+        if offset + max_results < len(thread_ids):
+            payload['nextPageToken'] = str(offset + max_results)
+        return 200, payload
+
+    def gmail_thread_get(self, id):
+        messages = self.data.thread_messages(id)
+        if not messages:
+            return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+        headers = self.params.get('metadataHeaders')
+        if isinstance(headers, str):
+            headers = [headers]
+        fmt = self.params.get('format', 'full')
+        return 200, {'id': id, 'messages': [self.data.message_resource(m, fmt, headers) for m in messages]}
+
+    def gmail_batch(self):
+        """multipart/mixed batch of GET requests, answered in one multipart/mixed response"""
+        content_type = self.headers.get('Content-Type', '')
+        boundary = content_type.split('boundary=')[-1].strip('"')
+        raw = self.raw_body.decode('utf-8').replace('\r\n', '\n')
+        response_boundary = 'batch_fake_boundary'
+        parts = []
+        for chunk in raw.split(f'--{boundary}'):
+            chunk = chunk.strip()
+            if not chunk or chunk == '--':
+                continue
+            outer_headers, _, inner = chunk.partition('\n\n')
+            content_id = next((line.split(':', 1)[1].strip() for line in outer_headers.splitlines()
+                               if line.lower().startswith('content-id:')), '')
+            request_line = inner.splitlines()[0]
+            sub_method, sub_url, _ = request_line.split(' ', 2)
+            sub_parsed = urlparse(sub_url)
+            self.params = {k: v if len(v) > 1 else v[0] for k, v in parse_qs(sub_parsed.query).items()}
+            status, payload = self._route(sub_method, sub_parsed.path)
+            body = json.dumps(payload)
+            parts.append(
+                f'--{response_boundary}\r\nContent-Type: application/http\r\n'
+                f'Content-ID: <response-{content_id.strip("<>")}>\r\n\r\n'
+                f'HTTP/1.1 {status} OK\r\nContent-Type: application/json; charset=UTF-8\r\n'
+                f'Content-Length: {len(body.encode("utf-8"))}\r\n\r\n{body}\r\n'
+            )
+        self._response_content_type = f'multipart/mixed; boundary={response_boundary}'
+        return 200, ''.join(parts) + f'--{response_boundary}--\r\n'
+
+    def gmail_send(self):
+        message = email.message_from_bytes(base64.urlsafe_b64decode(self._json_body().get('raw', '')))
+        body = message.get_payload(decode=True) or b''
+        sent = self.data.add_message(message.get('subject', ''), 'me@example.com',
+                                     body.decode('utf-8', 'replace'), ['SENT'])
+        return 200, {'id': sent['id'], 'threadId': sent['threadId'], 'labelIds': sent['labelIds']}
+
+    def gmail_history(self):
+        records = self.data.history_since(int(self.params.get('startHistoryId', 0)))
+        if records is None:
+            return 404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}}
+        max_results = int(self.params.get('maxResults', 100))
+        offset = int(self.params.get('pageToken', 0))
+        payload = {'historyId': str(self.data.history_id)}
+        if records[offset:offset + max_results]:
+            payload['history'] = records[offset:offset + max_results]
+        if offset + max_results < len(records):
+            payload['nextPageToken'] = str(offset + max_results)
+        return 200, payload
+
+    # Calendar
+
+    def calendar_list_calendars(self):
+        max_results = int(self.params.get('maxResults', 100))
+        offset = int(self.params.get('pageToken', 0))
+        payload = {'kind': 'calendar#calendarList', 'items': self.data.calendars[offset:offset + max_results]}
+        if offset + max_results < len(self.data.calendars):
+            payload['nextPageToken'] = str(offset + max_results)
+        return 200, payload
+
+    def _calendar(self, calendar: str) -> Optional[List[Dict[str, Any]]]:
+        return self.data.calendar_events.get(self._calendar_id(calendar))
+
+    @staticmethod
+    def _calendar_id(calendar: str) -> str:
+        calendar = unquote(calendar)
+        return PRIMARY_CALENDAR if calendar == 'primary' else calendar
+
+    @staticmethod
+    def _event_time(when: Dict[str, str]) -> datetime:
+        if 'dateTime' in when:
+            return datetime.fromisoformat(when['dateTime'].replace('Z', '+00:00'))
+        return datetime.fromisoformat(when['date']).replace(tzinfo=timezone.utc)
+
+    def calendar_list(self, calendar):
+        events = self._calendar(calendar)
+        if events is None:
+            return 404, {'error': {'code': 404, 'message': 'Not Found'}}
+        if 'syncToken' in self.params:
+            # Incremental sync: every event changed since the token, deleted ones as 'cancelled'
+            events = self.data.event_changes_since(self._calendar_id(calendar), int(self.params['syncToken']))
+            if events is None:
+                return 410, {'error': {'code': 410, 'message': 'Sync token is no longer valid, a full sync is required.',
+                                       'errors': [{'reason': 'fullSyncRequired'}]}}
+        if 'timeMin' in self.params:
+            time_min = datetime.fromisoformat(self.params['timeMin'].replace('Z', '+00:00'))
+            events = [e for e in events if self._event_time(e['end']) > time_min]
+        if 'timeMax' in self.params:
+            time_max = datetime.fromisoformat(self.params['timeMax'].replace('Z', '+00:00'))
+            events = [e for e in events if self._event_time(e['start']) < time_max]
+        if self.params.get('orderBy') == 'startTime':
+            events = sorted(events, key=lambda e: self._event_time(e['start']))
+        max_results = int(self.params.get('maxResults', 250))
+        offset = int(self.params.get('pageToken', 0))
+        timezone_name = next(c['timeZone'] for c in self.data.calendars
+                             if c['id'] == unquote(calendar) or (calendar == 'primary' and c.get('primary')))
+        payload = {'kind': 'calendar#events', 'timeZone': timezone_name, 'items': events[offset:offset + max_results]}
+        if offset + max_results < len(events):
+            payload['nextPageToken'] = str(offset + max_results)
+        elif not any(param in self.params for param in ('orderBy', 'timeMin', 'timeMax', 'q')):
+            # Only listings an incremental sync could repeat (none of these filters) get a sync token
+            payload['nextSyncToken'] = str(self.data.calendar_version)
+        return 200, payload
+
+    def calendar_insert(self, calendar):
+        event = self._json_body()
+        events = self._calendar(calendar)
+        if events is None:
+            return 404, {'error': {'code': 404, 'message': 'Not Found'}}
+        with self.data.lock:
+            event['id'] = f"evt{len(self.data.events):05d}"
+            event['status'] = 'confirmed'
+            events.append(event)
+            self.data.record_event_change(self._calendar_id(calendar), event)
+        return 200, event
+
+    def calendar_delete(self, calendar, id):
+        events = self._calendar(calendar)
+        with self.data.lock:
+            if events is not None:
+                events[:] = [e for e in events if e['id'] != id]
+                self.data.record_event_change(self._calendar_id(calendar), {'id': id, 'status': 'cancelled'})
+        return 204, None
+
+    @staticmethod
+    def _utc(when: datetime) -> str:
+        return when.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def _attendee_busy(self, email: str, time_min: datetime, time_max: datetime) -> List[Dict[str, str]]:
+        """A sender's working days: a daily one-hour meeting at a time of their own, and lunch"""
+        offset = SENDERS.index(email)
+        busy, day = [], time_min.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        while day < time_max:
+            for start, minutes in ((day + timedelta(hours=9 + offset), 60), (day + timedelta(hours=12), 45)):
+                end = start + timedelta(minutes=minutes)
+                if start < time_max and end > time_min:
+                    busy.append({'start': self._utc(start), 'end': self._utc(end)})
+            day += timedelta(days=1)
+        return sorted(busy, key=lambda period: period['start'])
+
+    def calendar_freebusy(self):
+        body = self._json_body()
+        time_min = datetime.fromisoformat(body['timeMin'].replace('Z', '+00:00'))
+        time_max = datetime.fromisoformat(body['timeMax'].replace('Z', '+00:00'))
+        calendars = {}
+        for item in body.get('items', []):
+            events = self._calendar(item['id'])
+            if events is not None:
+                busy = [{'start': self._utc(self._event_time(e['start'])), 'end': self._utc(self._event_time(e['end']))}
+                        for e in sorted(events, key=lambda e: self._event_time(e['start']))
+                        if 'dateTime' in e['start'] and e.get('transparency') != 'transparent'
+                        and self._event_time(e['start']) < time_max and self._event_time(e['end']) > time_min]
+                calendars[item['id']] = {'busy': busy}
+            elif item['id'] in SENDERS:
+                calendars[item['id']] = {'busy': self._attendee_busy(item['id'], time_min, time_max)}
+            else:
+                calendars[item['id']] = {'errors': [{'domain': 'global', 'reason': 'notFound'}], 'busy': []}
+        return 200, {'kind': 'calendar#freeBusy', 'timeMin': body['timeMin'], 'timeMax': body['timeMax'],
+                     'calendars': calendars}
+
+    def server_stats(self):
+        return 200, dict(self.stats)
+
+    def deliver_mail(self):
+        """Simulate new mail arriving: {"count": n}"""
+        count = int(self._json_body().get('count', 1))
+        delivered = [
+            self.data.add_message(f"{TOPICS[n % len(TOPICS)]} (new)", SENDERS[n % len(SENDERS)],
+                                  f"Fresh message {n}.", ['INBOX', 'UNREAD'])['id']
+            for n in range(count)
+        ]
+        return 200, {'delivered': delivered, 'historyId': str(self.data.history_id)}
+
+    def expire_calendar_sync(self):
+        """Invalidate every calendar sync token handed out so far, so the next incremental sync gets a 410"""
+        with self.data.lock:
+            self.data.calendar_version += 1
+            self.data.calendar_sync_floor = self.data.calendar_version
+        return 200, {'syncToken': str(self.data.calendar_version)}
+
+
+def start_server(port: int = 0, message_count: int = 500, event_count: int = 200,
+                 latency_ms: float = 0.0, attachment_kb: int = 256,
+                 error_rate: float = 0.0) -> ThreadingHTTPServer:
+    """Start the fake API on a background thread and return the server"""
+    handler = type('Handler', (FakeGoogleHandler,), {
+        'data': FakeGoogleData(message_count, event_count, attachment_kb),
+        'latency': latency_ms / 1000,
+        'error_rate': error_rate,
+        'stats': Counter(),
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='fake-google', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Gmail/Calendar API for load testing")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--messages", type=int, default=500, help="Synthetic mailbox size")
+    parser.add_argument("--events", type=int, default=200, help="Synthetic calendar size")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Added latency per API call")
+    parser.add_argument("--attachment-kb", type=int, default=256, help="Size of each synthetic attachment")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls answered with 429")
+    args = parser.parse_args()
+
+    server = start_server(args.port, args.messages, args.events, args.latency_ms, args.attachment_kb,
+                          args.error_rate)
+    print(f"🧪 Fake Google API on http://127.0.0.1:{server.server_address[1]}")
+    print(f"   export GOOGLE_API_ENDPOINT=http://127.0.0.1:{server.server_address[1]}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,117 +1,670 @@
 import os
 import base64
 import email
+import threading
+import time
 from email.mime.text import MIMEText
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
 from config import Config
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+import metrics
+import tracing
+import mime_utils
+import rate_limit
+import google_clients
+from mail_store import MailStore, parse_gmail_query, searches_hidden
+from mail_index import MailIndex
 from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest
 
 class GmailService:
-    def __init__(self, scopes=None, token_file="token_gmail.json", credentials_file="credentials.json"):
-        if scopes is None:
-            scopes = Config.GMAIL_SCOPES
-        self.creds = None
-        if os.path.exists(token_file):
-            self.creds = Credentials.from_authorized_user_file(token_file, scopes)
-            print("here found")
-
-        if not self.creds or not self.creds.valid:
-            if self.creds and self.creds.expired and self.creds.refresh_token:
-                self.creds.refresh(Request())
-                print("creds refresed")
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(credentials_file, scopes)
-                self.creds = flow.run_local_server(port=0)
-            with open(token_file, "w") as token:
-                token.write(self.creds.to_json())
-        self.service = build("gmail", "v1", credentials=self.creds)
+    def __init__(self):
+        self.store = MailStore() if Config.MAIL_CACHE_ENABLED else None
+        # Semantic search over the cache; the embedding model is loaded on first use
+        self.index = MailIndex(self.store) if self.store is not None else None
+        self._sync_lock = threading.Lock()
+        self._last_sync = None
+        # Set by SyncDaemon.register_gmail(): the daemon keeps the store current
+        self.background_sync = False
+        self._api_root = (Config.GOOGLE_API_ENDPOINT or 'https://gmail.googleapis.com').rstrip('/')
+        self._batch_uri = self._api_root + '/batch/gmail/v1'
         
+        # Credentials, discovery document and pooled transport are shared with CalendarService;
+        # self.service can be used from any thread
+        self.creds = google_clients.get_credentials()
+        self.service = google_clients.build_service('gmail', 'v1')
+        
+    # Partial responses: only the parts of a message resource we actually read
+    METADATA_HEADERS = ['Subject', 'From', 'Date', 'Message-ID']
+    METADATA_FIELDS = 'id,threadId,snippet,labelIds,internalDate,payload/headers'
+    BODY_FIELDS = 'id,payload(mimeType,headers,body/data,parts)'
+    SYNC_FIELDS = 'id,threadId,snippet,labelIds,internalDate,payload(mimeType,headers,body/data,parts)'
+    THREAD_METADATA_FIELDS = 'id,messages(id,threadId,snippet,labelIds,internalDate,payload/headers)'
+    THREAD_FIELDS = 'id,messages(id,threadId,snippet,labelIds,internalDate,payload(mimeType,headers,body/data,parts))'
+    HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+    HISTORY_FIELDS = ('history(messagesAdded/message(id,labelIds),messagesDeleted/message/id,'
+                      'labelsAdded/message(id,labelIds),labelsRemoved/message(id,labelIds)),'
+                      'historyId,nextPageToken')
+    
     def get_emails(self, max_results: int = 10, query: str = None) -> List[Dict[str, Any]]:
-        """Get emails from Gmail"""
+        """Get emails from Gmail, including their bodies"""
+        return self.fetch_bodies(self.list_emails(max_results=max_results, query=query))
+    
+    def list_emails(self, max_results: int = 10, query: str = None) -> List[Dict[str, Any]]:
+        """List emails with headers and snippet only; bodies are fetched later with fetch_bodies()"""
+        if query is None and self.store is not None:
+            # Inbox checks are answered from the local mailbox after a cheap incremental sync
+            try:
+                self._sync_for_read()
+                return self.store.list_messages('INBOX', max_results)
+            except Exception as e:
+                print(f"Error syncing mailbox, falling back to the API: {e}")
+        
         try:
-            # Build query
-            gmail_query = query or "in:inbox"
-            
-            # Get messages
-            results = self.service.users().messages().list(
-                userId='me', 
-                q=gmail_query, 
-                maxResults=max_results
-            ).execute()
-            
-            messages = results.get('messages', [])
             emails = []
-            
-            for message in messages:
-                msg = self.service.users().messages().get(
-                    userId='me', 
-                    id=message['id'], 
-                    format='full'
-                ).execute()
-                
-                headers = msg['payload']['headers']
-                subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-                sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown')
-                date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown')
-                
-                # Get email body
-                body = self._get_email_body(msg['payload'])
-                
-                emails.append({
-                    'id': message['id'],
-                    'subject': subject,
-                    'sender': sender,
-                    'date': date,
-                    'body': body,
-                    'snippet': msg.get('snippet', '')
-                })
-            
+            for page in self.iter_email_pages(query=query or "in:inbox", page_size=min(max_results, 500),
+                                              limit=max_results):
+                emails.extend(page)
             return emails
             
         except Exception as e:
             print(f"Error fetching emails: {e}")
             return []
     
-    def _get_email_body(self, payload: Dict[str, Any]) -> str:
-        """Extract email body from payload"""
-        if 'body' in payload and payload['body'].get('data'):
-            return base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8')
+    def iter_emails(self, query: str = None, page_size: int = 100, limit: int = None) -> Iterator[Dict[str, Any]]:
+        """Yield emails (headers and snippet) across every result page, newest first"""
+        for page in self.iter_email_pages(query=query, page_size=page_size, limit=limit):
+            yield from page
+    
+    def iter_email_pages(self, query: str = None, page_size: int = 100,
+                         limit: int = None) -> Iterator[List[Dict[str, Any]]]:
+        """Yield pages of emails, following nextPageToken until `limit` emails or the end of the results.
+        
+        While the caller works on one page, the next one is listed and fetched in the background
+        on another pooled connection, so at most two pages are held in memory.
+        """
+        emails, page_token = self._fetch_page(query, None, page_size)
+        prefetcher = None
+        remaining = limit
+        try:
+            while True:
+                if remaining is not None:
+                    emails = emails[:remaining]
+                    remaining -= len(emails)
+                
+                next_page = None
+                if page_token and (remaining is None or remaining > 0):
+                    if prefetcher is None:
+                        prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='gmail-prefetch')
+                    size = page_size if remaining is None else min(page_size, remaining)
+                    next_page = prefetcher.submit(tracing.wrap(self._fetch_page), query, page_token, size)
+                
+                if emails:
+                    yield emails
+                if next_page is None:
+                    return
+                emails, page_token = next_page.result()
+        finally:
+            if prefetcher is not None:
+                prefetcher.shutdown(wait=True)
+    
+    def iter_message_ids(self, query: str = None, limit: int = None) -> Iterator[str]:
+        """Yield matching message ids only, 500 per list call, for bulk operations that fetch their own data.
         
-        if 'parts' in payload:
-            for part in payload['parts']:
-                if part['mimeType'] == 'text/plain':
-                    if 'data' in part['body']:
-                        return base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
+        The list calls share GMAIL_QUOTA with the bulk work and are retried on 429/5xx.
+        """
+        page_token = None
+        count = 0
+        while True:
+            request = self.service.users().messages().list(
+                userId='me',
+                q=query,
+                maxResults=500 if limit is None else min(500, limit - count),
+                pageToken=page_token,
+                fields='messages/id,nextPageToken'
+            )
+            results = rate_limit.call_with_retries(request.execute, rate_limit.GMAIL_QUOTA_COSTS['messages.list'])
+            for message in results.get('messages', []):
+                yield message['id']
+                count += 1
+            page_token = results.get('nextPageToken')
+            if not page_token or (limit is not None and count >= limit):
+                return
+    
+    def _fetch_page(self, query: Optional[str], page_token: Optional[str],
+                    page_size: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """List one page of message ids and fetch their metadata in a batch"""
+        results = self.service.users().messages().list(
+            userId='me',
+            q=query,
+            maxResults=page_size,
+            pageToken=page_token,
+            fields='messages/id,nextPageToken'
+        ).execute()
         
-        return "No readable content"
+        # One batched round-trip instead of one request per message
+        message_ids = [m['id'] for m in results.get('messages', [])]
+        return self._fetch_metadata(message_ids), results.get('nextPageToken')
     
-    def send_email(self, to: str, subject: str, body: str) -> bool:
-        """Send an email"""
+    def search_emails(self, query: str, max_results: int = 10) -> List[Dict[str, Any]]:
+        """Search with Gmail syntax, answered from the local full-text index when possible.
+        
+        Only the incremental sync (messages newer than the last sync) touches the API;
+        queries using operators the index does not understand are sent to Gmail, and so
+        are queries with too few local hits when the cache holds only the newest mail.
+        """
+        parsed = parse_gmail_query(query)
+        if parsed is not None and self.store is not None and self.store.fts_enabled:
+            try:
+                self._sync_for_read()
+                with tracing.span('gmail.local_search', query=query) as span:
+                    emails = self.store.search(parsed, max_results)
+                    span.set_attribute('results', len(emails))
+                # The sync never lists spam and trash, so only Gmail can rule out a match there
+                complete = self.store.get_state('full_mailbox') == '1' and not searches_hidden(parsed)
+                if len(emails) >= max_results or complete:
+                    metrics.record_cache('mail_search', True)
+                    return emails
+            except Exception as e:
+                print(f"Error searching the local mailbox, falling back to the API: {e}")
+        
+        metrics.record_cache('mail_search', False)
+        return self.list_emails(max_results=max_results, query=query)
+    
+    def semantic_search(self, text: str, max_results: int = 10, filter_query: str = None) -> List[Dict[str, Any]]:
+        """Cached emails closest in meaning to text, best first; filter_query narrows them with Gmail syntax"""
+        if self.index is None:
+            print("Semantic search needs the mailbox cache (MAIL_CACHE_ENABLED)")
+            return []
         try:
-            message = MIMEText(body)
-            message['to'] = to
-            message['subject'] = subject
+            self._sync_for_read()
+            if not self.index.background_update:
+                self.index.update()
+            return self.index.search(text, max_results=max_results, filter_query=filter_query)
+        except Exception as e:
+            print(f"Error in semantic email search: {e}")
+            return []
+    
+    def fetch_bodies(self, emails: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Fill in 'body' for emails listed without one, in a single batched fetch"""
+        missing = [email_data for email_data in emails if 'body' not in email_data]
+        if missing and self.store is not None:
+            cached = self.store.get_bodies([e['id'] for e in missing])
+            for email_data in missing:
+                metrics.record_cache('mail_body', email_data['id'] in cached)
+                if email_data['id'] in cached:
+                    email_data['body'] = cached[email_data['id']]
+            missing = [email_data for email_data in missing if 'body' not in email_data]
+        if not missing:
+            return emails
+        
+        try:
+            messages = self._batch_get_messages([e['id'] for e in missing], format='full', fields=self.BODY_FIELDS)
+        except Exception as e:
+            print(f"Error fetching email bodies: {e}")
+            messages = [None] * len(missing)
+        
+        for email_data, msg in zip(missing, messages):
+            email_data['body'] = self._get_email_body(msg['payload']) if msg else "No readable content"
+            if msg and self.store is not None:
+                self.store.set_body(email_data['id'], email_data['body'])
+        return emails
+    
+    def sync(self, max_age: float = 0) -> Dict[str, Any]:
+        """Bring the local mailbox up to date.
+        
+        Applies the changes since the last stored historyId, so the cost is proportional
+        to new mail; a full resync only happens on first use or when the history has expired.
+        Skipped if the last sync finished less than max_age seconds ago.
+        """
+        if self.store is None:
+            raise RuntimeError("The mailbox cache is disabled (MAIL_CACHE_ENABLED=false)")
+        
+        with self._sync_lock:
+            if self._last_sync is not None and time.monotonic() - self._last_sync < max_age:
+                metrics.record_cache('mailbox', True)
+                return {'mode': 'skipped'}
+            metrics.record_cache('mailbox', False)
             
-            raw = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
+            history_id = self.store.get_state('history_id')
+            with tracing.span('gmail.sync', incremental=history_id is not None) as span:
+                result = None
+                if history_id:
+                    try:
+                        result = self._sync_history(history_id)
+                    except HttpError as e:
+                        if e.resp.status != 404:
+                            raise
+                        print("Mailbox history expired, running a full resync")
+                if result is None:
+                    result = self._full_sync()
+                span.set_attribute('changes', result['added'] + result['updated'] + result['deleted'])
             
-            self.service.users().messages().send(
-                userId='me', 
-                body={'raw': raw}
+            self._last_sync = time.monotonic()
+            return result
+    
+    def _sync_for_read(self):
+        """Sync before answering from the store, unless the sync daemon already keeps it current"""
+        if self.background_sync and self._last_sync is not None:
+            return
+        self.sync(max_age=Config.MAIL_SYNC_MAX_AGE)
+    
+    def _full_sync(self) -> Dict[str, Any]:
+        """Reload the most recent MAIL_SYNC_MAX_MESSAGES messages into the store"""
+        # Read the historyId first so changes made during the sync are picked up next time
+        history_id = self.service.users().getProfile(userId='me', fields='historyId').execute()['historyId']
+        
+        message_ids = []
+        page_token = None
+        while len(message_ids) < Config.MAIL_SYNC_MAX_MESSAGES:
+            results = self.service.users().messages().list(
+                userId='me',
+                maxResults=min(500, Config.MAIL_SYNC_MAX_MESSAGES - len(message_ids)),
+                pageToken=page_token,
+                fields='messages/id,nextPageToken'
+            ).execute()
+            message_ids.extend(m['id'] for m in results.get('messages', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+        
+        emails = self._fetch_for_store(message_ids)
+        self.store.upsert_messages(emails)
+        # Anything cached inside the window we just listed but not returned was deleted;
+        # when the whole mailbox was listed, that is anything not returned at all
+        oldest = min((e['internal_date'] for e in emails), default=0) if page_token else 0
+        deleted = self.store.delete_unseen_since([e['id'] for e in emails], oldest)
+        # Changes to older messages during the history gap were missed, so threads are re-read on demand
+        self.store.forget_threads()
+        self.store.set_state('history_id', history_id)
+        # Local search can only rule out a match when nothing older was left unlisted
+        self.store.set_state('full_mailbox', '0' if page_token else '1')
+        return {'mode': 'full', 'added': len(emails), 'updated': 0, 'deleted': deleted}
+    
+    def _sync_history(self, history_id: str) -> Dict[str, Any]:
+        """Apply users.history.list changes since history_id; raises HttpError 404 once it has expired"""
+        added: Dict[str, bool] = {}
+        relabeled: Dict[str, List[str]] = {}
+        deleted = set()
+        latest = history_id
+        page_token = None
+        
+        while True:
+            results = self.service.users().history().list(
+                userId='me',
+                startHistoryId=history_id,
+                historyTypes=self.HISTORY_TYPES,
+                pageToken=page_token,
+                fields=self.HISTORY_FIELDS
             ).execute()
             
-            return True
+            # Records are in chronological order, so later changes win
+            for record in results.get('history', []):
+                for item in record.get('messagesAdded', []):
+                    added[item['message']['id']] = True
+                    deleted.discard(item['message']['id'])
+                for item in record.get('messagesDeleted', []):
+                    message_id = item['message']['id']
+                    deleted.add(message_id)
+                    added.pop(message_id, None)
+                    relabeled.pop(message_id, None)
+                for key in ('labelsAdded', 'labelsRemoved'):
+                    for item in record.get(key, []):
+                        if item['message']['id'] not in deleted:
+                            relabeled[item['message']['id']] = item['message'].get('labelIds', [])
             
+            latest = results.get('historyId', latest)
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+        
+        # Only new messages cost a fetch; label changes carry the full label set
+        emails = self._fetch_for_store(list(added))
+        self.store.upsert_messages(emails)
+        updated = sum(self.store.set_labels(message_id, labels)
+                      for message_id, labels in relabeled.items() if message_id not in added)
+        self.store.delete_messages(deleted)
+        self.store.set_state('history_id', latest)
+        return {'mode': 'incremental', 'added': len(emails), 'updated': updated, 'deleted': len(deleted)}
+    
+    def _fetch_for_store(self, message_ids: List[str]) -> List[Dict[str, Any]]:
+        """Fetch messages for the local store, with bodies when MAIL_SYNC_BODIES so they get indexed"""
+        if not Config.MAIL_SYNC_BODIES:
+            return self._fetch_metadata(message_ids)
+        messages = self._batch_get_messages(message_ids, format='full', fields=self.SYNC_FIELDS)
+        return [self._parse_message(msg) for msg in messages if msg is not None]
+    
+    def _fetch_metadata(self, message_ids: List[str]) -> List[Dict[str, Any]]:
+        metadata = self._batch_get_messages(
+            message_ids,
+            format='metadata',
+            metadataHeaders=self.METADATA_HEADERS,
+            fields=self.METADATA_FIELDS
+        )
+        return [self._parse_message(msg, include_body=False) for msg in metadata if msg is not None]
+    
+    def _batch_get_messages(self, message_ids: List[str], **get_kwargs) -> List[Optional[Dict[str, Any]]]:
+        """Fetch messages through the Gmail batch endpoint, in the same order as message_ids.
+        
+        A message that cannot be fetched comes back as None instead of failing the whole batch.
+        """
+        return self._batch_get(
+            message_ids, lambda message_id: self.service.users().messages().get(userId='me', id=message_id, **get_kwargs)
+        )
+    
+    def _batch_get(self, ids: List[str], make_request) -> List[Optional[Dict[str, Any]]]:
+        """Execute make_request(id) for every id through the batch endpoint; None for ids that failed"""
+        results: Dict[str, Dict[str, Any]] = {}
+        failed: Dict[str, Exception] = {}
+        
+        def on_response(request_id, response, exception):
+            if exception is not None:
+                failed[request_id] = exception
+            else:
+                results[request_id] = response
+        
+        request_ids = [str(index) for index in range(len(ids))]
+        pairs = list(zip(request_ids, ids))
+        for start in range(0, len(pairs), Config.GMAIL_BATCH_SIZE):
+            chunk = pairs[start:start + Config.GMAIL_BATCH_SIZE]
+            batch = BatchHttpRequest(callback=on_response, batch_uri=self._batch_uri)
+            for request_id, item_id in chunk:
+                batch.add(make_request(item_id), request_id=request_id)
+            with metrics.GOOGLE_API_SECONDS.time(service='gmail', method='batch'), \
+                    tracing.span('google.gmail.batch', requests=len(chunk)):
+                batch.execute()
+        
+        # Items rejected inside the batch (usually 429s) get one individual retry with backoff
+        for request_id, exception in list(failed.items()):
+            item_id = ids[int(request_id)]
+            if isinstance(exception, HttpError) and exception.resp.status not in (429, 500, 502, 503, 504):
+                print(f"Error fetching {item_id}: {exception}")
+                continue
+            try:
+                results[request_id] = make_request(item_id).execute(num_retries=3)
+            except Exception as e:
+                print(f"Error fetching {item_id}: {e}")
+        
+        return [results.get(request_id) for request_id in request_ids]
+    
+    def _parse_message(self, msg: Dict[str, Any], include_body: bool = True) -> Dict[str, Any]:
+        """Turn a Gmail message resource into the email dict used by the assistant"""
+        headers = msg['payload']['headers']
+        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
+        sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown')
+        date = next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown')
+        # Header case varies between senders
+        rfc822_id = next((h['value'] for h in headers if h['name'].lower() == 'message-id'), None)
+        
+        email_data = {
+            'id': msg['id'],
+            'thread_id': msg.get('threadId'),
+            'subject': subject,
+            'sender': sender,
+            'date': date,
+            'snippet': msg.get('snippet', ''),
+            'labels': msg.get('labelIds', []),
+            'internal_date': int(msg.get('internalDate', 0)),
+            'rfc822_id': rfc822_id
+        }
+        if include_body:
+            # Get email body
+            email_data['body'] = self._get_email_body(msg['payload'])
+        return email_data
+    
+    def _get_email_body(self, payload: Dict[str, Any]) -> str:
+        """Extract email body from payload, at any nesting depth"""
+        return mime_utils.extract_body(payload)
+    
+    def list_threads(self, max_results: int = 10, query: str = None) -> List[Dict[str, Any]]:
+        """List conversations, most recently active first, with each message's headers and snippet.
+        
+        A page of threads costs one threads.list and one batched threads.get (metadata only),
+        not a fetch per message; inbox listings are answered from the local mailbox.
+        """
+        if query is None and self.store is not None:
+            try:
+                self._sync_for_read()
+                return [self._make_thread(messages[0]['thread_id'], messages)
+                        for messages in self.store.list_threads('INBOX', max_results)]
+            except Exception as e:
+                print(f"Error syncing mailbox, falling back to the API: {e}")
+        
+        try:
+            results = self.service.users().threads().list(
+                userId='me',
+                q=query or 'in:inbox',
+                maxResults=min(max_results, 500),
+                fields='threads/id'
+            ).execute()
+            resources = self._batch_get(
+                [thread['id'] for thread in results.get('threads', [])],
+                lambda thread_id: self.service.users().threads().get(
+                    userId='me', id=thread_id, format='metadata',
+                    metadataHeaders=self.METADATA_HEADERS, fields=self.THREAD_METADATA_FIELDS
+                )
+            )
+            return [self._parse_thread(resource, include_body=False) for resource in resources if resource]
+        except Exception as e:
+            print(f"Error fetching threads: {e}")
+            return []
+    
+    def get_thread(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        """A whole conversation with bodies, oldest message first.
+        
+        Served from the local mailbox once the thread has been cached in full; otherwise
+        one threads.get call fetches every message, and the thread is cached.
+        """
+        if self.store is not None:
+            try:
+                self._sync_for_read()
+                messages = self.store.get_thread(thread_id) if self.store.thread_complete(thread_id) else []
+                metrics.record_cache('mail_thread', bool(messages))
+                if messages:
+                    return self._make_thread(thread_id, self.fetch_bodies(messages))
+            except Exception as e:
+                print(f"Error reading thread {thread_id} from the local mailbox: {e}")
+        
+        try:
+            resource = self.service.users().threads().get(
+                userId='me', id=thread_id, format='full', fields=self.THREAD_FIELDS
+            ).execute()
         except Exception as e:
-            print(f"Error sending email: {e}")
-            return False
+            print(f"Error fetching thread {thread_id}: {e}")
+            return None
+        thread = self._parse_thread(resource)
+        self._cache_thread(thread)
+        return thread
+    
+    def fetch_thread_bodies(self, threads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Complete threads from list_threads() with every message and body, one batched threads.get"""
+        incomplete = [thread for thread in threads if any('body' not in m for m in thread['messages'])]
+        if not incomplete:
+            return threads
+        
+        try:
+            resources = self._batch_get(
+                [thread['id'] for thread in incomplete],
+                lambda thread_id: self.service.users().threads().get(
+                    userId='me', id=thread_id, format='full', fields=self.THREAD_FIELDS
+                )
+            )
+        except Exception as e:
+            print(f"Error fetching threads: {e}")
+            resources = [None] * len(incomplete)
+        
+        for thread, resource in zip(incomplete, resources):
+            if resource is None:
+                for email_data in thread['messages']:
+                    email_data.setdefault('body', mime_utils.NO_CONTENT)
+                continue
+            fetched = self._parse_thread(resource)
+            self._cache_thread(fetched)
+            thread.update(fetched)
+        return threads
+    
+    def _cache_thread(self, thread: Dict[str, Any]):
+        if self.store is not None:
+            self.store.upsert_messages(thread['messages'])
+            self.store.mark_thread_complete(thread['id'])
+    
+    def _parse_thread(self, resource: Dict[str, Any], include_body: bool = True) -> Dict[str, Any]:
+        messages = [self._parse_message(msg, include_body) for msg in resource.get('messages', [])]
+        return self._make_thread(resource['id'], messages)
+    
+    def _make_thread(self, thread_id: str, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """The thread dict used by the assistant: summary fields plus its messages, oldest first"""
+        messages = sorted(messages, key=lambda m: m['internal_date'])
+        last = messages[-1] if messages else {}
+        return {
+            'id': thread_id,
+            'subject': messages[0]['subject'] if messages else 'No Subject',
+            'participants': list(dict.fromkeys(m['sender'] for m in messages)),
+            'message_count': len(messages),
+            'date': last.get('date', 'Unknown'),
+            'internal_date': last.get('internal_date', 0),
+            'snippet': last.get('snippet', ''),
+            'labels': sorted({label for m in messages for label in m.get('labels', [])}),
+            'messages': messages,
+        }
+    
+    def format_thread(self, thread: Dict[str, Any], max_chars: int = None) -> str:
+        """Plain-text transcript of a thread with quoted replies collapsed, e.g. for a summary prompt.
+        
+        With max_chars, the oldest messages are dropped first so the latest replies always fit.
+        """
+        sections = [
+            f"From: {m['sender']}\nDate: {m['date']}\n\n{mime_utils.collapse_quotes(m.get('body') or m['snippet'])}"
+            for m in thread['messages']
+        ]
+        text = '\n\n---\n\n'.join(sections)
+        while max_chars is not None and len(text) > max_chars and len(sections) > 1:
+            sections.pop(0)
+            text = '[earlier messages omitted]\n\n---\n\n' + '\n\n---\n\n'.join(sections)
+        return text[:max_chars] if max_chars is not None else text
+    
+    def get_attachments(self, message_id: str) -> List[Dict[str, Any]]:
+        """List a message's attachments (name, type, size, id) without downloading them"""
+        msg = self.service.users().messages().get(
+            userId='me', id=message_id, format='full', fields='id,payload'
+        ).execute()
+        return mime_utils.list_attachments(msg['payload'])
+    
+    def download_attachment(self, message_id: str, attachment: Dict[str, Any], dest_path: str) -> int:
+        """Stream one attachment from get_attachments() to dest_path; returns its size in bytes.
+        
+        The response is decoded and written in ATTACHMENT_CHUNK_SIZE pieces, so memory use
+        does not depend on the attachment size. A partial file is removed on failure.
+        """
+        try:
+            with open(dest_path, 'wb') as out:
+                return self.write_attachment(message_id, attachment, out)
+        except BaseException:
+            if os.path.exists(dest_path):
+                os.remove(dest_path)
+            raise
+    
+    def write_attachment(self, message_id: str, attachment: Dict[str, Any], out) -> int:
+        """Write one attachment's decoded bytes to a binary file object; returns the byte count"""
+        if attachment.get('data') is not None:
+            # Small attachments come inline with the message
+            data = attachment['data']
+            return out.write(base64.urlsafe_b64decode(data + '=' * (-len(data) % 4)))
+        return self._stream_attachment(message_id, attachment, out)
+    
+    def _stream_attachment(self, message_id: str, attachment: Dict[str, Any], out) -> int:
+        url = (f"{self._api_root}/gmail/v1/users/me/messages/{message_id}"
+               f"/attachments/{attachment['attachment_id']}")
+        start = time.perf_counter()
+        try:
+            with tracing.span('google.gmail.users.messages.attachments.get', size=attachment.get('size')), \
+                    google_clients.get_session().get(url, params={'fields': 'data'}, stream=True,
+                                                     timeout=Config.ATTACHMENT_TIMEOUT) as response:
+                response.raise_for_status()
+                return mime_utils.decode_base64_stream(response.iter_content(Config.ATTACHMENT_CHUNK_SIZE), out)
+        except Exception:
+            metrics.GOOGLE_API_ERRORS.inc(service='gmail', method='users.messages.attachments.get')
+            raise
+        finally:
+            metrics.GOOGLE_API_SECONDS.observe(time.perf_counter() - start, service='gmail',
+                                               method='users.messages.attachments.get')
+    
+    def send_email(self, to: str, subject: str, body: str) -> bool:
+        """Send an email, retrying on rate limiting and server errors"""
+        result = self._send_one({'to': to, 'subject': subject, 'body': body})
+        if result['status'] != 'sent':
+            print(f"Error sending email: {result['error']}")
+        return result['status'] == 'sent'
+    
+    def send_emails(self, messages: Iterable[Dict[str, str]], max_workers: int = None,
+                    progress=None) -> List[Dict[str, Any]]:
+        """Send many emails ({'to', 'subject', 'body'} dicts) as fast as the Gmail quota allows.
+        
+        Sends share the GMAIL_QUOTA token bucket and are retried with exponential backoff
+        and jitter on 429/5xx. Returns one result per input message, in input order, with
+        'status' of 'sent' (and the Gmail 'message_id') or 'failed' (and the 'error').
+        """
+        max_workers = max_workers or Config.BULK_SEND_WORKERS
+        results = []
+        
+        def collect(futures):
+            for future in futures:
+                results.append(future.result())
+                if progress:
+                    progress(len(results))
+        
+        with tracing.span('gmail.bulk_send', workers=max_workers) as span, \
+                ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='gmail-send') as pool:
+            # Bounded window, so a long queue of messages is not all held as pending futures
+            pending = set()
+            for index, message in enumerate(messages):
+                if len(pending) >= max_workers * 2:
+                    completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(completed)
+                pending.add(pool.submit(tracing.wrap(self._send_indexed), index, message))
+            collect(pending)
+            span.set_attribute('sent', sum(r['status'] == 'sent' for r in results))
+            span.set_attribute('failed', sum(r['status'] != 'sent' for r in results))
+        
+        return sorted(results, key=lambda result: result['index'])
+    
+    def _send_indexed(self, index: int, message: Dict[str, str]) -> Dict[str, Any]:
+        result = self._send_one(message)
+        result['index'] = index
+        return result
+    
+    def _send_one(self, message: Dict[str, str]) -> Dict[str, Any]:
+        """Send one message under the quota bucket; never raises, the outcome is in the result"""
+        result = {'to': message.get('to'), 'subject': message.get('subject', ''), 'attempts': 0}
+        if not message.get('to'):
+            metrics.EMAILS_SENT.inc(status='failed')
+            return dict(result, status='failed', error="Missing recipient ('to')")
+        
+        mime_message = MIMEText(message.get('body', ''))
+        mime_message['to'] = message['to']
+        mime_message['subject'] = message.get('subject', '')
+        raw = base64.urlsafe_b64encode(mime_message.as_bytes()).decode('utf-8')
+        
+        for attempt in range(Config.RETRY_MAX_ATTEMPTS):
+            rate_limit.GMAIL_QUOTA.acquire(rate_limit.GMAIL_QUOTA_COSTS['messages.send'])
+            result['attempts'] = attempt + 1
+            try:
+                sent = self.service.users().messages().send(userId='me', body={'raw': raw}).execute()
+                metrics.EMAILS_SENT.inc(status='sent')
+                return dict(result, status='sent', message_id=sent.get('id'))
+            except Exception as e:
+                if not rate_limit.is_retryable(e) or attempt == Config.RETRY_MAX_ATTEMPTS - 1:
+                    metrics.EMAILS_SENT.inc(status='failed')
+                    return dict(result, status='failed', error=str(e), status_code=rate_limit.status_of(e))
+                delay = rate_limit.backoff_delay(attempt)
+                if rate_limit.status_of(e) == 429:
+                    # Every sender backs off, not just this one
+                    rate_limit.GMAIL_QUOTA.penalize(delay)
+                time.sleep(delay)
     
     def save_emails_to_markdown(self, emails: List[Dict[str, Any]], filename: str = None) -> str:
-        """Save emails to a markdown file"""
+        """Save emails to a markdown file, fetching any bodies that were not loaded yet"""
         if not os.path.exists(Config.EMAIL_MARKDOWN_DIR):
             os.makedirs(Config.EMAIL_MARKDOWN_DIR)
         
@@ -120,19 +673,100 @@ class GmailService:
             filename = f"emails_{timestamp}.md"
         
         filepath = os.path.join(Config.EMAIL_MARKDOWN_DIR, filename)
+        self.fetch_bodies(emails)
         
-        with open(filepath, 'w', encoding='utf-8') as f:
+        with tracing.span('gmail.save_markdown', emails=len(emails)), \
+                open(filepath, 'w', encoding='utf-8') as f:
             f.write("# Email Archive\n\n")
             f.write(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
             
             for i, email_data in enumerate(emails, 1):
-                f.write(f"## Email {i}\n\n")
-                f.write(f"**Subject:** {email_data['subject']}\n\n")
-                f.write(f"**From:** {email_data['sender']}\n\n")
-                f.write(f"**Date:** {email_data['date']}\n\n")
-                f.write(f"**Snippet:** {email_data['snippet']}\n\n")
-                f.write("**Body:**\n\n")
-                f.write(f"{email_data['body']}\n\n")
+                self._write_markdown_email(f, i, email_data)
+        
+        return filepath
+    
+    def save_threads_to_markdown(self, threads: List[Dict[str, Any]], filename: str = None) -> str:
+        """Write threads to markdown, one section per conversation with its replies de-quoted"""
+        if not os.path.exists(Config.EMAIL_MARKDOWN_DIR):
+            os.makedirs(Config.EMAIL_MARKDOWN_DIR)
+        if not filename:
+            filename = f"threads_{datetime.now().strftime('%Y%m%d_%H%M%S')}.md"
+        
+        filepath = os.path.join(Config.EMAIL_MARKDOWN_DIR, os.path.basename(filename))
+        self.fetch_thread_bodies(threads)
+        
+        with tracing.span('gmail.save_thread_markdown', threads=len(threads)), \
+                open(filepath, 'w', encoding='utf-8') as f:
+            f.write("# Email Threads\n\n")
+            f.write(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+            
+            for i, thread in enumerate(threads, 1):
+                f.write(f"## Thread {i}: {thread['subject']}\n\n")
+                f.write(f"**Participants:** {', '.join(thread['participants'])}\n\n")
+                f.write(f"**Messages:** {thread['message_count']}\n\n")
+                for j, email_data in enumerate(thread['messages'], 1):
+                    f.write(f"### {j}. {email_data['sender']} ({email_data['date']})\n\n")
+                    f.write(f"{mime_utils.collapse_quotes(email_data['body'])}\n\n")
                 f.write("---\n\n")
         
-        return filepath 
+        return filepath
+    
+    def archive_to_markdown(self, pages: Iterable[List[Dict[str, Any]]], filename: str = None,
+                            append: bool = True, progress=None) -> Dict[str, Any]:
+        """Stream pages of emails into a markdown archive, one page at a time.
+        
+        Message ids already in the archive (tracked in a `<file>.ids` sidecar) are skipped,
+        so re-running an archive only adds new mail. With append=False the archive starts over.
+        """
+        if not os.path.exists(Config.EMAIL_MARKDOWN_DIR):
+            os.makedirs(Config.EMAIL_MARKDOWN_DIR)
+        if not filename:
+            filename = f"emails_{datetime.now().strftime('%Y%m%d_%H%M%S')}.md"
+        
+        # Archive names can come from job requests, so keep them inside EMAIL_MARKDOWN_DIR
+        filepath = os.path.join(Config.EMAIL_MARKDOWN_DIR, os.path.basename(filename))
+        ids_path = filepath + '.ids'
+        archived = set()
+        if append and os.path.exists(filepath) and os.path.exists(ids_path):
+            with open(ids_path, 'r', encoding='utf-8') as f:
+                archived = {line.strip() for line in f if line.strip()}
+        else:
+            append = False
+        
+        written = skipped = 0
+        with tracing.span('gmail.archive_markdown', append=append) as span, \
+                open(filepath, 'a' if append else 'w', encoding='utf-8') as f, \
+                open(ids_path, 'a' if append else 'w', encoding='utf-8') as ids_file:
+            if not append:
+                f.write("# Email Archive\n\n")
+                f.write(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+            
+            for page in pages:
+                new_emails = [e for e in page if e['id'] not in archived]
+                skipped += len(page) - len(new_emails)
+                self.fetch_bodies(new_emails)
+                for email_data in new_emails:
+                    self._write_markdown_email(f, len(archived) + 1, email_data)
+                    archived.add(email_data['id'])
+                # Ids are recorded only after their emails are on disk
+                f.flush()
+                ids_file.write(''.join(f"{e['id']}\n" for e in new_emails))
+                ids_file.flush()
+                written += len(new_emails)
+                if progress:
+                    progress(written, skipped)
+            
+            span.set_attribute('written', written)
+            span.set_attribute('skipped', skipped)
+        
+        return {'filepath': filepath, 'written': written, 'skipped': skipped}
+    
+    def _write_markdown_email(self, f, index: int, email_data: Dict[str, Any]):
+        f.write(f"## Email {index}\n\n")
+        f.write(f"**Subject:** {email_data['subject']}\n\n")
+        f.write(f"**From:** {email_data['sender']}\n\n")
+        f.write(f"**Date:** {email_data['date']}\n\n")
+        f.write(f"**Snippet:** {email_data['snippet']}\n\n")
+        f.write("**Body:**\n\n")
+        f.write(f"{email_data['body']}\n\n")
+        f.write("---\n\n")
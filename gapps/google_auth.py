@@ -1,10 +1,5 @@
-import os
-import json
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.exceptions import RefreshError
 from config import Config
+import credential_manager
 
 class GoogleAuth:
     def __init__(self, scopes, token_file=None):
@@ -18,58 +13,18 @@ class GoogleAuth:
         
     def authenticate(self):
         """Authenticate with Google APIs using OAuth2"""
-        creds = None
-        
-        # Check if token file exists
-        if os.path.exists(self.token_file):
-            try:
-                creds = Credentials.from_authorized_user_file(self.token_file, self.scopes)
-                print(f"Loaded credentials from {self.token_file}")
-                
-                # Check if refresh token exists
-                if not creds.refresh_token:
-                    print(f"No refresh token found in {self.token_file}, regenerating...")
-                    creds = None
-                    
-            except Exception as e:
-                print(f"Error loading credentials from {self.token_file}: {e}")
-                creds = None
-        
-        # If no valid credentials available, let user log in
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                try:
-                    creds.refresh(Request())
-                except RefreshError:
-                    print(f"Token expired, getting new credentials...")
-                    self._get_new_credentials()
-            else:
-                print(f"Getting new credentials...")
-                self._get_new_credentials()
-                
-        self.credentials = creds
-        return creds
+        # The process-wide manager owns the token (Config.TOKEN_FILE, with every scope) and keeps it fresh
+        self.credentials = self._manager().credentials
+        return self.credentials
     
     def _get_new_credentials(self):
         """Get new credentials through OAuth2 flow"""
-        if not os.path.exists(Config.CREDENTIALS_FILE):
-            raise FileNotFoundError(
-                f"Credentials file '{Config.CREDENTIALS_FILE}' not found. "
-                "Please download it from Google Cloud Console."
-            )
-        
-        flow = InstalledAppFlow.from_client_secrets_file(
-            Config.CREDENTIALS_FILE, self.scopes
-        )
-        # Ensure we get refresh tokens
-        creds = flow.run_local_server(port=0, access_type='offline', prompt='consent')
-        
-        # Save credentials for next run
-        with open(self.token_file, 'w') as token:
-            token.write(creds.to_json())
-        
-        print(f"Saved new credentials to {self.token_file}")
-        return creds
+        return self._manager(start=False).run_flow()
+    
+    def _manager(self, start=True):
+        if self.token_file != Config.TOKEN_FILE or not set(self.scopes) <= set(Config.GOOGLE_SCOPES):
+            raise ValueError(f"Google services share one token with Config.GOOGLE_SCOPES in {Config.TOKEN_FILE}")
+        return credential_manager.get_manager(start=start)
     
     def get_authenticated_service(self, service_name, version='v1'):
         """Get authenticated service instance"""
@@ -78,4 +33,4 @@ class GoogleAuth:
         if not self.credentials:
             self.authenticate()
         
-        return build(service_name, version, credentials=self.credentials) 
\ No newline at end of file
+        return build(service_name, version, credentials=self.credentials) 
@@ -0,0 +1,197 @@
+"""
+Shared Google API clients
+
+Gmail and Calendar use one set of credentials (a single token with both
+scopes, kept fresh by credential_manager), discovery documents that are
+loaded once per process (the static copies bundled with
+google-api-python-client, or fetched once and cached on disk), and one
+keep-alive HTTP transport instead of a new connection setup per service.
+
+httplib2 connections are not thread-safe, so the shared transport is a pool:
+each request checks out an idle AuthorizedHttp (opening a new one while
+fewer than GOOGLE_HTTP_POOL_SIZE exist) and returns it when done. One
+service object can then be used from any number of threads at once; a
+request that finds every connection busy for GOOGLE_HTTP_POOL_WAIT seconds
+fails with a TimeoutError instead of hanging.
+"""
+
+import json
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Dict, Tuple
+import httplib2
+import google_auth_httplib2
+from google.auth.credentials import AnonymousCredentials
+from google.auth.transport.requests import AuthorizedSession
+from requests.adapters import HTTPAdapter
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import DISCOVERY_URI, V2_DISCOVERY_URI, build_from_document
+from config import Config
+import credential_manager
+import metrics
+
+_lock = threading.RLock()
+_credentials = None
+_http = None
+_session = None
+_request_class = None
+_documents: Dict[str, Tuple[str, str]] = {}
+
+
+def get_credentials():
+    """The credentials shared by every Google service in this process"""
+    global _credentials
+    with _lock:
+        if _credentials is None:
+            if Config.GOOGLE_API_ENDPOINT:
+                # Local fake API for load testing: no OAuth
+                _credentials = AnonymousCredentials()
+            else:
+                # Refreshed in the background before expiry, so requests never wait for a refresh
+                _credentials = credential_manager.get_manager().credentials
+        return _credentials
+
+
+def new_http() -> google_auth_httplib2.AuthorizedHttp:
+    """A new authorized connection; httplib2 connections must not be shared between threads"""
+    return google_auth_httplib2.AuthorizedHttp(
+        get_credentials(), http=httplib2.Http(timeout=Config.GOOGLE_HTTP_TIMEOUT)
+    )
+
+
+class HttpPool:
+    """Thread-safe stand-in for an httplib2.Http, backed by a pool of AuthorizedHttp connections"""
+
+    def __init__(self, size: int = None, wait: float = None):
+        self.size = size or Config.GOOGLE_HTTP_POOL_SIZE
+        self.wait = Config.GOOGLE_HTTP_POOL_WAIT if wait is None else wait
+        self._idle = queue.LifoQueue()  # most recently used first: its connection is still open
+        self._created = 0
+        self._lock = threading.Lock()
+        metrics.GOOGLE_HTTP_CONNECTIONS.set_function(self._idle.qsize, state='idle')
+        metrics.GOOGLE_HTTP_CONNECTIONS.set_function(lambda: self._created - self._idle.qsize(), state='in_use')
+
+    @property
+    def credentials(self):
+        # googleapiclient reads this to refresh and apply credentials (e.g. in batch requests)
+        return get_credentials()
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the calling thread, waiting up to `wait` seconds if all `size` are busy"""
+        try:
+            http = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                http = new_http()
+            else:
+                try:
+                    http = self._idle.get(timeout=self.wait)
+                except queue.Empty:
+                    raise TimeoutError(
+                        f"All {self.size} Google API connections stayed busy for {self.wait:g}s; "
+                        "raise GOOGLE_HTTP_POOL_SIZE or GOOGLE_HTTP_POOL_WAIT"
+                    ) from None
+        try:
+            yield http
+        finally:
+            self._idle.put(http)
+
+    def request(self, *args, **kwargs):
+        with self.connection() as http:
+            return http.request(*args, **kwargs)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def get_http() -> HttpPool:
+    """The process-wide transport; keeps connections to Google alive between calls"""
+    global _http
+    with _lock:
+        if _http is None:
+            _http = HttpPool()
+        return _http
+
+
+def get_session() -> AuthorizedSession:
+    """Shared requests session for streamed downloads, with a pool of GOOGLE_HTTP_POOL_SIZE connections"""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = AuthorizedSession(get_credentials())
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=Config.GOOGLE_HTTP_POOL_SIZE)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+        return _session
+
+
+def request_class():
+    global _request_class
+    with _lock:
+        if _request_class is None:
+            _request_class = metrics.instrumented_request_class()
+        return _request_class
+
+
+def discovery_document(name: str, version: str) -> Tuple[str, str]:
+    """Discovery document JSON and the API's servicePath, read at most once per process.
+
+    Uses the copy bundled with the client library when there is one; otherwise the
+    document is fetched once and kept in DISCOVERY_CACHE_DIR for later runs.
+    """
+    key = f"{name}.{version}"
+    with _lock:
+        if key in _documents:
+            return _documents[key]
+
+        # Older client libraries do not bundle documents
+        get_static_doc = getattr(discovery_cache, 'get_static_doc', None)
+        document = get_static_doc(name, version) if get_static_doc else None
+        cache_path = os.path.join(Config.DISCOVERY_CACHE_DIR, f"{key}.json")
+        if document is None and os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                document = f.read()
+        if document is None:
+            document = _fetch_document(name, version)
+            os.makedirs(Config.DISCOVERY_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{cache_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(document)
+            os.replace(tmp_path, cache_path)
+
+        _documents[key] = (document, json.loads(document).get('servicePath', ''))
+        return _documents[key]
+
+
+def _fetch_document(name: str, version: str) -> str:
+    http = httplib2.Http(timeout=Config.GOOGLE_HTTP_TIMEOUT)
+    for template in (DISCOVERY_URI, V2_DISCOVERY_URI):
+        response, content = http.request(template.format(api=name, apiVersion=version))
+        if response.status == 200:
+            return content.decode('utf-8')
+    raise RuntimeError(f"Could not fetch the discovery document for {name} {version}")
+
+
+def build_service(name: str, version: str, http=None):
+    """Build an API client on the shared pooled transport (or `http`) without any network round-trip.
+
+    The client is safe to use from several threads at once.
+    """
+    document, service_path = discovery_document(name, version)
+    client_options = None
+    if Config.GOOGLE_API_ENDPOINT:
+        client_options = {'api_endpoint': f"{Config.GOOGLE_API_ENDPOINT.rstrip('/')}/{service_path}"}
+    # build_from_document() modifies the parsed document, so each build parses its own copy
+    return build_from_document(document, http=http or get_http(), client_options=client_options,
+                               requestBuilder=request_class())
@@ -0,0 +1,228 @@
+"""
+Background job subsystem for long-running assistant actions
+
+Submitting a job returns an id straight away; the work runs on a bounded
+worker pool and the job record (status, progress, result) is written to
+Config.JOB_DIR after every change, so clients can poll or reconnect later.
+Kinds that send mail as the user or read files on the server also need
+Config.JOB_TOKEN.
+"""
+
+import hmac
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+from config import Config
+import metrics
+import tracing
+
+TERMINAL_STATUSES = ('succeeded', 'failed')
+
+
+def _run_query(assistant, params, progress):
+    return assistant.process_user_query(params['query'])
+
+
+def _run_telegram_analysis(assistant, params, progress):
+    return assistant.analyze_telegram_chat(params['person_name'].lower(), progress=progress)
+
+
+def _run_archive_inbox(assistant, params, progress):
+    max_results = params.get('max_results', 100)
+    return assistant.archive_emails(
+        max_results=int(max_results) if max_results is not None else None,
+        query=params.get('query'),
+        filename=params.get('filename'),
+        append=params.get('append', True),
+        progress=progress
+    )
+
+
+def _run_export_attachments(assistant, params, progress):
+    max_results = params.get('max_results')
+    return assistant.export_attachments(
+        query=params.get('query', 'has:attachment'),
+        max_results=int(max_results) if max_results is not None else None,
+        progress=progress
+    )
+
+
+def _run_send_emails(assistant, params, progress):
+    messages = params.get('messages')
+    if not isinstance(messages, list) or not messages:
+        raise ValueError("'messages' must be a non-empty list of {to, subject, body}")
+    return assistant.send_bulk_emails(messages, progress=progress)
+
+
+def _run_email_digest(assistant, params, progress):
+    max_results = params.get('max_results')
+    result = assistant.email_digest(
+        max_results=int(max_results) if max_results is not None else None,
+        query=params.get('query'),
+        progress=progress
+    )
+    result['emails'] = [
+        {key: email_data.get(key) for key in ('id', 'thread_id', 'subject', 'sender', 'date', 'summary')}
+        for email_data in result['emails']
+    ]
+    return result
+
+
+def _run_import_mailbox(assistant, params, progress):
+    if not params.get('path'):
+        raise ValueError("'path' must name an mbox file or a directory of mbox/.eml files on the server")
+    return assistant.import_mailbox(params['path'], progress=progress)
+
+
+# Job kinds that can be submitted, mapped to the function that runs them
+JOB_KINDS: Dict[str, Callable] = {
+    'query': _run_query,
+    'telegram_analysis': _run_telegram_analysis,
+    'archive_inbox': _run_archive_inbox,
+    'export_attachments': _run_export_attachments,
+    'send_emails': _run_send_emails,
+    'email_digest': _run_email_digest,
+    'import_mailbox': _run_import_mailbox,
+}
+
+# Kinds that act as the user (sending mail) or read arbitrary server paths
+PRIVILEGED_KINDS = ('send_emails', 'import_mailbox')
+
+
+def check_job_token(kind: str, token: Optional[str]) -> bool:
+    """Privileged kinds are only available when JOB_TOKEN is set and matches"""
+    if kind not in PRIVILEGED_KINDS:
+        return True
+    if not Config.JOB_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token, Config.JOB_TOKEN)
+
+
+class JobManager:
+    def __init__(self, assistant, job_dir: str = None, max_workers: int = None):
+        self.assistant = assistant
+        self.job_dir = job_dir or Config.JOB_DIR
+        if not os.path.exists(self.job_dir):
+            os.makedirs(self.job_dir)
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or Config.JOB_WORKERS,
+            thread_name_prefix='job'
+        )
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._mark_interrupted_jobs()
+        metrics.QUEUE_DEPTH.set_function(self.queue_depth, queue='jobs')
+
+    def submit(self, kind: str, params: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Queue a job and return its record"""
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind '{kind}'. Available: {', '.join(JOB_KINDS)}")
+
+        now = datetime.now().isoformat()
+        job = {
+            'id': uuid.uuid4().hex,
+            'kind': kind,
+            'params': params or {},
+            'status': 'queued',
+            'progress': 0.0,
+            'message': '',
+            'result': None,
+            'error': None,
+            'created_at': now,
+            'updated_at': now,
+        }
+        with self._lock:
+            self._jobs[job['id']] = job
+            self._persist(job)
+            # Copied before a worker can pick it up, so callers always see it queued
+            queued = dict(job)
+        self._executor.submit(self._run, job['id'])
+        return queued
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job record, loading it from disk if this process did not run it"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                return dict(job)
+        return self._load(job_id)
+
+    def wait_for_update(self, job_id: str, since: str, timeout: float = 1.0) -> Optional[Dict[str, Any]]:
+        """Block until a job's updated_at moves past `since` or the timeout expires"""
+        with self._changed:
+            self._changed.wait_for(
+                lambda: job_id not in self._jobs or self._jobs[job_id]['updated_at'] != since,
+                timeout=timeout
+            )
+        return self.get(job_id)
+
+    def queue_depth(self) -> int:
+        """Number of jobs waiting for a worker"""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job['status'] == 'queued')
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job_id: str):
+        job = self._jobs[job_id]
+        self._update(job_id, status='running')
+
+        def progress(fraction: float, message: str = ''):
+            self._update(job_id, progress=round(min(max(fraction, 0.0), 1.0), 3), message=message)
+
+        try:
+            with tracing.start_trace(f"job.{job['kind']}", job_id=job_id), metrics.count_request_tokens():
+                result = JOB_KINDS[job['kind']](self.assistant, job['params'], progress)
+            self._update(job_id, status='succeeded', progress=1.0, message='Done', result=result)
+        except Exception as e:
+            self._update(job_id, status='failed', message='Failed', error=str(e))
+
+    def _update(self, job_id: str, **fields):
+        with self._changed:
+            job = self._jobs[job_id]
+            job.update(fields)
+            job['updated_at'] = datetime.now().isoformat()
+            self._persist(job)
+            if job['status'] in TERMINAL_STATUSES:
+                # Finished jobs are served from disk from now on
+                del self._jobs[job_id]
+            self._changed.notify_all()
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.job_dir, f"{job_id}.json")
+
+    def _persist(self, job: Dict[str, Any]):
+        # Write to a temp file and rename so readers never see a partial record
+        path = self._path(job['id'])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, path)
+
+    def _load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        # Ids are uuid hex; anything else cannot be a job file
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._path(job_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _mark_interrupted_jobs(self):
+        """Fail jobs that a previous process left queued or running"""
+        for filename in os.listdir(self.job_dir):
+            if not filename.endswith('.json'):
+                continue
+            job = self._load(filename[:-len('.json')])
+            if job and job['status'] not in TERMINAL_STATUSES:
+                job.update(status='failed', error='Interrupted by server restart',
+                           updated_at=datetime.now().isoformat())
+                self._persist(job)
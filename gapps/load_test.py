@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Load test for the assistant servers with a stubbed model and fake Google APIs
+
+Starts the fake Gmail/Calendar server, launches main.py (FastAPI) or
+run.py (Flask) with INFERENCE_BACKEND=stub pointed at it, then drives
+mixed-intent traffic with Poisson arrivals at a fixed rate and reports
+throughput, error rate and latency percentiles per intent.
+
+Usage:
+    python load_test.py --server main --rate 5 --duration 60 --output before.json
+    python load_test.py --server main --rate 5 --duration 60 --compare before.json
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+import fake_google_server
+
+# Queries that route to each intent through the keyword router
+INTENT_QUERIES = {
+    'general': ["How can I be more productive?", "Tell me a joke", "Help me plan my day"],
+    'inbox': ["Check my inbox", "show messages", "read email"],
+    'search': ["search emails about invoice", "find emails from alice"],
+    'send': ["send a mail to bob@example.com about the report"],
+    'calendar': ["What are today's events?", "what's on today", "yesterday's events"],
+    'create_event': ["schedule meeting with carol tomorrow at 3pm"],
+    'geeta': ["geeta guidance on handling stress"],
+}
+
+DEFAULT_MIX = 'general=0.3,inbox=0.25,search=0.1,send=0.05,calendar=0.2,create_event=0.05,geeta=0.05'
+
+SERVERS = {
+    # name: (command, port, query path, payload key)
+    'main': ([sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', '{port}',
+              '--log-level', 'warning'], 8000, '/query', 'query'),
+    'run': ([sys.executable, 'run.py'], 5000, '/get_response', 'message'),
+}
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        if name not in INTENT_QUERIES:
+            raise ValueError(f"Unknown intent '{name}'. Available: {', '.join(INTENT_QUERIES)}")
+        weights[name] = float(weight)
+    return weights
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    total = len(latencies) + errors
+    return {
+        'requests': total,
+        'errors': errors,
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'throughput_rps': round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        'latency_ms': {
+            name: round(value * 1000, 1) if value is not None else None
+            for name, value in (
+                ('p50', percentile(latencies, 50)),
+                ('p90', percentile(latencies, 90)),
+                ('p95', percentile(latencies, 95)),
+                ('p99', percentile(latencies, 99)),
+                ('max', max(latencies) if latencies else None),
+            )
+        },
+    }
+
+
+def wait_until_ready(base_url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"{base_url}/health", timeout=2) as response:
+                health = json.loads(response.read())
+                if health.get('assistant_ready') or health.get('ai_assistant_ready'):
+                    return
+        except (urllib.error.URLError, ConnectionError, ValueError):
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Server at {base_url} did not become ready within {timeout:.0f}s")
+
+
+def start_assistant_server(name: str, port: int, google_endpoint: str, extra_env: Dict[str, str],
+                           state_dir: str):
+    """Launch the server against the fake Google API, keeping its local caches under state_dir"""
+    command, default_port, _, _ = SERVERS[name]
+    env = dict(os.environ)
+    env.update({
+        'INFERENCE_BACKEND': 'stub',
+        'GOOGLE_API_ENDPOINT': google_endpoint,
+        'MAIL_CACHE_PATH': os.path.join(state_dir, 'mail_cache.sqlite3'),
+        'EVENT_CACHE_PATH': os.path.join(state_dir, 'event_cache.sqlite3'),
+        'VECTOR_INDEX_DIR': os.path.join(state_dir, 'mail_vectors'),
+        'EMBEDDING_BACKEND': 'hashing',
+        'TRACE_EXPORTER': env.get('TRACE_EXPORTER', 'none'),
+        'PORT': str(port),
+        'BRIDGE_PORT': str(port),
+    })
+    env.update(extra_env)
+    command = [part.replace('{port}', str(port)) for part in command]
+    return subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                            stdout=subprocess.DEVNULL)
+
+
+def run_load(base_url: str, path: str, payload_key: str, weights: Dict[str, float],
+             rate: float, duration: float, concurrency: int, seed: int) -> Dict[str, Any]:
+    """Open-loop load: requests are sent on a Poisson schedule regardless of how fast the server answers"""
+    rng = random.Random(seed)
+    intents = list(weights)
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+
+    def send(intent: str, query: str, scheduled: float):
+        body = json.dumps({payload_key: query}).encode('utf-8')
+        request = urllib.request.Request(f"{base_url}{path}", data=body,
+                                         headers={'Content-Type': 'application/json'}, method='POST')
+        ok = False
+        try:
+            with urllib.request.urlopen(request, timeout=300) as response:
+                result = json.loads(response.read())
+                ok = result.get('success', result.get('status') == 'success')
+        except Exception:
+            ok = False
+        # Measured from the scheduled send time so queueing in the client is not hidden
+        elapsed = time.perf_counter() - scheduled
+        with lock:
+            if ok:
+                latencies[intent].append(elapsed)
+            else:
+                errors[intent] += 1
+
+    start = time.perf_counter()
+    next_send = start
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while next_send - start < duration:
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            intent = rng.choices(intents, weights=[weights[i] for i in intents])[0]
+            executor.submit(send, intent, rng.choice(INTENT_QUERIES[intent]), next_send)
+            next_send += rng.expovariate(rate)
+    elapsed = time.perf_counter() - start
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    report = {
+        'overall': summarize(all_latencies, sum(errors.values()), elapsed),
+        'by_intent': {intent: summarize(latencies[intent], errors[intent], elapsed) for intent in intents},
+        'elapsed_seconds': round(elapsed, 2),
+    }
+    return report
+
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    def row(name: str, stats: Dict[str, Any], base: Optional[Dict[str, Any]]):
+        line = (f"{name:<14}{stats['requests']:>7}{stats['error_rate'] * 100:>8.1f}%"
+                f"{stats['throughput_rps']:>9.2f}")
+        for key in ('p50', 'p95', 'p99'):
+            value = stats['latency_ms'][key]
+            line += f"{value if value is not None else '-':>10}"
+            if base and value is not None and base['latency_ms'].get(key):
+                change = (value - base['latency_ms'][key]) / base['latency_ms'][key] * 100
+                line += f" ({change:+.0f}%)"
+        print(line)
+
+    print(f"\n{'intent':<14}{'reqs':>7}{'errors':>9}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    print("-" * 70)
+    for intent, stats in report['by_intent'].items():
+        row(intent, stats, baseline['by_intent'].get(intent) if baseline else None)
+    print("-" * 70)
+    row('overall', report['overall'], baseline['overall'] if baseline else None)
+    if baseline:
+        print(f"\nThroughput: {baseline['overall']['throughput_rps']:.2f} -> "
+              f"{report['overall']['throughput_rps']:.2f} rps")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the assistant with stubbed model and Google APIs")
+    parser.add_argument("--server", choices=list(SERVERS), default='main', help="Which server to launch")
+    parser.add_argument("--url", help="Test an already running server instead of launching one")
+    parser.add_argument("--port", type=int, help="Port for the launched server")
+    parser.add_argument("--rate", type=float, default=5.0, help="Mean arrival rate (requests/second)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of traffic to send")
+    parser.add_argument("--concurrency", type=int, default=64, help="Maximum requests in flight")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Intent weights, e.g. 'general=0.5,inbox=0.5'")
+    parser.add_argument("--google-latency-ms", type=float, default=40.0, help="Fake Google API latency")
+    parser.add_argument("--messages", type=int, default=500, help="Fake mailbox size")
+    parser.add_argument("--env", action='append', default=[], help="Extra KEY=VALUE for the server")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", "-o", help="Write the report as JSON")
+    parser.add_argument("--compare", help="Baseline JSON report to compare against")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    _, default_port, path, payload_key = SERVERS[args.server]
+    process = None
+    fake = None
+    state_dir = None
+
+    try:
+        if args.url:
+            base_url = args.url.rstrip('/')
+        else:
+            fake = fake_google_server.start_server(0, args.messages, latency_ms=args.google_latency_ms)
+            google_endpoint = f"http://127.0.0.1:{fake.server_address[1]}"
+            port = args.port or default_port
+            extra_env = dict(item.split('=', 1) for item in args.env)
+            print(f"🧪 Fake Google API: {google_endpoint} ({args.google_latency_ms:.0f}ms per call)")
+            print(f"🚀 Starting {args.server}.py with the stub model on port {port}...")
+            # Fake-server mail must never land in the user's real caches
+            state_dir = tempfile.mkdtemp(prefix='load_test_')
+            process = start_assistant_server(args.server, port, google_endpoint, extra_env, state_dir)
+            base_url = f"http://127.0.0.1:{port}"
+            wait_until_ready(base_url, timeout=120)
+
+        print(f"📈 Sending ~{args.rate:g} req/s for {args.duration:g}s to {base_url}{path}")
+        report = run_load(base_url, path, payload_key, weights, args.rate, args.duration,
+                          args.concurrency, args.seed)
+        report['config'] = {key: getattr(args, key) for key in
+                            ('server', 'rate', 'duration', 'concurrency', 'mix', 'google_latency_ms')}
+        if fake:
+            with urllib.request.urlopen(f"http://127.0.0.1:{fake.server_address[1]}/__stats") as response:
+                report['google_api_calls'] = json.loads(response.read())
+
+        baseline = None
+        if args.compare:
+            with open(args.compare, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        print_report(report, baseline)
+        if report.get('google_api_calls'):
+            print(f"\nFake Google API calls: {report['google_api_calls']}")
+
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            print(f"\n📝 Report saved to {args.output}")
+    finally:
+        if process:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if fake:
+            fake.shutdown()
+        if state_dir:
+            shutil.rmtree(state_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
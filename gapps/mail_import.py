@@ -0,0 +1,290 @@
+r"""
+Bulk import of mail exports into the local mailbox cache
+
+Seeds the cache from a Google Takeout mbox (or any mbox file, or a
+directory of mbox and .eml files) instead of the Gmail API, so onboarding a
+large mailbox costs no quota. Files are read sequentially, a message at a
+time, and handed to a pool of IMPORT_WORKERS processes in batches of about
+IMPORT_BATCH_BYTES; at most two batches per worker are in flight, so
+memory stays bounded whatever the size of the export. Parsed messages are
+written to the cache by this process, one transaction per batch, and show
+up in full-text and semantic search like synced mail.
+
+Takeout mboxes carry each message's Gmail id (on the "From " line), thread
+id (X-GM-THRID) and labels (X-Gmail-Labels), so imported messages line up
+with what GmailService syncs later. Other messages get a local id. A
+message is skipped when one with the same id or Message-ID header is
+already cached, so an export can be imported again or on top of synced
+mail.
+
+The server runs imports through run_in_subprocess(), i.e. this script:
+spawned workers import the parent's __main__, and for the server that
+would mean loading main.py and the model in every worker.
+
+    python mail_import.py ~/Takeout/Mail/All\ mail\ Including\ Spam\ and\ Trash.mbox
+"""
+
+import argparse
+import email
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from config import Config
+from mail_store import LOCAL_ID_PREFIX, MailStore
+import metrics
+import mime_utils
+import tracing
+
+# mboxrd quoting: a body line starting with "From " is written as ">From ", ">>From " as ">>>From " ...
+QUOTED_FROM = re.compile(rb'^>+From ')
+GMAIL_FROM_LINE = re.compile(rb'^From (\d+)@xxx ')
+SNIPPET_CHARS = 200
+
+# Takeout label names to Gmail label ids; other labels are kept by name
+TAKEOUT_LABELS = {
+    'inbox': 'INBOX', 'sent': 'SENT', 'drafts': 'DRAFT', 'draft': 'DRAFT', 'unread': 'UNREAD',
+    'starred': 'STARRED', 'important': 'IMPORTANT', 'spam': 'SPAM', 'trash': 'TRASH', 'chat': 'CHAT',
+    'category personal': 'CATEGORY_PERSONAL', 'category social': 'CATEGORY_SOCIAL',
+    'category promotions': 'CATEGORY_PROMOTIONS', 'category updates': 'CATEGORY_UPDATES',
+    'category forums': 'CATEGORY_FORUMS',
+}
+# Takeout marks read mail "Opened"; it has no Gmail label
+IGNORED_LABELS = {'opened'}
+
+
+def list_sources(path: str) -> List[str]:
+    """The mbox and .eml files at path (a file, or a directory searched recursively), in name order"""
+    if os.path.isfile(path):
+        return [path]
+    sources = []
+    for directory, _, files in os.walk(path):
+        for name in files:
+            if name.lower().endswith(('.mbox', '.eml')):
+                sources.append(os.path.join(directory, name))
+    return sorted(sources)
+
+
+def iter_mbox(path: str) -> Iterator[Tuple[bytes, bytes]]:
+    """(From_ line, raw message) for each message of an mbox file, read a line at a time"""
+    with open(path, 'rb') as f:
+        from_line, lines, after_blank = None, [], True
+        for line in f:
+            if after_blank and line.startswith(b'From '):
+                if from_line is not None:
+                    yield from_line, b''.join(lines)
+                from_line, lines = line, []
+            else:
+                lines.append(line[1:] if QUOTED_FROM.match(line) else line)
+            after_blank = line in (b'\n', b'\r\n')
+        if from_line is not None:
+            yield from_line, b''.join(lines)
+
+
+def iter_messages(sources: List[str]) -> Iterator[Tuple[bytes, bytes]]:
+    """(From_ line or b'', raw message) for every message in the sources"""
+    for path in sources:
+        if path.lower().endswith('.eml'):
+            with open(path, 'rb') as f:
+                yield b'', f.read()
+        else:
+            yield from iter_mbox(path)
+
+
+def _local_id(key: str) -> str:
+    return LOCAL_ID_PREFIX + hashlib.sha1(key.encode('utf-8', errors='replace')).hexdigest()[:20]
+
+
+def _labels(value: str) -> List[str]:
+    labels = []
+    for label in re.findall(r'"[^"]*"|[^,]+', value or ''):
+        label = label.strip().strip('"')
+        if label and label.lower() not in IGNORED_LABELS:
+            labels.append(TAKEOUT_LABELS.get(label.lower(), label))
+    return labels
+
+
+def parse_message(from_line: bytes, raw: bytes) -> Dict[str, Any]:
+    """The cache's email dict for one raw RFC 822 message"""
+    msg = email.message_from_bytes(raw)
+    rfc822_id = (msg.get('Message-ID') or '').strip() or None
+
+    gmail_id = GMAIL_FROM_LINE.match(from_line)
+    if gmail_id:
+        # Takeout writes Gmail's ids in decimal; the API uses hex
+        message_id = format(int(gmail_id.group(1)), 'x')
+    else:
+        message_id = _local_id(rfc822_id or hashlib.sha1(raw).hexdigest())
+    thread = (msg.get('X-GM-THRID') or '').strip()
+    if thread.isdigit():
+        thread_id = format(int(thread), 'x')
+    else:
+        # The first message a reply refers to roots its conversation
+        references = re.findall(r'<[^>]+>', f"{msg.get('References', '')} {msg.get('In-Reply-To', '')}")
+        thread_id = _local_id(references[0] if references else (rfc822_id or message_id))
+
+    date = msg.get('Date')
+    try:
+        internal_date = int(parsedate_to_datetime(date).astimezone(timezone.utc).timestamp() * 1000)
+    except (TypeError, ValueError, IndexError):
+        internal_date = 0
+
+    body = mime_utils.message_body(msg)
+    labels = _labels(msg.get('X-Gmail-Labels')) if msg.get('X-Gmail-Labels') is not None else ['INBOX']
+    return {
+        'id': message_id,
+        'thread_id': thread_id,
+        'subject': mime_utils.decode_header_value(msg.get('Subject')) or 'No Subject',
+        'sender': mime_utils.decode_header_value(msg.get('From')) or 'Unknown',
+        'date': date or 'Unknown',
+        'internal_date': internal_date,
+        'snippet': '' if body == mime_utils.NO_CONTENT else ' '.join(body.split())[:SNIPPET_CHARS],
+        'labels': labels,
+        'body': body,
+        'rfc822_id': rfc822_id,
+    }
+
+
+def parse_batch(batch: List[Tuple[bytes, bytes]]) -> List[Optional[Dict[str, Any]]]:
+    """Runs in a worker process; None for each message that could not be parsed"""
+    emails = []
+    for from_line, raw in batch:
+        try:
+            emails.append(parse_message(from_line, raw))
+        except Exception:
+            emails.append(None)
+    return emails
+
+
+class MailImporter:
+    def __init__(self, store: MailStore, index=None, workers: int = None):
+        self.store = store
+        self.index = index
+        self.workers = workers or Config.IMPORT_WORKERS or os.cpu_count() or 1
+
+    def run(self, path: str, progress=None) -> Dict[str, Any]:
+        """Import every message under path; returns counts of imported, duplicate and unreadable messages"""
+        sources = list_sources(path)
+        if not sources:
+            raise FileNotFoundError(f"No .mbox or .eml files found at {path}")
+        total_bytes = sum(os.path.getsize(source) for source in sources)
+        totals = {'messages': 0, 'imported': 0, 'duplicates': 0, 'failed': 0}
+
+        with tracing.span('mail_import.run', files=len(sources), bytes=total_bytes) as span:
+            read = 0
+            # Spawned, not forked: the caller may hold a CUDA context and live threads
+            with ProcessPoolExecutor(max_workers=self.workers,
+                                     mp_context=multiprocessing.get_context('spawn')) as pool:
+                pending = set()
+                for batch in self._batches(sources):
+                    pending.add(pool.submit(parse_batch, batch))
+                    read += sum(len(from_line) + len(raw) for from_line, raw in batch)
+                    # Bounded window: parse ahead by at most two batches per worker
+                    while len(pending) >= self.workers * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self._store(future.result(), totals)
+                        if progress:
+                            progress(read / total_bytes if total_bytes else 1.0, dict(totals))
+                for future in wait(pending).done:
+                    self._store(future.result(), totals)
+            if progress:
+                progress(1.0, dict(totals))
+
+            for key, value in totals.items():
+                span.set_attribute(key, value)
+        if self.index is not None and totals['imported']:
+            # Imported mail is searchable by meaning as well as by keyword
+            totals['embedded'] = self.index.update()['added']
+        return totals
+
+    def _batches(self, sources: List[str]) -> Iterator[List[Tuple[bytes, bytes]]]:
+        batch, size = [], 0
+        for from_line, raw in iter_messages(sources):
+            batch.append((from_line, raw))
+            size += len(raw)
+            if size >= Config.IMPORT_BATCH_BYTES:
+                yield batch
+                batch, size = [], 0
+        if batch:
+            yield batch
+
+    def _store(self, emails: List[Optional[Dict[str, Any]]], totals: Dict[str, int]):
+        parsed = [email_data for email_data in emails if email_data is not None]
+        imported = self.store.import_messages(parsed)
+        totals['messages'] += len(emails)
+        totals['imported'] += imported
+        totals['duplicates'] += len(parsed) - imported
+        totals['failed'] += len(emails) - len(parsed)
+        metrics.MAIL_IMPORT_MESSAGES.inc(imported, result='imported')
+        metrics.MAIL_IMPORT_MESSAGES.inc(len(parsed) - imported, result='duplicate')
+        metrics.MAIL_IMPORT_MESSAGES.inc(len(emails) - len(parsed), result='failed')
+
+
+
+def run_in_subprocess(path: str, cache_path: str, embed: bool = True, workers: int = None,
+                      progress=None) -> Dict[str, Any]:
+    """MailImporter.run() in a child running this script, so its workers import only this module"""
+    command = [sys.executable, os.path.abspath(__file__), path, '--cache', cache_path, '--progress-jsonl']
+    if not embed:
+        command.append('--no-embed')
+    if workers:
+        command += ['--workers', str(workers)]
+    result, last_output = None, ''
+    # One stream, so the child can never block on a full pipe that is not being read
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True) as child:
+        for line in child.stdout:
+            try:
+                update = json.loads(line)
+            except ValueError:
+                update = None
+            if not isinstance(update, dict):
+                # The child's own messages and tracebacks
+                print(line, end='')
+                last_output = line.strip() or last_output
+                continue
+            if 'result' in update:
+                result = update['result']
+            elif progress:
+                progress(update['fraction'], update['totals'])
+    if child.returncode != 0 or result is None:
+        raise RuntimeError(f"Mailbox import failed (exit status {child.returncode}): {last_output}")
+    # Counted here too: the child's metrics die with it
+    for key, label in (('imported', 'imported'), ('duplicates', 'duplicate'), ('failed', 'failed')):
+        metrics.MAIL_IMPORT_MESSAGES.inc(result[key], result=label)
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import an mbox file or a directory of mbox/.eml files "
+                                                 "into the local mailbox cache")
+    parser.add_argument("path", help="mbox file, .eml file or directory")
+    parser.add_argument("--workers", type=int, help="Parser processes (default: IMPORT_WORKERS or one per CPU)")
+    parser.add_argument("--no-embed", action="store_true", help="Leave semantic indexing to the sync daemon")
+    parser.add_argument("--cache", help="Mailbox cache to import into (default: MAIL_CACHE_PATH)")
+    parser.add_argument("--progress-jsonl", action="store_true",
+                        help="Report progress and the result as JSON lines, for run_in_subprocess()")
+    args = parser.parse_args()
+
+    store = MailStore(args.cache)
+    index = None
+    if not args.no_embed:
+        from mail_index import MailIndex
+        index = MailIndex(store)
+
+    def report(fraction, totals):
+        if args.progress_jsonl:
+            print(json.dumps({'fraction': fraction, 'totals': totals}), flush=True)
+        else:
+            print(f"\r{fraction:6.1%}  {totals['imported']} imported, {totals['duplicates']} duplicates, "
+                  f"{totals['failed']} unreadable", end='', flush=True)
+
+    result = MailImporter(store, index=index, workers=args.workers).run(args.path, progress=report)
+    print(json.dumps({'result': result}) if args.progress_jsonl else f"\nDone: {result}")
@@ -0,0 +1,418 @@
+"""
+Semantic email index
+
+Finds mail by meaning ("the email about rescheduling the offsite") rather
+than by keyword. The subject and cleaned body of each cached message are
+embedded in batches and appended, L2-normalized, to a float16 matrix on
+disk that searches read through a memory map: the matrix takes two bytes
+per dimension and message, opens instantly and is paged in by the OS
+rather than loaded. update() only embeds messages the index has not seen
+(or whose body has been cached since), so keeping it current costs one
+batch per sync. The message behind each matrix row is recorded in the
+mailbox cache.
+
+Up to VECTOR_IVF_MIN_VECTORS rows a search scores the whole matrix in
+blocks. Past that an inverted file (IVF) of spherical k-means clusters is
+trained, and only rows in the VECTOR_IVF_PROBES clusters nearest the query
+are scored. Gmail-style filters (labels, dates, from:, words) select rows
+from the mailbox cache before scoring, so filtered searches are exact.
+
+The server and `python mail_import.py` may update the same index at once:
+writes happen under a lock file in VECTOR_INDEX_DIR, and a writer first
+picks up rows appended (or a compaction made) by the other process.
+"""
+
+import glob
+import os
+import re
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+import numpy as np
+from config import Config
+from email_digest import clean_body
+from mail_store import MailStore, parse_gmail_query
+import metrics
+import tracing
+
+try:
+    import fcntl
+except ImportError:
+    # No flock on Windows: only one process may update an index there
+    fcntl = None
+
+# Rows scored per matrix block; bounds the float32 copy made of each block
+SEARCH_BLOCK_ROWS = 65536
+# Extra hits fetched to make up for rows of deleted or re-embedded messages
+SEARCH_OVERFETCH = 10
+HASH_DIM = 512
+WORD = re.compile(r'\w+')
+# The fallback to HashingEmbedder is reported once per process, not by every index that loads it
+_fallback_reported = False
+
+
+def document_text(email_data: Dict[str, Any]) -> str:
+    """The text embedded for an email: subject, sender and de-quoted body (or snippet)"""
+    body = clean_body(email_data.get('body') or email_data.get('snippet', ''))
+    text = f"{email_data.get('subject') or ''}\n{email_data.get('sender') or ''}\n{body}"
+    return text[:Config.EMBEDDING_MAX_CHARS]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class HashingEmbedder:
+    """Feature-hashed words and word pairs; needs no model, for load testing or as a keyword-ish fallback"""
+
+    def __init__(self, dim: int = HASH_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            words = WORD.findall(text.lower())
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                h = zlib.crc32(feature.encode('utf-8'))
+                vectors[i, h % self.dim] += 1.0 if h >> 31 else -1.0
+        return _normalize(vectors)
+
+
+class SentenceTransformerEmbedder:
+    """EMBEDDING_MODEL run with sentence-transformers (an optional dependency)"""
+
+    def __init__(self, model_name: str = None):
+        from sentence_transformers import SentenceTransformer
+
+        self.name = model_name or Config.EMBEDDING_MODEL
+        self.model = SentenceTransformer(self.name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = self.model.encode(texts, batch_size=Config.EMBEDDING_BATCH_SIZE,
+                                    normalize_embeddings=True, convert_to_numpy=True)
+        return vectors.astype(np.float32)
+
+
+def load_embedder():
+    global _fallback_reported
+    if Config.EMBEDDING_BACKEND == 'hashing':
+        return HashingEmbedder()
+    if Config.EMBEDDING_BACKEND == 'auto':
+        try:
+            return SentenceTransformerEmbedder()
+        except ImportError:
+            if not _fallback_reported:
+                _fallback_reported = True
+                print("sentence-transformers is not installed, semantic search uses hashed word features")
+            return HashingEmbedder()
+    return SentenceTransformerEmbedder()
+
+
+class MailIndex:
+    def __init__(self, store: MailStore, embedder=None, directory: str = None):
+        self.store = store
+        self.directory = directory or Config.VECTOR_INDEX_DIR
+        # Set by SyncDaemon.register_mail_index(): the daemon embeds new mail
+        self.background_update = False
+        self._embedder = embedder
+        self._lock = threading.RLock()
+        self._update_lock = threading.Lock()
+        self._opened = False
+        self._matrix = None
+        self._ids = np.empty(0, dtype=object)
+        self._live = 0
+        self._centroids = None
+        self._clusters = None
+        metrics.MAIL_INDEX_VECTORS.set_function(lambda: self._live, state='live')
+        metrics.MAIL_INDEX_VECTORS.set_function(lambda: len(self._ids) - self._live, state='dead')
+
+    @property
+    def model(self) -> str:
+        self._open()
+        return self._embedder.name
+
+    def update(self) -> Dict[str, int]:
+        """Embed messages that are new to the index; returns counts of 'added' and 'updated' messages"""
+        with self._update_lock:
+            self._open()
+            added = updated = 0
+            with tracing.span('mail_index.update') as span:
+                while True:
+                    pending = self.store.messages_to_embed(self.model, Config.EMBEDDING_BATCH_SIZE * 8)
+                    if not pending:
+                        break
+                    # Embedding is the slow part and runs without blocking searches
+                    vectors = self._embedder.embed([document_text(e) for e in pending])
+                    with self._lock, self._files_locked():
+                        self._refresh()
+                        start = self._append(vectors)
+                        replaced = self.store.set_embedding_rows(
+                            self.model, [(e['id'], start + i, 'body' in e) for i, e in enumerate(pending)]
+                        )
+                        self._ids[start:start + len(pending)] = [e['id'] for e in pending]
+                        self._ids[replaced] = None
+                        self._live += len(pending) - len(replaced)
+                    added += len(pending) - len(replaced)
+                    updated += len(replaced)
+
+                with self._lock, self._files_locked():
+                    self._refresh()
+                    if len(self._ids) - self._live > Config.VECTOR_COMPACT_RATIO * max(len(self._ids), 1000):
+                        self._compact()
+                    if self._needs_training():
+                        self._train()
+                span.set_attribute('added', added)
+                span.set_attribute('updated', updated)
+                span.set_attribute('vectors', self._live)
+        return {'added': added, 'updated': updated}
+
+    def search(self, text: str, max_results: int = 10, filter_query: str = None) -> List[Dict[str, Any]]:
+        """Cached emails closest in meaning to text, best first, each with a cosine 'score'.
+
+        filter_query restricts the search with Gmail syntax (e.g. 'is:unread newer_than:30d').
+        """
+        parsed = None
+        if filter_query:
+            parsed = parse_gmail_query(filter_query)
+            if parsed is None:
+                raise ValueError(f"Unsupported filter for semantic search: {filter_query}")
+        self._open()
+
+        started = time.perf_counter()
+        with tracing.span('mail_index.search', filtered=parsed is not None) as span:
+            query = self._embedder.embed([text])[0]
+            with self._lock:
+                if self._stale():
+                    with self._files_locked():
+                        self._refresh()
+                matrix, ids, centroids, clusters = self._matrix, self._ids, self._centroids, self._clusters
+            if matrix is None:
+                return []
+
+            candidates = None
+            if parsed is not None:
+                # Every row the filter selects is scored: probing clusters would drop matches outside them
+                rows = [row for row, _ in self.store.embedding_rows(self.model, parsed) if row < len(matrix)]
+                candidates = np.unique(np.array(rows, dtype=np.int64))
+            elif centroids is not None:
+                probes = np.argsort(centroids @ query)[-Config.VECTOR_IVF_PROBES:]
+                candidates = np.flatnonzero(np.isin(clusters[:len(matrix)], probes))
+            span.set_attribute('scanned', len(matrix) if candidates is None else len(candidates))
+
+            rows, scores = self._top(matrix, query, candidates, max_results + SEARCH_OVERFETCH)
+            message_ids = [ids[row] for row in rows if ids[row] is not None]
+            messages = self.store.get_messages(message_ids)
+            results, seen = [], set()
+            for row, score in zip(rows, scores):
+                message_id = ids[row]
+                if message_id is None or message_id in seen:
+                    continue
+                if message_id not in messages:
+                    # Deleted since it was embedded
+                    with self._lock:
+                        if self._ids is ids and ids[row] is not None:
+                            self._ids[row] = None
+                            self._live -= 1
+                    continue
+                seen.add(message_id)
+                email_data = messages[message_id]
+                email_data['score'] = round(float(score), 4)
+                results.append(email_data)
+                if len(results) >= max_results:
+                    break
+            span.set_attribute('results', len(results))
+        metrics.SEMANTIC_SEARCH_SECONDS.observe(time.perf_counter() - started)
+        return results
+
+    def _top(self, matrix: np.ndarray, query: np.ndarray, candidates: Optional[np.ndarray], k: int):
+        """Rows of matrix (all, or only candidates) with the k highest dot products with query"""
+        best_rows, best_scores = [], []
+        total = len(matrix) if candidates is None else len(candidates)
+        for start in range(0, total, SEARCH_BLOCK_ROWS):
+            if candidates is None:
+                rows = np.arange(start, min(start + SEARCH_BLOCK_ROWS, total))
+                block = matrix[start:start + SEARCH_BLOCK_ROWS]
+            else:
+                rows = candidates[start:start + SEARCH_BLOCK_ROWS]
+                block = matrix[rows]
+            scores = block.astype(np.float32) @ query
+            if len(scores) > k:
+                keep = np.argpartition(scores, -k)[-k:]
+                rows, scores = rows[keep], scores[keep]
+            best_rows.append(rows)
+            best_scores.append(scores)
+        if not best_rows:
+            return [], []
+        rows, scores = np.concatenate(best_rows), np.concatenate(best_scores)
+        order = np.argsort(-scores)[:k]
+        return rows[order].tolist(), scores[order].tolist()
+
+    def _path(self, generation: str, suffix: str) -> str:
+        slug = re.sub(r'[^A-Za-z0-9_.-]+', '_', self._embedder.name)
+        return os.path.join(self.directory, f"{slug}.{generation}.{suffix}")
+
+    def _open(self):
+        """Load the embedder and map the current matrix, once"""
+        with self._lock:
+            if self._opened:
+                return
+            if self._embedder is None:
+                self._embedder = load_embedder()
+            os.makedirs(self.directory, exist_ok=True)
+            with self._files_locked():
+                self._load()
+                self._opened = True
+                if len(self._ids) - self._live > Config.VECTOR_COMPACT_RATIO * max(len(self._ids), 1000):
+                    self._compact()
+
+    @contextmanager
+    def _files_locked(self):
+        """Hold the index's lock file, excluding writers in other processes; take self._lock first"""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, '.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self):
+        """Map the current generation's matrix and read which message each row belongs to"""
+        self._generation = self.store.get_state(f"vectors:{self._embedder.name}") or '0'
+
+        # Files of older generations are left behind by a compaction interrupted before it finished
+        current = {self._path(self._generation, suffix) for suffix in ('f16', 'clusters.i32', 'centroids.npy')}
+        for path in glob.glob(self._path('*', '*')):
+            if path not in current:
+                os.remove(path)
+
+        path = self._path(self._generation, 'f16')
+        row_bytes = self._embedder.dim * 2
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size % row_bytes:
+            # A partly written row from an interrupted append
+            with open(path, 'r+b') as f:
+                f.truncate(size - size % row_bytes)
+        rows = size // row_bytes
+        self._map(rows)
+
+        self._ids = np.empty(rows, dtype=object)
+        for row, message_id in self.store.embedding_rows(self._embedder.name):
+            if row < rows:
+                self._ids[row] = message_id
+        self._live = sum(1 for message_id in self._ids if message_id is not None)
+        self._load_clusters()
+
+    def _stale(self) -> bool:
+        """Whether another process has appended to or compacted the matrix since this one last read it"""
+        generation = self.store.get_state(f"vectors:{self._embedder.name}") or '0'
+        path = self._path(generation, 'f16')
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        return generation != self._generation or size != len(self._ids) * self._embedder.dim * 2
+
+    def _refresh(self):
+        """Reload the matrix if it is stale; call with the lock file held"""
+        if self._stale():
+            self._load()
+
+    def _map(self, rows: int):
+        path = self._path(self._generation, 'f16')
+        self._matrix = np.memmap(path, dtype=np.float16, mode='r', shape=(rows, self._embedder.dim)) \
+            if rows else None
+
+    def _append(self, vectors: np.ndarray) -> int:
+        """Append rows to the matrix; returns the first new row"""
+        start = len(self._ids)
+        with open(self._path(self._generation, 'f16'), 'ab') as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float16).tobytes())
+        self._map(start + len(vectors))
+        self._ids = np.concatenate([self._ids, np.empty(len(vectors), dtype=object)])
+        if self._centroids is not None:
+            self._append_clusters(vectors)
+        return start
+
+    def _compact(self):
+        """Rewrite the matrix without the rows of deleted and re-embedded messages"""
+        with tracing.span('mail_index.compact', rows=len(self._ids), live=self._live):
+            rows = sorted(row for row, _ in self.store.embedding_rows(self._embedder.name) if row < len(self._ids))
+            generation = str(int(self._generation) + 1)
+            with open(self._path(generation, 'f16'), 'wb') as f:
+                for start in range(0, len(rows), SEARCH_BLOCK_ROWS):
+                    f.write(np.asarray(self._matrix[rows[start:start + SEARCH_BLOCK_ROWS]]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            # The new row numbers and generation are committed together, so a crash leaves the old matrix in use
+            self.store.renumber_embeddings(self._embedder.name, rows, f"vectors:{self._embedder.name}", generation)
+            for path in glob.glob(self._path(self._generation, '*')):
+                os.remove(path)
+            self._ids = self._ids[rows] if rows else np.empty(0, dtype=object)
+            self._live = len(rows)
+            self._generation = generation
+            self._map(len(rows))
+            self._centroids = self._clusters = None
+
+    def _needs_training(self) -> bool:
+        rows = len(self._ids)
+        if rows < Config.VECTOR_IVF_MIN_VECTORS:
+            return False
+        # About sqrt(rows) clusters; retrain once the matrix has grown fourfold
+        return self._centroids is None or int(np.sqrt(rows)) >= 2 * len(self._centroids)
+
+    def _train(self):
+        """Spherical k-means on a sample of the matrix, then assign every row to its nearest centroid"""
+        rows = len(self._ids)
+        lists = int(np.sqrt(rows))
+        with tracing.span('mail_index.train', rows=rows, clusters=lists):
+            rng = np.random.default_rng(0)
+            sample = np.sort(rng.choice(rows, size=min(rows, lists * 40), replace=False))
+            data = np.asarray(self._matrix[sample], dtype=np.float32)
+            centroids = data[rng.choice(len(data), size=lists, replace=False)]
+            for _ in range(Config.VECTOR_IVF_ITERATIONS):
+                assignment = np.argmax(data @ centroids.T, axis=1)
+                order = np.argsort(assignment, kind='stable')
+                ordered = assignment[order]
+                starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+                sums = np.zeros_like(centroids)
+                sums[ordered[starts]] = np.add.reduceat(data[order], starts, axis=0)
+                empty = ~np.any(sums, axis=1)
+                # Clusters that lost all their rows keep their old centroid
+                sums[empty] = centroids[empty]
+                centroids = _normalize(sums)
+
+            np.save(self._path(self._generation, 'centroids.npy'), centroids.astype(np.float32))
+            self._centroids = centroids.astype(np.float32)
+            with open(self._path(self._generation, 'clusters.i32'), 'wb'):
+                pass
+            self._clusters = np.empty(0, dtype=np.int32)
+            for start in range(0, rows, SEARCH_BLOCK_ROWS):
+                self._append_clusters(self._matrix[start:start + SEARCH_BLOCK_ROWS])
+
+    def _append_clusters(self, vectors: np.ndarray):
+        assignment = np.argmax(np.asarray(vectors, dtype=np.float32) @ self._centroids.T, axis=1).astype(np.int32)
+        with open(self._path(self._generation, 'clusters.i32'), 'ab') as f:
+            f.write(assignment.tobytes())
+        self._clusters = np.concatenate([self._clusters, assignment])
+
+    def _load_clusters(self):
+        centroids_path = self._path(self._generation, 'centroids.npy')
+        clusters_path = self._path(self._generation, 'clusters.i32')
+        if not os.path.exists(centroids_path) or not os.path.exists(clusters_path):
+            self._centroids = self._clusters = None
+            return
+        self._centroids = np.load(centroids_path)
+        clusters = np.fromfile(clusters_path, dtype=np.int32)
+        rows = len(self._ids)
+        if len(clusters) > rows:
+            clusters = clusters[:rows]
+            clusters.tofile(clusters_path)
+        self._clusters = clusters
+        if len(clusters) < rows:
+            # Rows appended after the last assignment was written
+            self._append_clusters(self._matrix[len(clusters):])
@@ -0,0 +1,595 @@
+"""
+Local SQLite mailbox cache
+
+Holds headers, snippet, labels and (once fetched) the body of each message,
+keyed by Gmail message id, plus the sync state (last historyId) that
+GmailService.sync() uses for incremental updates. Messages are indexed by
+thread, and threads fetched in full are recorded so a conversation can be
+read back without the API once it is cached.
+
+Subject, sender, snippet and body are full-text indexed (FTS5) so that
+Gmail-style searches can be answered locally; see parse_gmail_query().
+The embeddings table maps messages to rows of the semantic index's vector
+matrix (see mail_index.py).
+"""
+
+import os
+import re
+import shlex
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+from config import Config
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    thread_id TEXT,
+    subject TEXT,
+    sender TEXT,
+    date TEXT,
+    internal_date INTEGER,
+    snippet TEXT,
+    body TEXT,
+    updated_at REAL,
+    rfc822_id TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_internal_date ON messages (internal_date DESC);
+DROP INDEX IF EXISTS messages_thread;
+CREATE INDEX IF NOT EXISTS messages_thread_date ON messages (thread_id, internal_date);
+
+-- Threads whose every message has been cached (later replies arrive through the sync)
+CREATE TABLE IF NOT EXISTS threads (
+    id TEXT PRIMARY KEY,
+    fetched_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS message_labels (
+    message_id TEXT NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+    label TEXT NOT NULL,
+    PRIMARY KEY (label, message_id)
+);
+CREATE INDEX IF NOT EXISTS message_labels_message ON message_labels (message_id);
+
+-- Digest summaries, per model
+CREATE TABLE IF NOT EXISTS summaries (
+    message_id TEXT NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+    model TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    created_at REAL,
+    PRIMARY KEY (message_id, model)
+);
+
+-- Row of each message in the semantic index's vector matrix, per embedding model
+CREATE TABLE IF NOT EXISTS embeddings (
+    message_id TEXT NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+    model TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    with_body INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (model, message_id)
+);
+CREATE INDEX IF NOT EXISTS embeddings_message ON embeddings (message_id);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# External-content index over the messages table, kept current by triggers
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE messages_fts USING fts5 (
+    subject, sender, snippet, body,
+    content = 'messages', content_rowid = 'rowid', tokenize = 'unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, subject, sender, snippet, body)
+    VALUES (new.rowid, new.subject, new.sender, new.snippet, new.body);
+END;
+CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, subject, sender, snippet, body)
+    VALUES ('delete', old.rowid, old.subject, old.sender, old.snippet, old.body);
+END;
+CREATE TRIGGER messages_fts_update AFTER UPDATE OF subject, sender, snippet, body ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, subject, sender, snippet, body)
+    VALUES ('delete', old.rowid, old.subject, old.sender, old.snippet, old.body);
+    INSERT INTO messages_fts (rowid, subject, sender, snippet, body)
+    VALUES (new.rowid, new.subject, new.sender, new.snippet, new.body);
+END;
+INSERT INTO messages_fts (messages_fts) VALUES ('rebuild');
+"""
+
+MESSAGE_COLUMNS = ('id', 'thread_id', 'subject', 'sender', 'date', 'internal_date', 'snippet', 'body')
+
+# Messages imported from a mail export without a Gmail id (see mail_import.py); Gmail does not know them
+LOCAL_ID_PREFIX = 'local-'
+
+# bm25() weights for subject, sender, snippet, body
+FTS_WEIGHTS = (10.0, 5.0, 2.0, 1.0)
+
+# Gmail search operators that map onto labels
+LABEL_OPERATORS = {
+    'is:unread': ('UNREAD', True), 'is:read': ('UNREAD', False),
+    'is:starred': ('STARRED', True), 'is:important': ('IMPORTANT', True),
+    'in:inbox': ('INBOX', True), 'in:sent': ('SENT', True), 'in:draft': ('DRAFT', True),
+    'in:spam': ('SPAM', True), 'in:trash': ('TRASH', True),
+}
+# Like Gmail, searches leave these out unless the query asks for them (in:spam, in:trash, in:anywhere)
+HIDDEN_LABELS = ('SPAM', 'TRASH')
+SYSTEM_LABELS = {'INBOX', 'SENT', 'DRAFT', 'UNREAD', 'STARRED', 'IMPORTANT',
+                 'CATEGORY_PERSONAL', 'CATEGORY_SOCIAL', 'CATEGORY_PROMOTIONS', 'CATEGORY_UPDATES', 'CATEGORY_FORUMS'}
+RELATIVE_UNITS = {'d': 1, 'm': 30, 'y': 365}
+
+
+def _parse_date(value: str) -> Optional[int]:
+    """Gmail dates are YYYY/MM/DD (or YYYY-MM-DD) in local time, or epoch seconds; returns epoch ms"""
+    if value.isdigit() and len(value) > 8:
+        return int(value) * 1000
+    for fmt in ('%Y/%m/%d', '%Y-%m-%d', '%m/%d/%Y'):
+        try:
+            return int(datetime.strptime(value, fmt).timestamp() * 1000)
+        except ValueError:
+            continue
+    return None
+
+
+def parse_gmail_query(query: str) -> Optional[Dict[str, Any]]:
+    """Parse the common subset of Gmail search syntax.
+    
+    Supports plain words and "quoted phrases", from:, subject:, is:unread/read/starred/important,
+    in:inbox/sent/draft/spam/trash/anywhere, label: for system labels, after:/before:, newer_than:/older_than:.
+    Returns None for anything else (to:, has:, OR, negation, ...), so the caller can ask Gmail instead.
+    """
+    try:
+        tokens = shlex.split(query or '')
+    except ValueError:
+        return None
+    
+    parsed = {'terms': [], 'fields': [], 'labels': [], 'without_labels': [], 'after': None, 'before': None,
+              'anywhere': False}
+    for token in tokens:
+        lowered = token.lower()
+        operator, _, value = token.partition(':')
+        operator = operator.lower()
+        
+        if lowered in LABEL_OPERATORS:
+            label, present = LABEL_OPERATORS[lowered]
+            (parsed['labels'] if present else parsed['without_labels']).append(label)
+        elif lowered == 'in:anywhere':
+            parsed['anywhere'] = True
+        elif operator == 'label' and value.upper() in SYSTEM_LABELS:
+            parsed['labels'].append(value.upper())
+        elif operator in ('from', 'subject') and value:
+            parsed['fields'].append(('sender' if operator == 'from' else 'subject', value))
+        elif operator in ('after', 'before') and value:
+            timestamp = _parse_date(value)
+            if timestamp is None:
+                return None
+            parsed[operator] = timestamp
+        elif operator in ('newer_than', 'older_than') and re.fullmatch(r'\d+[dmy]', value.lower()):
+            days = int(value[:-1]) * RELATIVE_UNITS[value[-1].lower()]
+            timestamp = int((datetime.now() - timedelta(days=days)).timestamp() * 1000)
+            parsed['after' if operator == 'newer_than' else 'before'] = timestamp
+        elif re.match(r'^[A-Za-z_]+:', token) and not lowered.startswith(('http:', 'https:')):
+            # An operator we cannot answer locally
+            return None
+        elif token.startswith('-') or token in ('OR', 'AND', '|') or any(c in token for c in '{}()'):
+            return None
+        else:
+            parsed['terms'].append(token)
+    return parsed
+
+
+def _fts_phrase(text: str) -> str:
+    return '"' + text.replace('"', '""') + '"'
+
+
+def searches_hidden(parsed: Dict[str, Any]) -> bool:
+    """Whether a parse_gmail_query() result also covers spam and trash"""
+    return parsed['anywhere'] or any(label in HIDDEN_LABELS for label in parsed['labels'])
+
+
+class MailStore:
+    def __init__(self, path: str = None):
+        self.path = path or Config.MAIL_CACHE_PATH
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # One connection shared by all threads, serialized by a lock
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA foreign_keys=ON")
+            self._conn.executescript(SCHEMA)
+            self._migrate()
+            self.fts_enabled = self._init_fts()
+
+    def _migrate(self):
+        """Bring a cache created by an older version up to the current schema"""
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(messages)")}
+        if 'rfc822_id' not in columns:
+            self._conn.execute("ALTER TABLE messages ADD COLUMN rfc822_id TEXT")
+        # The Message-ID header, to recognize a message imported from a mail export
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_rfc822_id ON messages (rfc822_id)")
+
+    def _init_fts(self) -> bool:
+        exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+        ).fetchone()
+        if exists:
+            return True
+        try:
+            # Creates the index and builds it from any messages already cached
+            self._conn.executescript(f"BEGIN; {FTS_SCHEMA} COMMIT;")
+            return True
+        except sqlite3.OperationalError as e:
+            # SQLite built without FTS5: searches go to the Gmail API
+            self._conn.rollback()
+            print(f"Full-text search unavailable ({e}); email searches will use the Gmail API")
+            return False
+
+    def upsert_messages(self, emails: Iterable[Dict[str, Any]]):
+        """Insert or update messages; a stored body is kept unless a new one is given"""
+        now = time.time()
+        with self._lock, self._conn:
+            for email_data in emails:
+                rfc822_id = email_data.get('rfc822_id')
+                if rfc822_id:
+                    # The same message imported from an export before Gmail's copy was seen
+                    self._conn.execute(
+                        "DELETE FROM messages WHERE rfc822_id = ? AND id != ? AND id LIKE ?",
+                        (rfc822_id, email_data['id'], LOCAL_ID_PREFIX + '%')
+                    )
+                self._conn.execute(
+                    """
+                    INSERT INTO messages (id, thread_id, subject, sender, date, internal_date, snippet, body,
+                                          updated_at, rfc822_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (id) DO UPDATE SET
+                        thread_id = excluded.thread_id,
+                        subject = excluded.subject,
+                        sender = excluded.sender,
+                        date = excluded.date,
+                        internal_date = excluded.internal_date,
+                        snippet = excluded.snippet,
+                        body = COALESCE(excluded.body, messages.body),
+                        updated_at = excluded.updated_at,
+                        rfc822_id = COALESCE(excluded.rfc822_id, messages.rfc822_id)
+                    """,
+                    (email_data['id'], email_data.get('thread_id'), email_data.get('subject'),
+                     email_data.get('sender'), email_data.get('date'), email_data.get('internal_date', 0),
+                     email_data.get('snippet', ''), email_data.get('body'), now, rfc822_id)
+                )
+                if 'labels' in email_data:
+                    self._set_labels(email_data['id'], email_data['labels'])
+
+    def import_messages(self, emails: Iterable[Dict[str, Any]]) -> int:
+        """Add messages from a mail export, skipping any whose id or Message-ID is already cached;
+        returns how many were added"""
+        now = time.time()
+        added = 0
+        with self._lock, self._conn:
+            for email_data in emails:
+                inserted = self._conn.execute(
+                    """
+                    INSERT INTO messages (id, thread_id, subject, sender, date, internal_date, snippet, body,
+                                          updated_at, rfc822_id)
+                    SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+                    WHERE ? IS NULL OR NOT EXISTS (SELECT 1 FROM messages WHERE rfc822_id = ?)
+                    ON CONFLICT (id) DO NOTHING
+                    """,
+                    (email_data['id'], email_data.get('thread_id'), email_data.get('subject'),
+                     email_data.get('sender'), email_data.get('date'), email_data.get('internal_date', 0),
+                     email_data.get('snippet', ''), email_data.get('body'), now, email_data.get('rfc822_id'),
+                     email_data.get('rfc822_id'), email_data.get('rfc822_id'))
+                ).rowcount
+                if inserted:
+                    self._set_labels(email_data['id'], email_data.get('labels', []))
+                    if (email_data.get('thread_id') or '').startswith(LOCAL_ID_PREFIX):
+                        # Threads only known locally cannot be fetched, so what is cached is the whole thread
+                        self._conn.execute("INSERT OR IGNORE INTO threads (id, fetched_at) VALUES (?, ?)",
+                                           (email_data['thread_id'], now))
+                    added += 1
+        return added
+
+    def set_labels(self, message_id: str, labels: List[str]) -> bool:
+        """Replace a cached message's labels; returns False if the message is not cached"""
+        with self._lock, self._conn:
+            if not self._conn.execute("SELECT 1 FROM messages WHERE id = ?", (message_id,)).fetchone():
+                return False
+            self._set_labels(message_id, labels)
+            return True
+
+    def _set_labels(self, message_id: str, labels: List[str]):
+        self._conn.execute("DELETE FROM message_labels WHERE message_id = ?", (message_id,))
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO message_labels (message_id, label) VALUES (?, ?)",
+            [(message_id, label) for label in labels]
+        )
+
+    def set_body(self, message_id: str, body: str):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE messages SET body = ? WHERE id = ?", (body, message_id))
+
+    def delete_messages(self, message_ids: Iterable[str]):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM messages WHERE id = ?", [(i,) for i in message_ids])
+
+    def delete_unseen_since(self, seen_ids: Iterable[str], oldest_internal_date: int) -> int:
+        """Drop messages inside a full-sync window that the sync did not see (other than ones
+        only known locally); returns how many"""
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS seen_ids (id TEXT PRIMARY KEY)")
+            self._conn.execute("DELETE FROM seen_ids")
+            self._conn.executemany("INSERT OR IGNORE INTO seen_ids (id) VALUES (?)", [(i,) for i in seen_ids])
+            return self._conn.execute(
+                "DELETE FROM messages WHERE internal_date >= ? AND id NOT IN (SELECT id FROM seen_ids) "
+                "AND id NOT LIKE ?",
+                (oldest_internal_date, LOCAL_ID_PREFIX + '%')
+            ).rowcount
+
+    def get_message(self, message_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(f"{self._select()} WHERE m.id = ?", (message_id,)).fetchone()
+            return self._to_email(row) if row else None
+
+    def get_bodies(self, message_ids: List[str]) -> Dict[str, str]:
+        """Return the cached bodies for whichever of message_ids have one"""
+        bodies = {}
+        with self._lock:
+            for start in range(0, len(message_ids), 500):
+                chunk = message_ids[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT id, body FROM messages WHERE body IS NOT NULL AND id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                bodies.update({row['id']: row['body'] for row in rows})
+        return bodies
+
+    def get_summaries(self, message_ids: List[str], model: str) -> Dict[str, str]:
+        """Cached digest summaries by message id, for whichever of message_ids have one"""
+        summaries = {}
+        with self._lock:
+            for start in range(0, len(message_ids), 500):
+                chunk = message_ids[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT message_id, summary FROM summaries WHERE model = ? "
+                    f"AND message_id IN ({','.join('?' * len(chunk))})",
+                    [model] + chunk
+                ).fetchall()
+                summaries.update({row['message_id']: row['summary'] for row in rows})
+        return summaries
+
+    def set_summaries(self, summaries: Dict[str, str], model: str):
+        """Cache summaries of messages in the store (others are ignored)"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO summaries (message_id, model, summary, created_at) "
+                "SELECT id, ?, ?, ? FROM messages WHERE id = ? "
+                "ON CONFLICT (message_id, model) DO UPDATE SET summary = excluded.summary, "
+                "created_at = excluded.created_at",
+                [(model, summary, now, message_id) for message_id, summary in summaries.items()]
+            )
+
+    def list_messages(self, label: str = 'INBOX', limit: int = 10) -> List[Dict[str, Any]]:
+        """Most recent messages carrying a label"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                {self._select()}
+                JOIN message_labels l ON l.message_id = m.id AND l.label = ?
+                ORDER BY m.internal_date DESC LIMIT ?
+                """,
+                (label, limit)
+            ).fetchall()
+            return [self._to_email(row) for row in rows]
+
+    def list_threads(self, label: str = 'INBOX', limit: int = 10) -> List[List[Dict[str, Any]]]:
+        """Most recently active threads with a message carrying a label, each as its messages oldest first"""
+        with self._lock:
+            thread_ids = [row['thread_id'] for row in self._conn.execute(
+                """
+                SELECT m.thread_id, MAX(m.internal_date) AS last_date FROM messages m
+                JOIN message_labels l ON l.message_id = m.id AND l.label = ?
+                WHERE m.thread_id IS NOT NULL
+                GROUP BY m.thread_id ORDER BY last_date DESC LIMIT ?
+                """,
+                (label, limit)
+            ).fetchall()]
+            if not thread_ids:
+                return []
+            rows = self._conn.execute(
+                f"{self._select()} WHERE m.thread_id IN ({','.join('?' * len(thread_ids))}) "
+                "ORDER BY m.internal_date",
+                thread_ids
+            ).fetchall()
+        threads = {thread_id: [] for thread_id in thread_ids}
+        for row in rows:
+            threads[row['thread_id']].append(self._to_email(row))
+        return list(threads.values())
+
+    def get_thread(self, thread_id: str) -> List[Dict[str, Any]]:
+        """A thread's cached messages, oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"{self._select()} WHERE m.thread_id = ? ORDER BY m.internal_date", (thread_id,)
+            ).fetchall()
+            return [self._to_email(row) for row in rows]
+
+    def thread_complete(self, thread_id: str) -> bool:
+        """Whether every message of the thread has been cached by mark_thread_complete()"""
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM threads WHERE id = ?", (thread_id,)).fetchone() is not None
+
+    def mark_thread_complete(self, thread_id: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO threads (id, fetched_at) VALUES (?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET fetched_at = excluded.fetched_at",
+                (thread_id, time.time())
+            )
+
+    def forget_threads(self):
+        """Stop treating any thread as complete, e.g. after a full resync that may have missed deletions"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM threads")
+
+    def search(self, parsed: Dict[str, Any], limit: int = 10) -> List[Dict[str, Any]]:
+        """Run a parse_gmail_query() result against the index.
+        
+        Free-text matches are ranked by bm25 and get a 'match' snippet with the hits
+        in [brackets]; operator-only searches are ordered newest first.
+        """
+        match, where, params = self._filters(parsed)
+        if match:
+            weights = ', '.join(str(w) for w in FTS_WEIGHTS)
+            match_snippet = "snippet(messages_fts, -1, '[', ']', '…', 16)"
+            sql = (f"{self._select(match_snippet)} "
+                   f"JOIN messages_fts ON messages_fts.rowid = m.rowid WHERE messages_fts MATCH ? "
+                   + ''.join(f"AND {clause} " for clause in where)
+                   + f"ORDER BY bm25(messages_fts, {weights}) LIMIT ?")
+            params = [match] + params
+        else:
+            sql = (f"{self._select()} " + (f"WHERE {' AND '.join(where)} " if where else '')
+                   + "ORDER BY m.internal_date DESC LIMIT ?")
+        
+        with self._lock:
+            return [self._to_email(row) for row in self._conn.execute(sql, params + [limit]).fetchall()]
+
+    def _filters(self, parsed: Dict[str, Any]):
+        """FTS match expression, WHERE clauses and their parameters for a parse_gmail_query() result"""
+        match = ' AND '.join(
+            [_fts_phrase(term) for term in parsed['terms']] +
+            [f"{column} : {_fts_phrase(value)}" for column, value in parsed['fields']]
+        )
+        where, params = [], []
+        for label in parsed['labels']:
+            where.append("EXISTS (SELECT 1 FROM message_labels l WHERE l.message_id = m.id AND l.label = ?)")
+            params.append(label)
+        for label in parsed['without_labels']:
+            where.append("NOT EXISTS (SELECT 1 FROM message_labels l WHERE l.message_id = m.id AND l.label = ?)")
+            params.append(label)
+        if not searches_hidden(parsed):
+            where.append("NOT EXISTS (SELECT 1 FROM message_labels l WHERE l.message_id = m.id AND l.label IN (?, ?))")
+            params.extend(HIDDEN_LABELS)
+        if parsed['after'] is not None:
+            where.append("m.internal_date >= ?")
+            params.append(parsed['after'])
+        if parsed['before'] is not None:
+            where.append("m.internal_date < ?")
+            params.append(parsed['before'])
+        return match, where, params
+
+    def messages_to_embed(self, model: str, limit: int = 1000) -> List[Dict[str, Any]]:
+        """Messages with no embedding for a model yet, or embedded before their body was cached; newest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                {self._select()}
+                LEFT JOIN embeddings e ON e.message_id = m.id AND e.model = ?
+                WHERE e.message_id IS NULL OR (e.with_body = 0 AND m.body IS NOT NULL)
+                ORDER BY m.internal_date DESC LIMIT ?
+                """,
+                (model, limit)
+            ).fetchall()
+            return [self._to_email(row) for row in rows]
+
+    def set_embedding_rows(self, model: str, rows: Iterable[tuple]):
+        """Record (message_id, row, with_body) for messages still in the store; returns the replaced rows"""
+        replaced = []
+        with self._lock, self._conn:
+            for message_id, row, with_body in rows:
+                old = self._conn.execute("SELECT row FROM embeddings WHERE model = ? AND message_id = ?",
+                                         (model, message_id)).fetchone()
+                if old:
+                    replaced.append(old['row'])
+                self._conn.execute(
+                    "INSERT INTO embeddings (message_id, model, row, with_body) "
+                    "SELECT id, ?, ?, ? FROM messages WHERE id = ? "
+                    "ON CONFLICT (model, message_id) DO UPDATE SET row = excluded.row, with_body = excluded.with_body",
+                    (model, row, int(with_body), message_id)
+                )
+        return replaced
+
+    def renumber_embeddings(self, model: str, rows: List[int], state_key: str, state_value: str):
+        """Move the embeddings at `rows` to rows 0..n-1 in that order, dropping any others, and set a state
+        key in the same transaction"""
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS row_map (old INTEGER PRIMARY KEY, new INTEGER)")
+            self._conn.execute("DELETE FROM row_map")
+            self._conn.executemany("INSERT INTO row_map (old, new) VALUES (?, ?)",
+                                   [(old, new) for new, old in enumerate(rows)])
+            self._conn.execute("DELETE FROM embeddings WHERE model = ? AND row NOT IN (SELECT old FROM row_map)",
+                               (model,))
+            self._conn.execute("UPDATE embeddings SET row = (SELECT new FROM row_map WHERE old = row) WHERE model = ?",
+                               (model,))
+            self._conn.execute(
+                "INSERT INTO sync_state (key, value) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                (state_key, state_value)
+            )
+
+    def embedding_rows(self, model: str, parsed: Dict[str, Any] = None) -> List[tuple]:
+        """(row, message_id) of every embedded message, or of those matching a parse_gmail_query() result"""
+        match, where, params = self._filters(parsed) if parsed else ('', [], [])
+        sql = "SELECT e.row, e.message_id FROM embeddings e JOIN messages m ON m.id = e.message_id "
+        if match:
+            sql += "JOIN messages_fts ON messages_fts.rowid = m.rowid AND messages_fts MATCH ? "
+        sql += "WHERE e.model = ? " + ''.join(f"AND {clause} " for clause in where)
+        params = ([match] if match else []) + [model] + params
+        with self._lock:
+            return [(row['row'], row['message_id']) for row in self._conn.execute(sql, params).fetchall()]
+
+    def get_messages(self, message_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Cached messages by id, for whichever of message_ids are in the store"""
+        messages = {}
+        with self._lock:
+            for start in range(0, len(message_ids), 500):
+                chunk = message_ids[start:start + 500]
+                rows = self._conn.execute(
+                    f"{self._select()} WHERE m.id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                messages.update({row['id']: self._to_email(row) for row in rows})
+        return messages
+
+    def message_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def get_state(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+            return row['value'] if row else None
+
+    def set_state(self, key: str, value: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO sync_state (key, value) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                (key, str(value))
+            )
+
+    def _select(self, match_snippet: str = 'NULL') -> str:
+        return (f"SELECT {', '.join('m.' + c for c in MESSAGE_COLUMNS)}, {match_snippet} AS match, "
+                "(SELECT group_concat(label, char(31)) FROM message_labels WHERE message_id = m.id) AS labels "
+                "FROM messages m")
+
+    def _to_email(self, row: sqlite3.Row) -> Dict[str, Any]:
+        email_data = {key: row[key] for key in MESSAGE_COLUMNS if key != 'body'}
+        email_data['labels'] = row['labels'].split('\x1f') if row['labels'] else []
+        # Leave 'body' out until it has been fetched, so fetch_bodies() knows to load it
+        if row['body'] is not None:
+            email_data['body'] = row['body']
+        if row['match'] is not None:
+            email_data['match'] = ' '.join(row['match'].split())
+        return email_data
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,10 +1,17 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import time
+from fastapi import FastAPI, Header, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional
+from typing import Any, Dict, List, Optional
 import uvicorn
 from ai_assistant import AIAssistant
 from config import Config
+from jobs import JobManager, TERMINAL_STATUSES, check_job_token
+import sync_daemon
+import metrics
+import tracing
+from profiler import profiler, check_token
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -22,28 +29,78 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Time every request, labelled by its route template"""
+    start = time.perf_counter()
+    metrics.REQUESTS_IN_FLIGHT.inc()
+    try:
+        return await call_next(request)
+    finally:
+        metrics.REQUESTS_IN_FLIGHT.dec()
+        route = request.scope.get('route')
+        endpoint = route.path if route else 'unmatched'
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+
 # Initialize AI Assistant
 assistant = None
+job_manager = None
+sync_worker = None
 
 class QueryRequest(BaseModel):
     query: str
     user_id: Optional[str] = None
+    debug: bool = False
 
 class QueryResponse(BaseModel):
     response: str
     success: bool
     error: Optional[str] = None
+    timings: Optional[List[Dict[str, Any]]] = None
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    user_id: Optional[str] = None
+
+class BatchQueryResponse(BaseModel):
+    responses: List[QueryResponse]
+    success: bool
+    error: Optional[str] = None
+
+class ProfileRequest(BaseModel):
+    count: Optional[int] = None
+    sample_rate: Optional[float] = None
+    mode: str = 'sampling'
+    interval_ms: Optional[float] = None
+    endpoints: Optional[List[str]] = None
+    ttl_seconds: Optional[int] = None
+
+class JobRequest(BaseModel):
+    kind: str
+    params: Dict[str, Any] = {}
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize the AI assistant on startup"""
-    global assistant
+    global assistant, job_manager, sync_worker
     try:
         assistant = AIAssistant()
+        job_manager = JobManager(assistant)
+        sync_worker = sync_daemon.start_for(assistant)
         print("✅ AI Assistant initialized successfully")
     except Exception as e:
         print(f"❌ Failed to initialize AI Assistant: {e}")
         assistant = None
+        job_manager = None
+        sync_worker = None
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop accepting background jobs and stop background sync"""
+    if job_manager:
+        job_manager.shutdown()
+    if sync_worker:
+        sync_worker.stop()
 
 @app.get("/")
 async def root():
@@ -60,19 +117,90 @@ async def process_query(request: QueryRequest):
     if not assistant:
         raise HTTPException(status_code=500, detail="AI Assistant not initialized")
     
+    with tracing.start_trace('POST /query', user_id=request.user_id or '') as trace, \
+            profiler.profile('/query'):
+        try:
+            response = assistant.process_user_query(request.query)
+            result = QueryResponse(
+                response=response,
+                success=True
+            )
+        except Exception as e:
+            result = QueryResponse(
+                response="",
+                success=False,
+                error=str(e)
+            )
+    
+    if request.debug:
+        # Per-stage latency breakdown of this query
+        result.timings = trace.breakdown()
+    return result
+
+@app.post("/query/batch", response_model=BatchQueryResponse)
+def process_query_batch(request: BatchQueryRequest):
+    """Process many queries at once, batching model generations by intent"""
+    if not assistant:
+        raise HTTPException(status_code=500, detail="AI Assistant not initialized")
+    
     try:
-        response = assistant.process_user_query(request.query)
-        return QueryResponse(
-            response=response,
+        responses = assistant.process_user_queries(request.queries)
+        return BatchQueryResponse(
+            responses=[QueryResponse(response=r, success=True) for r in responses],
             success=True
         )
     except Exception as e:
-        return QueryResponse(
-            response="",
+        return BatchQueryResponse(
+            responses=[],
             success=False,
             error=str(e)
         )
 
+@app.post("/jobs")
+async def submit_job(request: JobRequest, x_job_token: Optional[str] = Header(None)):
+    """Start a long-running action in the background and return its job id"""
+    if not job_manager:
+        raise HTTPException(status_code=500, detail="AI Assistant not initialized")
+    if not check_job_token(request.kind, x_job_token):
+        raise HTTPException(status_code=403, detail=f"Job token missing or invalid for '{request.kind}' jobs")
+    
+    try:
+        return job_manager.submit(request.kind, request.params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get the status, progress and result of a job"""
+    if not job_manager:
+        raise HTTPException(status_code=500, detail="AI Assistant not initialized")
+    
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.websocket("/jobs/{job_id}/ws")
+async def watch_job(websocket: WebSocket, job_id: str):
+    """Push job updates to the client until the job finishes"""
+    await websocket.accept()
+    job = job_manager.get(job_id) if job_manager else None
+    if not job:
+        await websocket.send_json({'error': 'Job not found'})
+        await websocket.close()
+        return
+    
+    try:
+        await websocket.send_json(job)
+        while job and job['status'] not in TERMINAL_STATUSES:
+            updated = await asyncio.to_thread(job_manager.wait_for_update, job_id, job['updated_at'])
+            if updated and updated['updated_at'] != job['updated_at']:
+                await websocket.send_json(updated)
+            job = updated
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -81,6 +209,36 @@ async def health_check():
         "assistant_ready": assistant is not None
     }
 
+def _require_profiler_token(token: Optional[str]):
+    if not check_token(token):
+        raise HTTPException(status_code=403, detail="Profiler token missing or invalid")
+
+@app.post("/debug/profile")
+async def arm_profiler(request: ProfileRequest, x_profiler_token: Optional[str] = Header(None)):
+    """Profile the next N requests (or a sampled fraction) to /query and /get_response"""
+    _require_profiler_token(x_profiler_token)
+    try:
+        return profiler.arm(**request.dict())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/debug/profile")
+async def profiler_status(x_profiler_token: Optional[str] = Header(None)):
+    """Show profiler state and the profiles written so far"""
+    _require_profiler_token(x_profiler_token)
+    return profiler.status()
+
+@app.delete("/debug/profile")
+async def disarm_profiler(x_profiler_token: Optional[str] = Header(None)):
+    """Stop profiling"""
+    _require_profiler_token(x_profiler_token)
+    return profiler.disarm()
+
+@app.get("/metrics")
+def get_metrics():
+    """Expose metrics in Prometheus text format"""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/capabilities")
 async def get_capabilities():
     """Get list of assistant capabilities"""
@@ -95,6 +253,8 @@ async def get_capabilities():
             "   - Check inbox and read emails",
             "   - Send emails",
             "   - Save emails to markdown files",
+            "⏳ Background Jobs",
+            "   - Archive the inbox or analyze telegram chats without holding a request open",
             "🤖 AI Chat",
             "   - General conversation and assistance"
         ],
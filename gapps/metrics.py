@@ -0,0 +1,330 @@
+"""
+In-process metrics in the Prometheus text exposition format
+
+A small registry of counters, gauges and histograms shared by the servers,
+the assistant and the Google services. `render()` produces the body served
+on /metrics.
+"""
+
+import contextvars
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+import tracing
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (1, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+_registry: List['_Metric'] = []
+_registry_lock = threading.Lock()
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                    for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._callbacks: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn: Callable[[], float], **labels):
+        """Compute the value lazily every time metrics are rendered"""
+        with self._lock:
+            self._callbacks[self._key(labels)] = fn
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+            callbacks = dict(self._callbacks)
+        for key, fn in callbacks.items():
+            try:
+                value = fn()
+            except Exception:
+                continue
+            if value is not None:
+                values[key] = value
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # Per-bucket (non-cumulative) counts followed by +Inf, sum
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        lines = []
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values[:-1]):
+                cumulative += count
+                le = 'le="%s"' % _format_value(float(bound))
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(values[-1])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+def render() -> str:
+    """Render every registered metric"""
+    with _registry_lock:
+        metrics = list(_registry)
+    return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+# Request handling
+REQUEST_SECONDS = Histogram('assistant_request_seconds', 'Total time spent handling an HTTP request',
+                            ['endpoint'])
+REQUESTS_IN_FLIGHT = Gauge('assistant_requests_in_flight', 'HTTP requests currently being handled')
+QUEUE_DEPTH = Gauge('assistant_queue_depth', 'Work items waiting to be processed', ['queue'])
+
+# Assistant pipeline stages
+ROUTING_SECONDS = Histogram('assistant_routing_seconds', 'Time spent deciding how to handle a query')
+GOOGLE_API_SECONDS = Histogram('google_api_call_seconds', 'Latency of Google API calls',
+                               ['service', 'method'])
+GOOGLE_HTTP_CONNECTIONS = Gauge('google_http_pool_connections', 'Pooled Google API connections by state', ['state'])
+OAUTH_REFRESHES = Counter('oauth_token_refreshes_total', 'Google access token refreshes by outcome', ['result'])
+OAUTH_TOKEN_TTL = Gauge('oauth_token_ttl_seconds', 'Seconds until the current Google access token expires')
+SYNC_LAG = Gauge('sync_lag_seconds', 'Seconds since a local store last synced successfully', ['store'])
+SYNC_INTERVAL = Gauge('sync_interval_seconds', 'Current background polling interval of a local store', ['store'])
+SYNC_RUNS = Counter('sync_runs_total', 'Background sync polls by outcome', ['store', 'result'])
+MAIL_INDEX_VECTORS = Gauge('mail_index_vectors', 'Rows of the semantic email index by state', ['state'])
+SEMANTIC_SEARCH_SECONDS = Histogram('mail_semantic_search_seconds', 'Time to embed a query and search the email index')
+MAIL_IMPORT_MESSAGES = Counter('mail_import_messages_total', 'Messages read from mail exports by outcome', ['result'])
+GOOGLE_API_ERRORS = Counter('google_api_errors_total', 'Google API calls that raised', ['service', 'method'])
+EMAILS_SENT = Counter('gmail_emails_sent_total', 'Emails sent, after retries, by outcome', ['status'])
+TOKENIZE_SECONDS = Histogram('model_tokenize_seconds', 'Time spent applying the chat template and tokenizing')
+PREFILL_SECONDS = Histogram('model_prefill_seconds', 'Time from generate() start to the first new token')
+DECODE_SECONDS = Histogram('model_decode_seconds', 'Time from the first new token to the end of generation')
+GENERATED_TOKENS = Histogram('model_generated_tokens', 'Tokens generated per request, over all its model passes',
+                             buckets=TOKEN_BUCKETS)
+
+
+
+class _TokenTally:
+    def __init__(self, tokens: int):
+        self.tokens = tokens
+        self.passes = 1 if tokens else 0
+        self._lock = threading.Lock()
+
+    def add(self, tokens: int):
+        with self._lock:
+            self.tokens += tokens
+            self.passes += 1
+
+
+_request_tokens: contextvars.ContextVar = contextvars.ContextVar('request_tokens', default=None)
+
+
+@contextmanager
+def count_request_tokens(initial: int = 0):
+    """Add up the tokens generated inside the block (also on threads started with tracing.wrap())
+    and observe GENERATED_TOKENS once when it ends; nested blocks count toward the outermost"""
+    tally = _request_tokens.get()
+    if tally is not None:
+        if initial:
+            tally.add(initial)
+        yield
+        return
+    tally = _TokenTally(initial)
+    token = _request_tokens.set(tally)
+    try:
+        yield
+    finally:
+        _request_tokens.reset(token)
+        if tally.passes:
+            GENERATED_TOKENS.observe(tally.tokens)
+
+
+def record_generated_tokens(tokens: int):
+    """Count the tokens of one model pass toward the current request"""
+    tally = _request_tokens.get()
+    if tally is None:
+        # Generation outside any request, e.g. a background job step
+        GENERATED_TOKENS.observe(tokens)
+    else:
+        tally.add(tokens)
+
+
+# Caches
+CACHE_REQUESTS = Counter('cache_requests_total', 'Cache lookups by outcome', ['cache', 'result'])
+
+
+def record_cache(cache: str, hit: bool):
+    """Count a cache lookup"""
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+# Memory
+MEMORY_BYTES = Gauge('process_memory_bytes', 'Memory used by this process', ['device', 'kind'])
+
+
+def _resident_memory() -> float:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        # ru_maxrss is the peak, in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _gpu_memory(stat: str):
+    # Only report GPU memory if the model code already imported torch
+    torch = sys.modules.get('torch')
+    if torch is None or not torch.cuda.is_available():
+        return None
+    return getattr(torch.cuda, stat)()
+
+
+MEMORY_BYTES.set_function(_resident_memory, device='cpu', kind='resident')
+MEMORY_BYTES.set_function(lambda: _gpu_memory('memory_allocated'), device='gpu', kind='allocated')
+MEMORY_BYTES.set_function(lambda: _gpu_memory('memory_reserved'), device='gpu', kind='reserved')
+
+
+class GenerationTimer:
+    """Streamer passed to model.generate() to split prefill from decode time.
+
+    generate() calls put() once with the prompt ids before running the model,
+    then once per generated step, and end() when it finishes.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_token = None
+        self.prefill_seconds = None
+        self.decode_seconds = None
+        self._calls = 0
+
+    def put(self, value):
+        self._calls += 1
+        if self._calls == 2:
+            self.first_token = time.perf_counter()
+            self.prefill_seconds = self.first_token - self.start
+            PREFILL_SECONDS.observe(self.prefill_seconds)
+
+    def end(self):
+        if self.first_token is not None:
+            self.decode_seconds = time.perf_counter() - self.first_token
+            DECODE_SECONDS.observe(self.decode_seconds)
+
+
+def instrumented_request_class():
+    """Return an HttpRequest subclass that times and traces every Google API call by method id"""
+    from googleapiclient.http import HttpRequest
+
+    class InstrumentedHttpRequest(HttpRequest):
+        def execute(self, *args, **kwargs):
+            service, _, method = (self.methodId or 'unknown.unknown').partition('.')
+            start = time.perf_counter()
+            try:
+                with tracing.span(f'google.{self.methodId}', http_method=self.method):
+                    return super().execute(*args, **kwargs)
+            except Exception:
+                GOOGLE_API_ERRORS.inc(service=service, method=method)
+                raise
+            finally:
+                GOOGLE_API_SECONDS.observe(time.perf_counter() - start, service=service, method=method)
+
+    return InstrumentedHttpRequest
@@ -0,0 +1,285 @@
+"""
+MIME helpers for Gmail message payloads (and raw messages from mail exports)
+
+Walks nested multipart payloads, decodes only the parts that are used
+(honoring each part's charset), turns HTML into plain text when a message
+has no text/plain part, and lists attachments so they can be downloaded
+on demand. Attachment data is decoded from the API's JSON response in
+chunks and written straight to disk. Replies can have the quoted history
+collapsed, since earlier messages of a thread are shown on their own.
+"""
+
+import base64
+import binascii
+import codecs
+import re
+from email.errors import HeaderParseError
+from email.header import decode_header, make_header
+from email.message import Message
+from html import unescape
+from html.parser import HTMLParser
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional
+
+NO_CONTENT = "No readable content"
+
+BLOCK_TAGS = {'p', 'div', 'br', 'tr', 'li', 'ul', 'ol', 'table', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+              'blockquote', 'pre', 'hr', 'section', 'article', 'header', 'footer'}
+SKIP_TAGS = {'script', 'style', 'head', 'title'}
+
+QUOTED_MARKER = "[quoted text collapsed]"
+# Lines that introduce the quoted history of a reply (Gmail/Apple, Outlook)
+QUOTE_HEADER = re.compile(
+    r'^(On .{0,200}wrote:|-{2,} ?Original Message ?-{2,}|_{5,}|From: .+\n(Sent|Date): .+)\s*$',
+    re.IGNORECASE | re.MULTILINE
+)
+
+
+def header_value(part: Dict[str, Any], name: str) -> Optional[str]:
+    name = name.lower()
+    return next((h['value'] for h in part.get('headers', []) if h['name'].lower() == name), None)
+
+
+def part_charset(part: Dict[str, Any]) -> str:
+    """Charset from the part's Content-Type header, defaulting to UTF-8"""
+    content_type = header_value(part, 'Content-Type') or ''
+    match = re.search(r'charset\s*=\s*"?([^";\s]+)"?', content_type, re.IGNORECASE)
+    charset = match.group(1) if match else 'utf-8'
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        return 'utf-8'
+    return charset
+
+
+def is_attachment(part: Dict[str, Any]) -> bool:
+    disposition = (header_value(part, 'Content-Disposition') or '').lower()
+    return bool(part.get('filename')) or disposition.startswith('attachment') or \
+        'attachmentId' in part.get('body', {})
+
+
+def walk_parts(payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Yield the leaf (non-multipart) parts of a payload, depth first, in document order"""
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        children = part.get('parts')
+        if children:
+            stack.extend(reversed(children))
+        elif not part.get('mimeType', '').startswith('multipart/'):
+            yield part
+
+
+def decode_part(part: Dict[str, Any]) -> str:
+    """Decode an inline part's body with its declared charset"""
+    data = part.get('body', {}).get('data')
+    if not data:
+        return ''
+    raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+    return raw.decode(part_charset(part), errors='replace')
+
+
+class _HTMLText(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks: List[str] = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip += 1
+        elif tag in BLOCK_TAGS:
+            self.chunks.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip = max(self._skip - 1, 0)
+        elif tag in BLOCK_TAGS:
+            self.chunks.append('\n')
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.chunks.append(data)
+
+
+def html_to_text(html: str) -> str:
+    """Readable plain text from an HTML body: scripts and styles dropped, blocks on their own lines"""
+    parser = _HTMLText()
+    try:
+        parser.feed(html)
+        parser.close()
+        text = ''.join(parser.chunks)
+    except Exception:
+        # Badly broken markup: strip tags crudely rather than lose the message
+        text = unescape(re.sub(r'<[^>]+>', ' ', html))
+    lines = (re.sub(r'[ \t\r\f\v]+', ' ', line).strip() for line in text.split('\n'))
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+
+def extract_body(payload: Dict[str, Any]) -> str:
+    """Text of a message: its text/plain parts, or its HTML converted to text if it has none"""
+    plain, html = [], None
+    for part in walk_parts(payload):
+        if is_attachment(part):
+            continue
+        mime_type = part.get('mimeType', '')
+        if mime_type == 'text/plain':
+            plain.append(part)
+        elif mime_type == 'text/html' and html is None:
+            html = part
+
+    # Only the parts that will be used are decoded
+    if plain:
+        text = '\n\n'.join(t for t in (decode_part(part).strip() for part in plain) if t)
+        if text:
+            return text
+    if html is not None:
+        text = html_to_text(decode_part(html))
+        if text:
+            return text
+    return NO_CONTENT
+
+
+def decode_header_value(value: Optional[str]) -> str:
+    """A raw (possibly RFC 2047 encoded) header as text"""
+    if value is None:
+        return ''
+    try:
+        return str(make_header(decode_header(value)))
+    except (HeaderParseError, LookupError, UnicodeError):
+        return str(value)
+
+
+def message_body(msg: Message) -> str:
+    """extract_body() for a raw RFC 822 message parsed with the email package (mbox and .eml files)"""
+    plain, html = [], None
+    for part in msg.walk():
+        if part.is_multipart() or part.get_content_disposition() == 'attachment' or part.get_filename():
+            continue
+        if part.get_content_type() == 'text/plain':
+            plain.append(part)
+        elif part.get_content_type() == 'text/html' and html is None:
+            html = part
+
+    if plain:
+        text = '\n\n'.join(t for t in (_decode_message_part(part).strip() for part in plain) if t)
+        if text:
+            return text
+    if html is not None:
+        text = html_to_text(_decode_message_part(html))
+        if text:
+            return text
+    return NO_CONTENT
+
+
+def _decode_message_part(part: Message) -> str:
+    raw = part.get_payload(decode=True) or b''
+    charset = part.get_content_charset() or 'utf-8'
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        charset = 'utf-8'
+    return raw.decode(charset, errors='replace')
+
+
+def collapse_quotes(text: str) -> str:
+    """A reply without the history it quotes: everything from "On ... wrote:" (or an Outlook
+    header) onwards, and each run of "> " lines, becomes a short marker"""
+    match = QUOTE_HEADER.search(text)
+    if match and text[:match.start()].strip():
+        text = text[:match.start()].rstrip() + f"\n\n{QUOTED_MARKER}"
+    lines, quoting = [], False
+    for line in text.split('\n'):
+        if line.lstrip().startswith('>'):
+            if not quoting:
+                lines.append(QUOTED_MARKER)
+            quoting = True
+        else:
+            quoting = False
+            lines.append(line)
+    return '\n'.join(lines).strip()
+
+
+def list_attachments(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Attachments of a message, without their data"""
+    attachments = []
+    for part in walk_parts(payload):
+        if not is_attachment(part):
+            continue
+        body = part.get('body', {})
+        attachments.append({
+            'part_id': part.get('partId'),
+            'filename': part.get('filename') or f"part-{part.get('partId', 'unknown')}",
+            'mime_type': part.get('mimeType', 'application/octet-stream'),
+            'size': body.get('size', 0),
+            'attachment_id': body.get('attachmentId'),
+            # Small attachments can be inlined in the payload instead of having an attachmentId
+            'data': body.get('data') if 'attachmentId' not in body else None,
+        })
+    return attachments
+
+
+class Base64FieldDecoder:
+    """Decode one base64url string field of a streamed JSON response straight into a file.
+
+    Feed it the raw response bytes chunk by chunk; only a few bytes of the encoded data
+    are buffered at a time, so memory does not depend on the attachment size.
+    """
+
+    def __init__(self, out: BinaryIO, field: str = 'data'):
+        self.out = out
+        self.marker = f'"{field}"'.encode('ascii')
+        self.written = 0
+        self.done = False
+        self._state = 'key'
+        self._buffer = b''
+
+    def feed(self, chunk: bytes):
+        if self.done:
+            return
+        self._buffer += chunk
+        if self._state == 'key':
+            index = self._buffer.find(self.marker)
+            if index < 0:
+                # Keep enough to match a marker split across chunks
+                self._buffer = self._buffer[-len(self.marker):]
+                return
+            self._buffer = self._buffer[index + len(self.marker):]
+            self._state = 'value'
+        if self._state == 'value':
+            quote = self._buffer.find(b'"')
+            if quote < 0:
+                self._buffer = b''
+                return
+            self._buffer = self._buffer[quote + 1:]
+            self._state = 'data'
+
+        end = self._buffer.find(b'"')
+        encoded = self._buffer if end < 0 else self._buffer[:end]
+        if end < 0:
+            # Decode whole 4-character groups and keep the remainder for the next chunk
+            usable = len(encoded) - len(encoded) % 4
+            encoded, self._buffer = encoded[:usable], encoded[usable:]
+        else:
+            encoded += b'=' * (-len(encoded) % 4)
+            self.done = True
+            self._buffer = b''
+        if encoded:
+            try:
+                data = base64.urlsafe_b64decode(encoded)
+            except binascii.Error as e:
+                raise ValueError(f"Invalid attachment data: {e}")
+            self.out.write(data)
+            self.written += len(data)
+
+    def close(self):
+        if not self.done:
+            raise ValueError(f"Response ended before the {self.marker.decode()} field was complete")
+
+
+def decode_base64_stream(chunks: Iterable[bytes], out: BinaryIO, field: str = 'data') -> int:
+    """Write the decoded `field` of a streamed JSON response to `out`; returns the bytes written"""
+    decoder = Base64FieldDecoder(out, field)
+    for chunk in chunks:
+        decoder.feed(chunk)
+    decoder.close()
+    return decoder.written
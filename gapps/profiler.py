@@ -0,0 +1,207 @@
+"""
+On-demand request profiler
+
+Disabled until armed through the authenticated /debug/profile endpoint.
+Once armed it profiles the next N requests, or a sampled fraction of them,
+and writes flamegraph-compatible output to Config.PROFILE_DIR:
+
+- 'sampling': a background thread samples the request thread's stack and
+  writes collapsed stacks (.folded) for flamegraph.pl or speedscope
+- 'deterministic': cProfile output (.prof) for snakeviz or flameprof
+
+An overhead guard limits profiling to one request at a time, a maximum
+number of profiles per minute, and a maximum profile duration.
+"""
+
+import cProfile
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Optional
+from config import Config
+
+MODES = ('sampling', 'deterministic')
+
+
+def check_token(token: Optional[str]) -> bool:
+    """Profiling is only available when PROFILER_TOKEN is set and matches"""
+    if not Config.PROFILER_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token, Config.PROFILER_TOKEN)
+
+
+class _StackSampler(threading.Thread):
+    """Periodically sample one thread's Python stack into collapsed-stack counts"""
+
+    def __init__(self, thread_id: int, interval: float, max_seconds: float):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.stacks: Counter = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stop_event.wait(self.interval) and time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class RequestProfiler:
+    def __init__(self, output_dir: str = None):
+        self.output_dir = output_dir or Config.PROFILE_DIR
+        self._lock = threading.Lock()
+        self._active = False
+        self._recent = deque()
+        self._state: Dict[str, Any] = {'armed': False}
+
+    def arm(self, count: int = None, sample_rate: float = None, mode: str = 'sampling',
+            interval_ms: float = None, endpoints=None, ttl_seconds: int = None) -> Dict[str, Any]:
+        """Start profiling the next `count` requests, or a `sample_rate` fraction of them"""
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiler mode '{mode}'. Available: {', '.join(MODES)}")
+        if count is None and sample_rate is None:
+            count = 1
+        if sample_rate is not None and not 0 < sample_rate <= 1:
+            raise ValueError("sample_rate must be in (0, 1]")
+
+        with self._lock:
+            self._state = {
+                'armed': True,
+                'mode': mode,
+                'remaining': count,
+                'sample_rate': sample_rate,
+                # Sampling faster than 1ms costs more than it tells us
+                'interval': max(interval_ms or Config.PROFILER_INTERVAL_MS, 1.0) / 1000,
+                'endpoints': list(endpoints) if endpoints else None,
+                'expires_at': time.time() + (ttl_seconds or Config.PROFILER_TTL_SECONDS),
+                'profiles': [],
+            }
+            return self._public_state()
+
+    def disarm(self) -> Dict[str, Any]:
+        with self._lock:
+            self._state['armed'] = False
+            return self._public_state()
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return self._public_state()
+
+    @contextmanager
+    def profile(self, endpoint: str):
+        """Profile the wrapped request if the profiler is armed and the overhead guard allows it"""
+        state = self._claim(endpoint)
+        if state is None:
+            yield
+            return
+
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        basename = os.path.join(self.output_dir, f"{timestamp}_{endpoint.strip('/').replace('/', '_')}")
+        try:
+            if state['mode'] == 'deterministic':
+                with self._deterministic(f"{basename}.prof"):
+                    yield
+            else:
+                with self._sampling(f"{basename}.folded", state['interval']):
+                    yield
+        finally:
+            with self._lock:
+                self._active = False
+
+    def _claim(self, endpoint: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            state = self._state
+            if not state['armed']:
+                return None
+            if time.time() > state['expires_at']:
+                state['armed'] = False
+                return None
+            if state['endpoints'] and endpoint not in state['endpoints']:
+                return None
+            if self._active:
+                # One profiled request at a time
+                return None
+
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            if len(self._recent) >= Config.PROFILER_MAX_PER_MINUTE:
+                return None
+
+            if state['remaining'] is None:
+                if random.random() >= state['sample_rate']:
+                    return None
+            else:
+                state['remaining'] -= 1
+                if state['remaining'] <= 0:
+                    state['armed'] = False
+
+            self._active = True
+            self._recent.append(now)
+            return dict(state)
+
+    @contextmanager
+    def _sampling(self, path: str, interval: float):
+        sampler = _StackSampler(threading.get_ident(), interval, Config.PROFILER_MAX_SECONDS)
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            self._write_folded(path, sampler.stacks)
+
+    @contextmanager
+    def _deterministic(self, path: str):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._ensure_output_dir()
+            profile.dump_stats(path)
+            self._record(path)
+
+    def _write_folded(self, path: str, stacks: Counter):
+        self._ensure_output_dir()
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        self._record(path)
+
+    def _record(self, path: str):
+        with self._lock:
+            self._state.setdefault('profiles', []).append(path)
+
+    def _ensure_output_dir(self):
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+
+    def _public_state(self) -> Dict[str, Any]:
+        state = dict(self._state)
+        if 'interval' in state:
+            state['interval_ms'] = state.pop('interval') * 1000
+        return state
+
+
+# Shared by the web servers
+profiler = RequestProfiler()
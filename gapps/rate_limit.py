@@ -0,0 +1,136 @@
+"""
+Rate limiting and retry helpers for Google API calls
+
+A thread-safe token bucket, and the exponential backoff with jitter used
+when Gmail answers 429 or 5xx. GMAIL_QUOTA is shared by every bulk
+operation in the process so together they stay inside the per-user quota.
+"""
+
+import random
+import threading
+import time
+from typing import Callable, Optional
+import requests
+from config import Config
+
+# Gmail quota units per call (https://developers.google.com/gmail/api/reference/quota)
+GMAIL_QUOTA_COSTS = {
+    'messages.list': 5,
+    'messages.get': 5,
+    'messages.attachments.get': 5,
+    'messages.send': 100,
+    'history.list': 2,
+    'getProfile': 1,
+    'threads.list': 10,
+    'threads.get': 10,
+}
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """Allow `rate` tokens per second on average, with bursts of up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens: float = 1, timeout: Optional[float] = None) -> bool:
+        """Block until `tokens` are available; returns False if that would take longer than timeout"""
+        if tokens > self.capacity:
+            raise ValueError(f"Cannot acquire {tokens} tokens from a bucket of capacity {self.capacity}")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def debit(self, tokens: float):
+        """Charge for tokens already spent without waiting; later acquires wait until they are repaid"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= tokens
+
+    def refund(self, tokens: float):
+        """Give back tokens that were acquired but not spent, up to capacity"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens + tokens)
+
+    def penalize(self, seconds: float):
+        """Stop handing out tokens for a while, e.g. after the server answered 429"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+
+def backoff_delay(attempt: int, base: float = None, cap: float = None) -> float:
+    """Full-jitter exponential backoff: a random delay in [0, min(cap, base * 2**attempt)]"""
+    base = Config.RETRY_BASE_SECONDS if base is None else base
+    cap = Config.RETRY_MAX_SECONDS if cap is None else cap
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def status_of(error: Exception) -> Optional[int]:
+    """HTTP status of an error from googleapiclient or requests, if it has one"""
+    resp = getattr(error, 'resp', None)
+    if resp is not None and getattr(resp, 'status', None) is not None:
+        return int(resp.status)
+    response = getattr(error, 'response', None)
+    if response is not None and getattr(response, 'status_code', None) is not None:
+        return int(response.status_code)
+    return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limiting, server errors and dropped connections are worth retrying"""
+    status = status_of(error)
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+    return isinstance(error, (ConnectionError, TimeoutError, requests.ConnectionError, requests.Timeout))
+
+
+# Shared by all bulk Gmail operations in this process
+GMAIL_QUOTA = TokenBucket(Config.GMAIL_QUOTA_UNITS_PER_SECOND, Config.GMAIL_QUOTA_BURST)
+
+
+def call_with_retries(fn: Callable, cost: float, quota: TokenBucket = None):
+    """Call fn after taking `cost` tokens from quota (GMAIL_QUOTA by default), backing off and retrying on 429/5xx"""
+    quota = quota or GMAIL_QUOTA
+    for attempt in range(Config.RETRY_MAX_ATTEMPTS):
+        if cost:
+            quota.acquire(cost)
+        try:
+            return fn()
+        except Exception as e:
+            if not is_retryable(e) or attempt == Config.RETRY_MAX_ATTEMPTS - 1:
+                raise
+            delay = backoff_delay(attempt)
+            if status_of(e) == 429:
+                # Slow every caller sharing the bucket down, not just this one
+                quota.penalize(delay)
+            time.sleep(delay)
@@ -9,13 +9,14 @@ from the frontend and processes them using your AI assistant.
 Usage:
     python run.py
 
-The server will start on http://127.0.0.1:5000 by default.
+The server will start on http://127.0.0.1:5000 by default (set BRIDGE_PORT to change it).
 Make sure your Next.js frontend is configured to send requests to this endpoint.
 """
 
 import sys
 import os
-from flask import Flask, request, jsonify
+import time
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 import logging
 from datetime import datetime
@@ -26,6 +27,12 @@ import traceback
 
 try:
     from ai_assistant import AIAssistant
+    from jobs import JobManager, check_job_token
+    import sync_daemon
+    from config import Config
+    import metrics
+    import tracing
+    from profiler import profiler, check_token
 except ImportError as e:
     print(f"Error importing AIAssistant: {e}")
     print("Make sure the gapps folder contains ai_assistant.py and all required dependencies are installed.")
@@ -46,15 +53,34 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Global variable to store the AI assistant instance
+@app.before_request
+def start_request_timer():
+    """Remember when the request started for the latency histogram"""
+    g.request_start = time.perf_counter()
+    metrics.REQUESTS_IN_FLIGHT.inc()
+
+@app.teardown_request
+def record_request_metrics(error=None):
+    """Record request latency, labelled by the matched route"""
+    if 'request_start' not in g:
+        return
+    metrics.REQUESTS_IN_FLIGHT.dec()
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+
+# Global variables to store the AI assistant and background job manager
 ai_assistant = None
+job_manager = None
+sync_worker = None
 
 def initialize_ai_assistant():
     """Initialize the AI assistant with error handling"""
-    global ai_assistant
+    global ai_assistant, job_manager, sync_worker
     try:
         logger.info("Initializing AI Assistant...")
         ai_assistant = AIAssistant()
+        job_manager = JobManager(ai_assistant)
+        sync_worker = sync_daemon.start_for(ai_assistant)
         logger.info("AI Assistant initialized successfully!")
         return True
     except Exception as e:
@@ -79,7 +105,8 @@ def get_response():
     
     Expected JSON payload:
     {
-        "message": "User's message here"
+        "message": "User's message here",
+        "debug": false  // optional, adds "timings" to the response
     }
     
     Returns:
@@ -116,19 +143,26 @@ def get_response():
                 'status': 'error'
             }), 400
         
-        logger.info(f"Processing message: {user_message[:100]}...")  # Log first 100 chars
+        logger.info(f"Processing message ({len(user_message)} chars): {user_message[:100]}...")  # Log first 100 chars
         
         # Process the message using AI assistant
-        ai_response = ai_assistant.process_user_query(user_message)
+        start = time.perf_counter()
+        with tracing.start_trace('POST /get_response') as trace, profiler.profile('/get_response'):
+            ai_response = ai_assistant.process_user_query(user_message)
+        elapsed = time.perf_counter() - start
         
-        logger.info(f"Generated response: {ai_response[:100]}...")  # Log first 100 chars
+        logger.info(f"Generated response ({len(ai_response)} chars) in {elapsed:.2f}s: {ai_response[:100]}...")  # Log first 100 chars
         
         # Return the response
-        return jsonify({
+        result = {
             'response': ai_response,
             'timestamp': datetime.now().isoformat(),
             'status': 'success'
-        })
+        }
+        if data.get('debug'):
+            # Per-stage latency breakdown of this message
+            result['timings'] = trace.breakdown()
+        return jsonify(result)
         
     except Exception as e:
         logger.error(f"Error processing request: {e}")
@@ -147,13 +181,111 @@ def chat_endpoint():
     """
     return get_response()
 
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Start a long-running action in the background.
+    
+    Expected JSON payload:
+    {
+        "kind": "archive_inbox" | "export_attachments" | "send_emails" | "email_digest" | "import_mailbox" | "telegram_analysis" | "query",
+        "params": {...}
+    }
+    
+    Returns the job record immediately; poll /jobs/<job_id> for progress.
+    send_emails and import_mailbox also need the X-Job-Token header to match JOB_TOKEN.
+    """
+    if job_manager is None:
+        return jsonify({
+            'error': 'AI Assistant not initialized',
+            'status': 'error'
+        }), 500
+    
+    data = request.get_json() or {}
+    kind = data.get('kind', '')
+    if not check_job_token(kind, request.headers.get('X-Job-Token')):
+        return jsonify({
+            'error': f"Job token missing or invalid for '{kind}' jobs",
+            'status': 'error'
+        }), 403
+    try:
+        job = job_manager.submit(kind, data.get('params') or {})
+    except ValueError as e:
+        return jsonify({
+            'error': str(e),
+            'status': 'error'
+        }), 400
+    
+    logger.info(f"Submitted {job['kind']} job {job['id']}")
+    return jsonify(job), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get the status, progress and result of a background job"""
+    job = job_manager.get(job_id) if job_manager else None
+    if not job:
+        return jsonify({
+            'error': 'Job not found',
+            'status': 'error'
+        }), 404
+    return jsonify(job)
+
+@app.route('/debug/profile', methods=['GET', 'POST', 'DELETE'])
+def profile_endpoint():
+    """
+    Arm (POST), inspect (GET) or disarm (DELETE) the request profiler.
+    Requires the X-Profiler-Token header to match PROFILER_TOKEN.
+    
+    POST payload (all optional):
+    {
+        "count": 5,                 // profile the next 5 requests
+        "sample_rate": 0.1,         // or profile 10% of requests
+        "mode": "sampling",         // or "deterministic"
+        "endpoints": ["/get_response"]
+    }
+    """
+    if not check_token(request.headers.get('X-Profiler-Token')):
+        return jsonify({
+            'error': 'Profiler token missing or invalid',
+            'status': 'error'
+        }), 403
+    
+    if request.method == 'GET':
+        return jsonify(profiler.status())
+    if request.method == 'DELETE':
+        return jsonify(profiler.disarm())
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        state = profiler.arm(
+            count=data.get('count'),
+            sample_rate=data.get('sample_rate'),
+            mode=data.get('mode', 'sampling'),
+            interval_ms=data.get('interval_ms'),
+            endpoints=data.get('endpoints'),
+            ttl_seconds=data.get('ttl_seconds')
+        )
+    except ValueError as e:
+        return jsonify({
+            'error': str(e),
+            'status': 'error'
+        }), 400
+    
+    logger.info(f"Profiler armed: {state}")
+    return jsonify(state)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Expose metrics in Prometheus text format"""
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
 @app.errorhandler(404)
 def not_found(error):
     """Handle 404 errors"""
     return jsonify({
         'error': 'Endpoint not found',
         'status': 'error',
-        'available_endpoints': ['/health', '/get_response', '/chat']
+        'available_endpoints': ['/health', '/get_response', '/chat', '/jobs', '/metrics']
     }), 404
 
 @app.errorhandler(500)
@@ -183,9 +315,9 @@ def main():
     print("✅ AI Assistant ready!")
     print("=" * 60)
     print("🌐 Starting Flask server...")
-    print("📡 Server will be available at: http://127.0.0.1:5000")
-    print("🔗 Health check: http://127.0.0.1:5000/health")
-    print("💬 Chat endpoint: http://127.0.0.1:5000/get_response")
+    print(f"📡 Server will be available at: http://127.0.0.1:{Config.BRIDGE_PORT}")
+    print(f"🔗 Health check: http://127.0.0.1:{Config.BRIDGE_PORT}/health")
+    print(f"💬 Chat endpoint: http://127.0.0.1:{Config.BRIDGE_PORT}/get_response")
     print("=" * 60)
     print("📝 Logs will be saved to: ai_server.log")
     print("🛑 Press Ctrl+C to stop the server")
@@ -195,7 +327,7 @@ def main():
         # Start the Flask development server
         app.run(
             host='0.0.0.0',
-            port=5000,
+            port=Config.BRIDGE_PORT,
             debug=False,  # Set to True for development debugging
             threaded=True  # Enable threading for better performance
         )
@@ -0,0 +1,109 @@
+"""
+Free/busy slot finding
+
+Busy times are (start, end) intervals in epoch seconds, one list per
+calendar: the user's own calendars come from the event cache, attendees'
+from freebusy.query. Each list is sorted and merged, the merged lists are
+combined with a k-way merge, and the union is swept once against the
+working hours of each day, so finding slots is O(n log n) in the number of
+busy intervals whatever the number of attendees or days searched.
+"""
+
+import heapq
+import math
+from datetime import datetime, time, timedelta
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+Interval = Tuple[float, float]
+
+
+def is_busy(event: Dict[str, Any]) -> bool:
+    """Whether an event blocks time: timed, not marked free, and not declined"""
+    if event.get('status') == 'cancelled' or event.get('transparency') == 'transparent':
+        return False
+    if 'dateTime' not in event.get('start', {}):
+        # All-day events (holidays, birthdays, out-of-office markers) label a day rather than fill it
+        return False
+    return not any(attendee.get('self') and attendee.get('responseStatus') == 'declined'
+                   for attendee in event.get('attendees', []))
+
+
+def _merge_sorted(intervals: Iterable[Interval]) -> List[Interval]:
+    merged: List[Interval] = []
+    for start, end in intervals:
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def merge_intervals(intervals: Iterable[Interval]) -> List[Interval]:
+    """Sorted, non-overlapping union of intervals; touching intervals are joined"""
+    return _merge_sorted(sorted(intervals))
+
+
+def union(busy: Dict[str, Iterable[Interval]]) -> List[Interval]:
+    """Merged busy time across calendars"""
+    return _merge_sorted(heapq.merge(*(merge_intervals(intervals) for intervals in busy.values())))
+
+
+def parse_clock(value: str) -> time:
+    """'09:00' or '9' as a time of day"""
+    hours, _, minutes = value.strip().partition(':')
+    return time(int(hours) % 24, int(minutes or 0))
+
+
+def working_windows(time_min: datetime, time_max: datetime, tz, day_start: time, day_end: time,
+                    weekdays: Sequence[int]) -> List[Interval]:
+    """Working hours of each working day between time_min and time_max, in tz"""
+    windows = []
+    lower, upper = time_min.timestamp(), time_max.timestamp()
+    day, last = time_min.astimezone(tz).date(), time_max.astimezone(tz).date()
+    while day <= last:
+        if day.weekday() in weekdays:
+            start = max(datetime.combine(day, day_start, tzinfo=tz).timestamp(), lower)
+            end = min(datetime.combine(day, day_end, tzinfo=tz).timestamp(), upper)
+            if end > start:
+                windows.append((start, end))
+        day += timedelta(days=1)
+    return windows
+
+
+def free_intervals(busy: List[Interval], windows: List[Interval]) -> List[Interval]:
+    """Parts of the windows not covered by busy; both lists sorted and non-overlapping"""
+    free, first = [], 0
+    for start, end in windows:
+        cursor = start
+        while first < len(busy) and busy[first][1] <= cursor:
+            first += 1
+        index = first
+        while index < len(busy) and busy[index][0] < end:
+            if busy[index][0] > cursor:
+                free.append((cursor, busy[index][0]))
+            cursor = max(cursor, busy[index][1])
+            index += 1
+        if cursor < end:
+            free.append((cursor, end))
+    return free
+
+
+def find_slots(busy: Dict[str, Iterable[Interval]], time_min: datetime, time_max: datetime, duration: timedelta,
+               tz, day_start: time, day_end: time, weekdays: Sequence[int], step: timedelta,
+               max_results: int) -> List[Interval]:
+    """The earliest meeting slot (on a step boundary of local time) in each free gap long enough for duration"""
+    gaps = free_intervals(union(busy), working_windows(time_min, time_max, tz, day_start, day_end, weekdays))
+    length, step_seconds = duration.total_seconds(), max(step.total_seconds(), 1)
+    slots = []
+    for gap_start, gap_end in gaps:
+        # Steps count from local midnight, so hourly slots start on the hour in tz whatever its UTC offset
+        midnight = datetime.combine(datetime.fromtimestamp(gap_start, tz).date(), time(0), tzinfo=tz).timestamp()
+        start = midnight + math.ceil((gap_start - midnight) / step_seconds) * step_seconds
+        if start + length <= gap_end:
+            slots.append((start, start + length))
+            if len(slots) >= max_results:
+                break
+    return slots
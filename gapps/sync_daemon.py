@@ -0,0 +1,207 @@
+"""
+Background sync daemon
+
+Keeps the local stores current so user queries read them without waiting
+on Google. Each registered store is polled on its own adaptive interval:
+any change found drops it back to SYNC_MIN_INTERVAL, and every idle poll
+stretches it by IDLE_BACKOFF up to SYNC_MAX_INTERVAL. Polls are paid for
+from a dedicated budget (SYNC_QUOTA_UNITS_PER_SECOND) and, for Gmail, from
+the shared per-user quota, so background sync never crowds out requests.
+Derived stores, like the semantic mail index, are polled as soon as the
+store they are built from changes.
+Seconds since each store's last successful sync are exported as
+sync_lag_seconds{store}.
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+from config import Config
+import metrics
+import rate_limit
+import tracing
+
+# Interval multiplier after a poll that found nothing new
+IDLE_BACKOFF = 1.5
+
+
+def gmail_sync_cost(result: Dict[str, Any]) -> float:
+    """Gmail quota units a GmailService.sync() run used"""
+    costs = rate_limit.GMAIL_QUOTA_COSTS
+    fetched = result.get('added', 0) * costs['messages.get']
+    if result.get('mode') == 'incremental':
+        return costs['history.list'] + fetched
+    if result.get('mode') == 'full':
+        pages = result.get('added', 0) // 500 + 1
+        return costs['getProfile'] + pages * costs['messages.list'] + fetched
+    return 0
+
+
+class SyncTask:
+    """One store to keep current"""
+
+    def __init__(self, name: str, sync: Callable[[], Dict[str, Any]], cost: Callable[[Dict[str, Any]], float],
+                 base_cost: float, quota: Optional[rate_limit.TokenBucket], interval: float):
+        self.name = name
+        self.sync = sync
+        self.cost = cost
+        self.base_cost = base_cost
+        self.quota = quota
+        self.interval = interval
+        self.next_run = time.monotonic()
+        self.registered_at = self.next_run
+        self.last_success: Optional[float] = None
+        # Set by nudge(); a nudge that arrives while a poll runs gets a poll of its own
+        self.nudged = False
+        # Stores polled right away whenever this one changes
+        self.triggers: List[str] = []
+
+    def lag(self) -> float:
+        return time.monotonic() - (self.last_success or self.registered_at)
+
+
+class SyncDaemon:
+    def __init__(self, min_interval: float = None, max_interval: float = None,
+                 budget: rate_limit.TokenBucket = None):
+        self.min_interval = min_interval or Config.SYNC_MIN_INTERVAL
+        self.max_interval = max(max_interval or Config.SYNC_MAX_INTERVAL, self.min_interval)
+        self.budget = budget or rate_limit.TokenBucket(Config.SYNC_QUOTA_UNITS_PER_SECOND,
+                                                       Config.SYNC_QUOTA_UNITS_PER_SECOND * 60)
+        self._tasks: Dict[str, SyncTask] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def register(self, name: str, sync: Callable[[], Dict[str, Any]],
+                 cost: Callable[[Dict[str, Any]], float] = None, base_cost: float = 1,
+                 quota: rate_limit.TokenBucket = None):
+        """Poll `sync` in the background; it returns counts of 'added', 'updated' and 'deleted' items.
+
+        base_cost quota units are reserved before each poll and cost(result) - base_cost charged after.
+        """
+        task = SyncTask(name, sync, cost or (lambda result: base_cost), base_cost, quota, self.min_interval)
+        with self._lock:
+            self._tasks[name] = task
+        metrics.SYNC_LAG.set_function(task.lag, store=name)
+        metrics.SYNC_INTERVAL.set_function(lambda: task.interval, store=name)
+        self._wake.set()
+
+    def register_gmail(self, gmail_service):
+        """Keep the GmailService mailbox cache current; its reads then stop syncing on the request path"""
+        if gmail_service.store is None:
+            return
+        costs = rate_limit.GMAIL_QUOTA_COSTS
+        self.register('gmail', gmail_service.sync, cost=gmail_sync_cost, base_cost=costs['history.list'],
+                      quota=rate_limit.GMAIL_QUOTA)
+        gmail_service.background_sync = True
+
+    def register_calendar(self, calendar_service):
+        """Keep the CalendarService event cache current; its reads then stop syncing on the request path"""
+        if calendar_service.store is None:
+            return
+        # Calendar quota is separate from Gmail's: only the daemon's own budget applies
+        self.register('calendar', calendar_service.sync, cost=lambda result: result.get('requests', 1))
+        calendar_service.background_sync = True
+
+    def register_mail_index(self, mail_index):
+        """Embed new mail in the background, so semantic searches only embed the query"""
+        if mail_index is None:
+            return
+        # Local work only: no Google quota
+        self.register('mail_index', mail_index.update, base_cost=0)
+        with self._lock:
+            if 'gmail' in self._tasks:
+                # New mail is embedded as soon as the mailbox sync brings it in
+                self._tasks['gmail'].triggers.append('mail_index')
+        mail_index.background_update = True
+
+    def nudge(self, name: str):
+        """Poll a store now, e.g. right after the user changed something"""
+        with self._lock:
+            task = self._tasks.get(name)
+            if task:
+                task.next_run = time.monotonic()
+                task.nudged = True
+        self._wake.set()
+
+    def start(self) -> 'SyncDaemon':
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sync-daemon', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                task = min(self._tasks.values(), key=lambda t: t.next_run, default=None)
+            delay = self.max_interval if task is None else task.next_run - time.monotonic()
+            if delay > 0:
+                # Woken early by register(), nudge() or stop()
+                self._wake.wait(delay)
+                self._wake.clear()
+                continue
+            self._poll(task)
+
+    def _poll(self, task: SyncTask):
+        with self._lock:
+            task.nudged = False
+        # Wait for budget rather than borrow from user traffic
+        if not self.budget.try_acquire(task.base_cost):
+            self._schedule(task, 1)
+            return
+        if task.quota is not None and not task.quota.try_acquire(task.base_cost):
+            # The poll did not happen, so it must not use up the daemon's budget either
+            self.budget.refund(task.base_cost)
+            self._schedule(task, 1)
+            return
+
+        try:
+            with tracing.start_trace(f"sync.{task.name}"):
+                result = task.sync()
+        except Exception as e:
+            print(f"Error syncing {task.name}: {e}")
+            metrics.SYNC_RUNS.inc(store=task.name, result='failed')
+            task.interval = min(self.max_interval, task.interval * 2)
+            self._schedule(task, task.interval)
+            return
+
+        extra = task.cost(result) - task.base_cost
+        if extra > 0:
+            self.budget.debit(extra)
+            if task.quota is not None:
+                task.quota.debit(extra)
+
+        changes = result.get('added', 0) + result.get('updated', 0) + result.get('deleted', 0)
+        metrics.SYNC_RUNS.inc(store=task.name, result='changed' if changes else 'unchanged')
+        # Busy stores are polled often, idle ones less and less
+        task.interval = self.min_interval if changes else min(self.max_interval, task.interval * IDLE_BACKOFF)
+        task.last_success = time.monotonic()
+        self._schedule(task, task.interval)
+        if changes:
+            for name in task.triggers:
+                self.nudge(name)
+
+    def _schedule(self, task: SyncTask, delay: float):
+        # Under the lock, like nudge(), so a nudge that arrived during the poll is not overwritten
+        with self._lock:
+            task.next_run = time.monotonic() + (0 if task.nudged else delay)
+
+
+def start_for(assistant) -> Optional[SyncDaemon]:
+    """Start background sync of the assistant's local stores, unless SYNC_DAEMON_ENABLED is false"""
+    if not Config.SYNC_DAEMON_ENABLED:
+        return None
+    daemon = SyncDaemon()
+    daemon.register_gmail(assistant.gmail_service)
+    daemon.register_mail_index(assistant.gmail_service.index)
+    daemon.register_calendar(assistant.calendar_service)
+    return daemon.start()
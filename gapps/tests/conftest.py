@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+# The gapps modules import each other by bare name, as when run from gapps/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Importing tracing must not start writing traces/spans.jsonl
+os.environ.setdefault('TRACE_EXPORTER', 'none')
+
+
+@pytest.fixture
+def fake_google(tmp_path, monkeypatch):
+    """The fake Gmail/Calendar API on a free port, with the local caches under tmp_path; yields its data"""
+    import fake_google_server
+    import google_clients
+    from config import Config
+
+    server = fake_google_server.start_server(0, message_count=30, event_count=100)
+    monkeypatch.setattr(Config, 'GOOGLE_API_ENDPOINT', f"http://127.0.0.1:{server.server_address[1]}")
+    monkeypatch.setattr(Config, 'MAIL_CACHE_PATH', str(tmp_path / 'mail_cache.sqlite3'))
+    monkeypatch.setattr(Config, 'EVENT_CACHE_PATH', str(tmp_path / 'event_cache.sqlite3'))
+    monkeypatch.setattr(Config, 'VECTOR_INDEX_DIR', str(tmp_path / 'mail_vectors'))
+    # Process-wide clients built for another endpoint must not be reused
+    for name in ('_credentials', '_http', '_session'):
+        monkeypatch.setattr(google_clients, name, None)
+    yield server.RequestHandlerClass.data
+    server.shutdown()
+    server.server_close()
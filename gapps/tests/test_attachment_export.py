@@ -0,0 +1,33 @@
+import json
+import os
+
+import rate_limit
+from attachment_export import AttachmentExporter
+from gmail_service import GmailService
+
+
+def test_identical_attachments_are_stored_once(fake_google, tmp_path):
+    # Every attachment has the same content, under different names
+    fake_google.attachment_data = lambda attachment_id: b'%PDF-1.4 same bytes\n' * 64
+    with_attachments = [m for m in fake_google.messages if m.get('attachment')]
+    with_attachments[0]['attachment'] = 'scan.PNG'
+    gmail = GmailService()
+    exporter = AttachmentExporter(gmail, output_dir=str(tmp_path / 'attachments'), max_workers=2,
+                                  quota=rate_limit.TokenBucket(rate=1000))
+
+    totals = exporter.export(gmail.iter_message_ids(query='has:attachment'))
+
+    assert totals['messages'] == len(with_attachments)
+    assert totals['attachments'] == len(with_attachments)
+    assert totals['deduplicated'] == len(with_attachments) - 1
+    assert totals['failed'] == 0
+    with open(totals['manifest'], encoding='utf-8') as f:
+        stored = [entry for entry in map(json.loads, f) if entry['status'] == 'stored']
+    assert len({entry['path'] for entry in stored}) == 1
+    # The object is named by its digest alone; the manifest keeps each name's extension
+    assert os.path.basename(stored[0]['path']) == stored[0]['sha256']
+    assert {entry['extension'] for entry in stored} == {'.png', '.pdf'}
+
+    again = exporter.export(gmail.iter_message_ids(query='has:attachment'))
+    assert again['skipped_messages'] == len(with_attachments)
+    assert again['attachments'] == 0
@@ -0,0 +1,78 @@
+import json
+
+from batch_runner import default_output_path, run_batch_file
+from config import Config
+
+
+class EchoAssistant:
+    def __init__(self):
+        self.batches = []
+
+    def iter_process_user_queries(self, queries):
+        self.batches.append(list(queries))
+        # Out of order, as concurrent handlers finish
+        for index in reversed(range(len(queries))):
+            yield index, f"answer to {queries[index]}"
+
+
+def write_lines(path, lines):
+    path.write_text(''.join(line + '\n' for line in lines), encoding='utf-8')
+
+
+def read_results(path):
+    return [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines() if line]
+
+
+def read_results_tolerant(path):
+    results = []
+    for line in path.read_text(encoding='utf-8').splitlines():
+        try:
+            results.append(json.loads(line))
+        except ValueError:
+            continue
+    return results
+
+
+def test_results_are_streamed_in_bounded_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'BATCH_CHUNK_SIZE', 2)
+    source = tmp_path / 'queries.jsonl'
+    write_lines(source, [json.dumps({'id': 'a', 'query': 'one'}), json.dumps('two'), '', 'not json',
+                         json.dumps({'query': ''}), json.dumps({'query': 'three'})])
+    assistant = EchoAssistant()
+
+    stats = run_batch_file(assistant, str(source))
+
+    assert stats == {'processed': 3, 'skipped': 0}
+    assert assistant.batches == [['one', 'two'], ['three']]
+    results = read_results(tmp_path / 'queries.results.jsonl')
+    assert {r['id']: r['response'] for r in results} == {
+        'a': 'answer to one', '2': 'answer to two', '6': 'answer to three'}
+
+
+def test_resume_skips_done_ids_and_repairs_a_partial_line(tmp_path):
+    source = tmp_path / 'queries.jsonl'
+    write_lines(source, [json.dumps({'id': i, 'query': f"q{i}"}) for i in range(4)])
+    output = tmp_path / 'out.jsonl'
+    output.write_text(json.dumps({'id': '0', 'query': 'q0', 'response': 'done'}) + '\n'
+                      + '{"id": "1", "que', encoding='utf-8')
+    assistant = EchoAssistant()
+
+    stats = run_batch_file(assistant, str(source), str(output))
+
+    assert stats == {'processed': 3, 'skipped': 1}
+    assert assistant.batches == [['q1', 'q2', 'q3']]
+    assert sorted(r['id'] for r in read_results_tolerant(output)) == ['0', '1', '2', '3']
+
+
+def test_without_resume_the_output_is_rewritten(tmp_path):
+    source = tmp_path / 'queries.jsonl'
+    write_lines(source, [json.dumps('only')])
+    output = tmp_path / 'out.jsonl'
+    output.write_text(json.dumps({'id': '1', 'response': 'stale'}) + '\n', encoding='utf-8')
+
+    assert run_batch_file(EchoAssistant(), str(source), str(output), resume=False)['processed'] == 1
+    assert [r['response'] for r in read_results(output)] == ['answer to only']
+
+
+def test_default_output_path():
+    assert default_output_path('/data/queries.jsonl') == '/data/queries.results.jsonl'
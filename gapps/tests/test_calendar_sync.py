@@ -0,0 +1,76 @@
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+from calendar_service import CalendarService
+from config import Config
+from event_store import event_bounds
+from fake_google_server import PRIMARY_CALENDAR
+
+
+def change_event(data, event):
+    with data.lock:
+        events = data.calendar_events[PRIMARY_CALENDAR]
+        events[:] = [e for e in events if e['id'] != event['id']] + ([] if event['status'] == 'cancelled' else [event])
+        data.record_event_change(PRIMARY_CALENDAR, event)
+
+
+def test_full_sync_gets_tokens_and_keeps_the_window(fake_google, monkeypatch):
+    monkeypatch.setattr(Config, 'EVENT_SYNC_PAST_DAYS', 3)
+    calendar = CalendarService()
+    result = calendar.sync()
+
+    assert result['mode'] == 'full'
+    for listed in calendar.store.calendars():
+        assert calendar.store.sync_token(listed['id'])
+    window_start = datetime.now(timezone.utc) - timedelta(days=3)
+    cached = calendar.store.events_between(datetime.fromtimestamp(0, timezone.utc), window_start + timedelta(days=365))
+    # Listed in full, filtered locally
+    assert 0 < len(cached) < sum(len(events) for events in fake_google.calendar_events.values())
+    assert min(event_bounds(event)[1] for event in cached) > window_start.timestamp() - 60
+
+    # Inside the window reads come from the cache; before it, from the API
+    assert calendar._cached_events(None, window_start + timedelta(hours=1), window_start + timedelta(days=1), 10)
+    assert calendar._cached_events(None, window_start - timedelta(days=1), window_start, 10) is None
+
+
+def test_changes_arrive_through_the_sync_token(fake_google):
+    calendar = CalendarService()
+    calendar.sync()
+    start = datetime.now(timezone.utc).replace(microsecond=0) + timedelta(days=1)
+    added = fake_google._event('evt-new', 'Dentist', start, start + timedelta(hours=1))
+    removed = dict(fake_google.calendar_events[PRIMARY_CALENDAR][-1], status='cancelled')
+    change_event(fake_google, added)
+    change_event(fake_google, removed)
+
+    result = calendar.sync()
+    assert result['mode'] == 'incremental'
+    assert (result['added'], result['deleted']) == (1, 1)
+    events = calendar.get_events('primary', max_results=None, time_min=start - timedelta(minutes=1),
+                                 time_max=start + timedelta(days=60))
+    ids = {event['id'] for event in events}
+    assert 'evt-new' in ids and removed['id'] not in ids
+
+
+def test_expired_sync_token_falls_back_to_a_full_sync(fake_google):
+    calendar = CalendarService()
+    calendar.sync()
+    with fake_google.lock:
+        fake_google.calendar_version += 1
+        fake_google.calendar_sync_floor = fake_google.calendar_version
+
+    result = calendar.sync()
+    assert result['mode'] == 'full'
+    assert calendar.store.sync_token(PRIMARY_CALENDAR) == str(fake_google.calendar_version)
+
+
+def test_a_broken_cache_falls_back_to_the_api(fake_google, monkeypatch):
+    calendar = CalendarService()
+    calendar.sync()
+
+    def locked(*args):
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(calendar.store, 'covers', locked)
+    now = datetime.now(timezone.utc)
+    events = calendar.get_events('primary', max_results=5, time_min=now, time_max=now + timedelta(days=7))
+    assert len(events) == 5
@@ -0,0 +1,88 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from google.auth.exceptions import RefreshError
+from google.oauth2.credentials import Credentials
+
+import credential_manager
+from credential_manager import CredentialManager, ManagedCredentials
+
+
+def utcnow():
+    # google-auth keeps expiry as naive UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def expired_credentials(manager):
+    creds = ManagedCredentials(token='old', refresh_token='refresh', client_id='id', client_secret='secret',
+                               token_uri='https://oauth2.example.com/token', scopes=manager.scopes)
+    creds.expiry = utcnow() - timedelta(minutes=1)
+    creds.on_refresh = manager.save
+    return creds
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return CredentialManager(['https://www.googleapis.com/auth/gmail.readonly'], str(tmp_path / 'token.json'),
+                             refresh_margin=0)
+
+
+def test_concurrent_refreshes_reach_google_once(manager, monkeypatch):
+    calls = []
+
+    def refresh(self, request):
+        calls.append(threading.current_thread().name)
+        time.sleep(0.05)
+        self.token = f"new-{len(calls)}"
+        self.expiry = utcnow() + timedelta(hours=1)
+
+    monkeypatch.setattr(Credentials, 'refresh', refresh)
+    manager.credentials = expired_credentials(manager)
+    start = threading.Barrier(8)
+
+    def worker():
+        start.wait()
+        manager.refresh()
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert manager.credentials.token == 'new-1'
+    # The refreshed token was saved, owner-only
+    with open(manager.token_file, encoding='utf-8') as f:
+        assert json.load(f)['token'] == 'new-1'
+    assert os.stat(manager.token_file).st_mode & 0o777 == 0o600
+    assert manager.seconds_until_refresh() > 3500
+
+
+def test_rejected_refresh_token_asks_for_oauth_py(manager, monkeypatch):
+    def refresh(self, request):
+        raise RefreshError('invalid_grant: Token has been expired or revoked.')
+
+    monkeypatch.setattr(Credentials, 'refresh', refresh)
+    manager.save(expired_credentials(manager))
+    monkeypatch.setattr(manager, 'run_flow', lambda port=0: pytest.fail('must not open a browser'))
+
+    with pytest.raises(RuntimeError, match='python oauth.py'):
+        manager.authenticate()
+
+
+def test_old_per_service_tokens_ask_for_oauth_py(manager, tmp_path, monkeypatch):
+    (tmp_path / 'token_gmail.json').write_text('{}', encoding='utf-8')
+    monkeypatch.setattr(manager, 'run_flow', lambda port=0: pytest.fail('must not open a browser'))
+
+    with pytest.raises(RuntimeError, match='token_gmail.json'):
+        manager.authenticate()
+
+
+def test_get_manager_is_shared(monkeypatch):
+    monkeypatch.setattr(credential_manager, '_manager', None)
+    assert credential_manager.get_manager(start=False) is credential_manager.get_manager(start=False)
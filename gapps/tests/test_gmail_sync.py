@@ -0,0 +1,53 @@
+from gmail_service import GmailService
+from mail_store import parse_gmail_query
+
+
+def record_change(data, change):
+    with data.lock:
+        data.history_id += 1
+        data.history.append(dict(change, id=str(data.history_id)))
+
+
+def test_first_sync_is_full_then_history_is_applied(fake_google):
+    gmail = GmailService()
+    result = gmail.sync()
+    assert result['mode'] == 'full'
+    assert gmail.store.message_count() == 30
+    assert gmail.store.get_state('history_id') == str(fake_google.history_id)
+    assert gmail.store.get_state('full_mailbox') == '1'
+
+    new = fake_google.add_message('Pelican sightings', 'zoe@example.com', 'Three pelicans at the pier.', ['INBOX'])
+    gone, relabeled = fake_google.messages[5], fake_google.messages[6]
+    record_change(fake_google, {'messagesDeleted': [{'message': {'id': gone['id']}}]})
+    record_change(fake_google, {'labelsAdded': [{'message': {'id': relabeled['id'], 'labelIds': ['INBOX', 'STARRED']}}]})
+
+    result = gmail.sync()
+    assert result == {'mode': 'incremental', 'added': 1, 'updated': 1, 'deleted': 1}
+    assert gmail.store.get_message(new['id'])['subject'] == 'Pelican sightings'
+    assert gmail.store.get_message(gone['id']) is None
+    assert gmail.store.get_message(relabeled['id'])['labels'] == ['INBOX', 'STARRED']
+    assert gmail.store.get_state('history_id') == str(fake_google.history_id)
+    # The synced body went through the FTS triggers
+    assert [e['id'] for e in gmail.store.search(parse_gmail_query('pelicans'))] == [new['id']]
+
+
+def test_expired_history_falls_back_to_a_full_sync(fake_google):
+    gmail = GmailService()
+    gmail.sync()
+    deleted = fake_google.messages.pop(0)
+    with fake_google.lock:
+        del fake_google.by_id[deleted['id']]
+        fake_google.history_id += 1
+        # Everything before now is outside the retained history
+        fake_google.history_floor = fake_google.history_id
+
+    result = gmail.sync()
+    assert result['mode'] == 'full'
+    assert result['deleted'] == 1
+    assert gmail.store.get_message(deleted['id']) is None
+
+
+def test_recent_sync_is_skipped(fake_google):
+    gmail = GmailService()
+    gmail.sync()
+    assert gmail.sync(max_age=60) == {'mode': 'skipped'}
@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+
+import google_clients
+from google_clients import HttpPool
+
+
+class FakeHttp:
+    def __init__(self):
+        self.requests = []
+        self.in_use = False
+
+    def request(self, uri, method='GET', **kwargs):
+        # httplib2 connections must never be shared by two threads at once
+        assert not self.in_use
+        self.in_use = True
+        self.requests.append(uri)
+        time.sleep(0.001)
+        self.in_use = False
+        return {'status': '200'}, uri.encode('utf-8')
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    opened = []
+
+    def new_http():
+        opened.append(FakeHttp())
+        return opened[-1]
+
+    monkeypatch.setattr(google_clients, 'new_http', new_http)
+    return opened
+
+
+def test_connections_are_reused_most_recent_first(opened):
+    pool = HttpPool(size=3)
+    with pool.connection() as first, pool.connection() as second:
+        assert first is not second
+    assert pool.request('https://example.com/a') == ({'status': '200'}, b'https://example.com/a')
+    assert len(opened) == 2
+    assert opened[0].requests == ['https://example.com/a']
+
+
+def test_no_more_than_size_connections_are_opened(opened):
+    pool = HttpPool(size=2, wait=5)
+    start = threading.Barrier(6)
+    errors = []
+
+    def worker(n):
+        start.wait()
+        try:
+            for i in range(20):
+                pool.request(f"https://example.com/{n}/{i}")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(opened) == 2
+    assert not any(http.in_use for http in opened)
+    assert sum(len(http.requests) for http in opened) == 120
+
+
+def test_waiting_for_a_busy_pool_times_out(opened):
+    pool = HttpPool(size=1, wait=0.05)
+    with pool.connection():
+        with pytest.raises(TimeoutError, match='GOOGLE_HTTP_POOL_SIZE'):
+            with pool.connection():
+                pass
+    # The connection went back to the pool once released
+    with pool.connection() as http:
+        assert http is opened[0]
@@ -0,0 +1,99 @@
+import json
+import threading
+
+import pytest
+
+import jobs
+from config import Config
+from jobs import JobManager, check_job_token
+
+
+class FakeAssistant:
+    def __init__(self):
+        self.release = threading.Event()
+
+    def process_user_query(self, query):
+        if query == 'fail':
+            raise RuntimeError('model unavailable')
+        if query == 'block':
+            self.release.wait(5)
+        return f"answer to {query}"
+
+    def archive_emails(self, max_results, query, filename, append, progress):
+        progress(0.5, 'halfway')
+        return {'count': max_results, 'query': query}
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = JobManager(FakeAssistant(), job_dir=str(tmp_path), max_workers=1)
+    yield manager
+    manager.assistant.release.set()
+    manager.shutdown()
+
+
+def wait_until_finished(manager, job):
+    for _ in range(100):
+        if job['status'] in jobs.TERMINAL_STATUSES:
+            return job
+        job = manager.wait_for_update(job['id'], job['updated_at'], timeout=0.1)
+    raise AssertionError(f"job {job['id']} did not finish: {job}")
+
+
+def test_job_runs_and_is_persisted(manager, tmp_path):
+    job = manager.submit('archive_inbox', {'max_results': '3'})
+    assert job['status'] == 'queued'
+
+    job = wait_until_finished(manager, job)
+    assert job['status'] == 'succeeded'
+    assert job['progress'] == 1.0
+    assert job['result'] == {'count': 3, 'query': None}
+    with open(tmp_path / f"{job['id']}.json", encoding='utf-8') as f:
+        assert json.load(f)['result'] == job['result']
+
+
+def test_failed_job_records_the_error(manager):
+    job = wait_until_finished(manager, manager.submit('query', {'query': 'fail'}))
+    assert job['status'] == 'failed'
+    assert job['error'] == 'model unavailable'
+
+
+def test_queue_depth_counts_jobs_waiting_for_a_worker(manager):
+    running = manager.submit('query', {'query': 'block'})
+    queued = manager.submit('query', {'query': 'next'})
+    assert manager.queue_depth() >= 1
+    manager.assistant.release.set()
+    assert wait_until_finished(manager, running)['result'] == 'answer to block'
+    assert wait_until_finished(manager, queued)['result'] == 'answer to next'
+    assert manager.queue_depth() == 0
+
+
+def test_unknown_kind_and_job_ids(manager):
+    with pytest.raises(ValueError):
+        manager.submit('rm_rf')
+    assert manager.get('0' * 32) is None
+    assert manager.get('../secrets') is None
+
+
+def test_jobs_left_running_by_a_previous_process_are_failed(tmp_path):
+    record = {'id': 'a' * 32, 'kind': 'query', 'status': 'running', 'updated_at': ''}
+    (tmp_path / f"{record['id']}.json").write_text(json.dumps(record), encoding='utf-8')
+
+    manager = JobManager(FakeAssistant(), job_dir=str(tmp_path), max_workers=1)
+    try:
+        job = manager.get(record['id'])
+        assert job['status'] == 'failed'
+        assert job['error'] == 'Interrupted by server restart'
+    finally:
+        manager.shutdown()
+
+
+def test_privileged_kinds_need_the_job_token(monkeypatch):
+    monkeypatch.setattr(Config, 'JOB_TOKEN', None)
+    assert check_job_token('archive_inbox', None)
+    assert not check_job_token('send_emails', 'anything')
+
+    monkeypatch.setattr(Config, 'JOB_TOKEN', 's3cret')
+    assert check_job_token('import_mailbox', 's3cret')
+    assert not check_job_token('import_mailbox', 'wrong')
+    assert not check_job_token('send_emails', None)
@@ -0,0 +1,63 @@
+import pytest
+
+from mail_import import iter_mbox, run_in_subprocess
+from mail_store import MailStore
+
+MBOX = (
+    b'From alice@example.com Mon Oct 19 09:00:00 2026\n'
+    b'Subject: first\n'
+    b'\n'
+    b'Hello\n'
+    b'>From the start, quoted\n'
+    b'>>From deeper\n'
+    b'From here on the line is not a separator\n'
+    b'\n'
+    b'From bob@example.com Mon Oct 19 10:00:00 2026\r\n'
+    b'Subject: second\r\n'
+    b'\r\n'
+    b'Bye\r\n'
+)
+
+
+def test_iter_mbox_splits_messages_and_unquotes_from_lines(tmp_path):
+    path = tmp_path / 'mail.mbox'
+    path.write_bytes(MBOX)
+    messages = list(iter_mbox(str(path)))
+    assert [from_line for from_line, _ in messages] == [
+        b'From alice@example.com Mon Oct 19 09:00:00 2026\n',
+        b'From bob@example.com Mon Oct 19 10:00:00 2026\r\n',
+    ]
+    first, second = messages[0][1], messages[1][1]
+    assert first == (b'Subject: first\n\nHello\nFrom the start, quoted\n>From deeper\n'
+                     b'From here on the line is not a separator\n\n')
+    assert second == b'Subject: second\r\n\r\nBye\r\n'
+
+
+def test_iter_mbox_empty_file(tmp_path):
+    path = tmp_path / 'empty.mbox'
+    path.write_bytes(b'')
+    assert list(iter_mbox(str(path))) == []
+
+
+def test_import_in_a_subprocess_reports_progress(tmp_path):
+    path = tmp_path / 'mail.mbox'
+    path.write_bytes(MBOX)
+    cache_path = str(tmp_path / 'mail_cache.sqlite3')
+    updates = []
+
+    result = run_in_subprocess(str(path), cache_path, embed=False, workers=1,
+                               progress=lambda fraction, totals: updates.append(fraction))
+
+    assert result == {'messages': 2, 'imported': 2, 'duplicates': 0, 'failed': 0}
+    assert updates[-1] == 1.0
+    store = MailStore(cache_path)
+    assert store.message_count() == 2
+    store.close()
+
+    # Importing again finds only duplicates
+    assert run_in_subprocess(str(path), cache_path, embed=False, workers=1)['duplicates'] == 2
+
+
+def test_failed_import_raises_with_the_childs_error(tmp_path):
+    with pytest.raises(RuntimeError, match='No .mbox or .eml files'):
+        run_in_subprocess(str(tmp_path), str(tmp_path / 'mail_cache.sqlite3'), embed=False)
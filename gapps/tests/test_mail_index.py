@@ -0,0 +1,98 @@
+import pytest
+
+import mail_index
+from config import Config
+from mail_index import HashingEmbedder, MailIndex
+from mail_store import MailStore
+
+TOPICS = ['offsite venue booking', 'quarterly budget review', 'printer out of toner', 'birthday cake order',
+          'server outage postmortem', 'new hire onboarding', 'conference travel plans', 'gym membership renewal']
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MailStore(str(tmp_path / 'mail_cache.sqlite3'))
+    yield store
+    store.close()
+
+
+def message(n, subject, sender='alice@example.com', labels=('INBOX',)):
+    return {'id': f"m{n}", 'thread_id': f"m{n}", 'subject': subject, 'sender': sender, 'internal_date': n,
+            'snippet': subject, 'body': f"Notes about the {subject}.", 'labels': list(labels)}
+
+
+def new_index(store, tmp_path):
+    return MailIndex(store, embedder=HashingEmbedder(), directory=str(tmp_path / 'mail_vectors'))
+
+
+def search_ids(index, text, **kwargs):
+    return [email_data['id'] for email_data in index.search(text, **kwargs)]
+
+
+def test_update_embeds_only_new_or_changed_mail(store, tmp_path):
+    store.upsert_messages(message(n, topic) for n, topic in enumerate(TOPICS))
+    index = new_index(store, tmp_path)
+
+    assert index.update() == {'added': len(TOPICS), 'updated': 0}
+    assert index.update() == {'added': 0, 'updated': 0}
+    assert search_ids(index, 'budget review', max_results=1) == ['m1']
+
+    store.upsert_messages([dict(message(9, 'conference travel plans'), body=None)])
+    assert index.update() == {'added': 1, 'updated': 0}
+    store.set_body('m9', 'Flights to the conference are booked.')
+    assert index.update() == {'added': 0, 'updated': 1}
+
+
+def test_deleted_mail_is_skipped_then_compacted_away(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'VECTOR_COMPACT_RATIO', 0.001)
+    store.upsert_messages(message(n, topic) for n, topic in enumerate(TOPICS))
+    index = new_index(store, tmp_path)
+    index.update()
+
+    store.delete_messages(['m1', 'm4'])
+    results = search_ids(index, 'budget review')
+    assert 'm1' not in results and len(results) == len(TOPICS) - 2
+
+    index.update()
+    assert len(index._ids) == index._live == len(TOPICS) - 2
+    assert store.get_state(f"vectors:{index.model}") == '1'
+    assert search_ids(index, 'printer toner', max_results=1) == ['m2']
+
+    # Another process's index picks up the compacted generation
+    other = new_index(store, tmp_path)
+    assert search_ids(other, 'new hire onboarding', max_results=1) == ['m5']
+    assert len(other._ids) == len(TOPICS) - 2
+
+
+def test_filtered_search_is_exact_once_clustered(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'VECTOR_IVF_MIN_VECTORS', 16)
+    monkeypatch.setattr(Config, 'VECTOR_IVF_PROBES', 1)
+    emails = [message(n, f"{TOPICS[n % len(TOPICS)]} {n}", sender='zed@example.org' if n % 3 else 'alice@example.com')
+              for n in range(96)]
+    store.upsert_messages(emails)
+    index = new_index(store, tmp_path)
+    index.update()
+    assert index._centroids is not None
+
+    # Unfiltered, only the nearest cluster is scored
+    assert len(search_ids(index, 'offsite venue booking', max_results=100)) < len(emails)
+    # Filtered, every match is scored, wherever it was clustered
+    zed = {e['id'] for e in emails if e['sender'] == 'zed@example.org'}
+    found = index.search('offsite venue booking', max_results=len(zed), filter_query='from:zed')
+    assert {email_data['id'] for email_data in found} == zed
+    assert found[0]['subject'].startswith('offsite venue booking')
+    with pytest.raises(ValueError):
+        index.search('budget', filter_query='has:attachment')
+
+
+def test_missing_sentence_transformers_is_reported_once(monkeypatch, capsys):
+    def unavailable():
+        raise ImportError('No module named sentence_transformers')
+
+    monkeypatch.setattr(Config, 'EMBEDDING_BACKEND', 'auto')
+    monkeypatch.setattr(mail_index, 'SentenceTransformerEmbedder', unavailable)
+    monkeypatch.setattr(mail_index, '_fallback_reported', False)
+
+    assert isinstance(mail_index.load_embedder(), HashingEmbedder)
+    assert isinstance(mail_index.load_embedder(), HashingEmbedder)
+    assert capsys.readouterr().out.count('sentence-transformers is not installed') == 1
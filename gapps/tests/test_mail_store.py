@@ -0,0 +1,121 @@
+from datetime import datetime
+
+import pytest
+
+from mail_store import MailStore, parse_gmail_query
+
+
+def test_words_phrases_and_fields():
+    parsed = parse_gmail_query('from:alice subject:"q3 budget" "offsite plan" review')
+    assert parsed['terms'] == ['offsite plan', 'review']
+    assert parsed['fields'] == [('sender', 'alice'), ('subject', 'q3 budget')]
+
+
+def test_label_operators():
+    parsed = parse_gmail_query('is:unread in:inbox label:starred is:read in:anywhere')
+    assert parsed['labels'] == ['UNREAD', 'INBOX', 'STARRED']
+    assert parsed['without_labels'] == ['UNREAD']
+    assert parsed['anywhere']
+    assert parse_gmail_query('in:spam in:trash')['labels'] == ['SPAM', 'TRASH']
+
+
+def test_absolute_dates_are_epoch_milliseconds():
+    parsed = parse_gmail_query('after:2026/01/02 before:2026-02-03')
+    assert parsed['after'] == int(datetime(2026, 1, 2).timestamp() * 1000)
+    assert parsed['before'] == int(datetime(2026, 2, 3).timestamp() * 1000)
+
+
+def test_relative_dates():
+    parsed = parse_gmail_query('newer_than:7d')
+    expected = (datetime.now().timestamp() - 7 * 86400) * 1000
+    assert abs(parsed['after'] - expected) < 60 * 1000
+    assert parse_gmail_query('older_than:1y')['before'] is not None
+
+
+def test_urls_are_words_not_operators():
+    assert parse_gmail_query('https://example.com/invoice')['terms'] == ['https://example.com/invoice']
+
+
+@pytest.mark.parametrize('query', [
+    'to:bob',
+    'has:attachment',
+    'alice OR bob',
+    '-label:spam',
+    '{alice bob}',
+    'after:yesterday',
+    'label:receipts',
+    '"unbalanced',
+])
+def test_unsupported_syntax_is_left_to_gmail(query):
+    assert parse_gmail_query(query) is None
+
+
+def test_empty_query():
+    assert parse_gmail_query('') == {'terms': [], 'fields': [], 'labels': [], 'without_labels': [],
+                                     'after': None, 'before': None, 'anywhere': False}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MailStore(str(tmp_path / 'mail_cache.sqlite3'))
+    yield store
+    store.close()
+
+
+def message(message_id, subject, labels=('INBOX',), internal_date=0, body=None):
+    return {'id': message_id, 'thread_id': message_id, 'subject': subject, 'sender': 'alice@example.com',
+            'internal_date': internal_date, 'snippet': subject, 'body': body, 'labels': list(labels)}
+
+
+def search_ids(store, query):
+    return [email_data['id'] for email_data in store.search(parse_gmail_query(query))]
+
+
+def test_index_follows_inserts_updates_and_deletes(store):
+    store.upsert_messages([message('m1', 'Harbour cruise tickets'), message('m2', 'Budget review')])
+    assert search_ids(store, 'harbour') == ['m1']
+
+    store.upsert_messages([message('m1', 'Lighthouse tour tickets')])
+    assert search_ids(store, 'harbour') == []
+    assert search_ids(store, 'lighthouse') == ['m1']
+
+    store.set_body('m2', 'The spreadsheet has the quarterly numbers')
+    assert search_ids(store, 'spreadsheet') == ['m2']
+
+    store.delete_messages(['m1'])
+    assert search_ids(store, 'tickets') == []
+
+
+def test_matches_are_ranked_and_filtered(store):
+    store.upsert_messages([
+        message('body', 'Weekly notes', body='the invoice is attached', internal_date=2),
+        message('subject', 'Invoice 42', labels=['INBOX', 'UNREAD'], internal_date=1),
+    ])
+    # A subject hit outweighs a body hit
+    assert search_ids(store, 'invoice') == ['subject', 'body']
+    assert search_ids(store, 'invoice is:unread') == ['subject']
+    assert search_ids(store, 'subject:invoice') == ['subject']
+    # Operator-only searches are newest first
+    assert search_ids(store, 'in:inbox') == ['body', 'subject']
+
+
+def test_spam_and_trash_only_when_asked_for(store):
+    store.upsert_messages([message('inbox', 'Prize draw'), message('spam', 'Prize draw', labels=['SPAM']),
+                           message('trash', 'Prize draw', labels=['TRASH'])])
+    assert search_ids(store, 'prize') == ['inbox']
+    assert search_ids(store, 'prize in:spam') == ['spam']
+    assert search_ids(store, 'prize in:trash') == ['trash']
+    assert sorted(search_ids(store, 'prize in:anywhere')) == ['inbox', 'spam', 'trash']
+
+
+def test_existing_messages_are_indexed_when_the_index_is_created(tmp_path):
+    path = str(tmp_path / 'old.sqlite3')
+    store = MailStore(path)
+    store.upsert_messages([message('m1', 'Orchard harvest')])
+    store._conn.executescript("DROP TABLE messages_fts; DROP TRIGGER messages_fts_insert; "
+                              "DROP TRIGGER messages_fts_delete; DROP TRIGGER messages_fts_update;")
+    store.close()
+
+    store = MailStore(path)
+    assert search_ids(store, 'orchard') == ['m1']
+    store.close()
@@ -0,0 +1,47 @@
+import threading
+
+import pytest
+
+import metrics
+import tracing
+
+
+def observed():
+    """(count, sum) of GENERATED_TOKENS so far"""
+    series = metrics.GENERATED_TOKENS._series.get((), [0] * (len(metrics.GENERATED_TOKENS.buckets) + 2))
+    return sum(series[:-1]), series[-1]
+
+
+@pytest.fixture(autouse=True)
+def reset_histogram():
+    metrics.GENERATED_TOKENS._series.clear()
+
+
+def test_every_pass_of_a_request_is_observed_once_in_total():
+    with metrics.count_request_tokens():
+        metrics.record_generated_tokens(10)
+        # A nested request, e.g. process_user_query inside a job, belongs to the outer one
+        with metrics.count_request_tokens():
+            metrics.record_generated_tokens(5)
+        worker = threading.Thread(target=tracing.wrap(metrics.record_generated_tokens), args=(7,))
+        worker.start()
+        worker.join()
+    assert observed() == (1, 22)
+
+
+def test_batched_pass_counts_toward_the_finishing_step():
+    with metrics.count_request_tokens(30):
+        metrics.record_generated_tokens(4)
+    assert observed() == (1, 34)
+
+
+def test_requests_without_generation_are_not_observed():
+    with metrics.count_request_tokens():
+        pass
+    assert observed() == (0, 0.0)
+
+
+def test_generation_outside_a_request_is_observed_directly():
+    metrics.record_generated_tokens(3)
+    metrics.record_generated_tokens(4)
+    assert observed() == (2, 7)
@@ -0,0 +1,54 @@
+import base64
+import io
+import json
+
+import pytest
+
+from mime_utils import Base64FieldDecoder, decode_base64_stream
+
+PAYLOAD = bytes(range(256)) * 40
+
+
+def response(payload: bytes = PAYLOAD) -> bytes:
+    data = base64.urlsafe_b64encode(payload).rstrip(b'=').decode('ascii')
+    return json.dumps({'size': len(payload), 'data': data}).encode('utf-8')
+
+
+def chunks(raw: bytes, size: int):
+    return [raw[i:i + size] for i in range(0, len(raw), size)]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 7, 64, 4096, 1 << 20])
+def test_decodes_whatever_the_chunk_size(size):
+    out = io.BytesIO()
+    assert decode_base64_stream(chunks(response(), size), out) == len(PAYLOAD)
+    assert out.getvalue() == PAYLOAD
+
+
+def test_marker_split_across_chunks():
+    raw = response(b'hello world')
+    split = raw.index(b'"data"') + 3
+    out = io.BytesIO()
+    decoder = Base64FieldDecoder(out)
+    decoder.feed(raw[:split])
+    decoder.feed(raw[split:])
+    decoder.close()
+    assert out.getvalue() == b'hello world'
+
+
+def test_other_fields_containing_the_name_are_ignored():
+    raw = b'{"metadata": "eA", "data": "' + base64.urlsafe_b64encode(b'ok').rstrip(b'=') + b'"}'
+    out = io.BytesIO()
+    decode_base64_stream(chunks(raw, 3), out)
+    assert out.getvalue() == b'ok'
+
+
+def test_truncated_response_is_an_error():
+    raw = response()
+    with pytest.raises(ValueError):
+        decode_base64_stream(chunks(raw[:len(raw) // 2], 100), io.BytesIO())
+
+
+def test_missing_field_is_an_error():
+    with pytest.raises(ValueError):
+        decode_base64_stream([b'{"size": 0}'], io.BytesIO())
@@ -0,0 +1,118 @@
+import pytest
+
+import rate_limit
+from rate_limit import TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(rate_limit.time, 'sleep', clock.sleep)
+    return clock
+
+
+def test_burst_up_to_capacity_then_refill_at_rate(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+    clock.now += 0.5
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+
+def test_refill_is_capped_at_capacity(clock):
+    bucket = TokenBucket(rate=10, capacity=2)
+    clock.now += 60
+    assert bucket.try_acquire(2)
+    assert not bucket.try_acquire(1)
+
+
+def test_acquire_waits_for_tokens(clock):
+    bucket = TokenBucket(rate=4, capacity=4)
+    assert bucket.acquire(4)
+    assert bucket.acquire(2)
+    assert clock.slept == [pytest.approx(0.5)]
+
+
+def test_acquire_gives_up_after_timeout(clock):
+    bucket = TokenBucket(rate=1, capacity=5)
+    bucket.acquire(5)
+    assert not bucket.acquire(3, timeout=2)
+    assert clock.slept == []
+
+
+def test_acquire_more_than_capacity_is_an_error(clock):
+    with pytest.raises(ValueError):
+        TokenBucket(rate=1, capacity=2).acquire(3)
+
+
+def test_debit_and_penalize_delay_later_acquires(clock):
+    bucket = TokenBucket(rate=10, capacity=10)
+    bucket.debit(15)
+    assert not bucket.try_acquire()
+    clock.now += 0.6
+    assert bucket.try_acquire()
+
+    bucket.penalize(2)
+    clock.now += 1.9
+    assert not bucket.try_acquire()
+    clock.now += 0.2
+    assert bucket.try_acquire()
+
+
+def test_rate_must_be_positive():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+
+
+def test_backoff_delay_is_capped(monkeypatch):
+    monkeypatch.setattr(rate_limit.random, 'uniform', lambda low, high: high)
+    assert rate_limit.backoff_delay(0, base=0.5, cap=8) == 0.5
+    assert rate_limit.backoff_delay(3, base=0.5, cap=8) == 4
+    assert rate_limit.backoff_delay(10, base=0.5, cap=8) == 8
+
+
+class Unavailable(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.response = type('Response', (), {'status_code': status})()
+
+
+def test_call_with_retries_charges_the_quota_per_attempt(clock, monkeypatch):
+    monkeypatch.setattr(rate_limit.random, 'uniform', lambda low, high: high)
+    monkeypatch.setattr(rate_limit.Config, 'RETRY_BASE_SECONDS', 1)
+    monkeypatch.setattr(rate_limit.Config, 'RETRY_MAX_ATTEMPTS', 5)
+    bucket = TokenBucket(rate=10, capacity=10)
+    outcomes = [Unavailable(429), Unavailable(503), 'listed']
+
+    def call():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert rate_limit.call_with_retries(call, 5, bucket) == 'listed'
+    # Backoff 1s; the 429 emptied the bucket, so the second attempt waits 0.5s for its tokens; backoff 2s
+    assert clock.slept == [pytest.approx(1), pytest.approx(0.5), pytest.approx(2)]
+
+
+def test_call_with_retries_gives_up_on_other_errors(clock):
+    def call():
+        raise Unavailable(404)
+
+    with pytest.raises(Unavailable):
+        rate_limit.call_with_retries(call, 5, TokenBucket(rate=100))
+    assert clock.slept == []
@@ -0,0 +1,77 @@
+from datetime import datetime, time, timedelta, timezone
+
+import slot_finder
+
+IST = timezone(timedelta(hours=5, minutes=30))
+WEEKDAYS = range(5)
+
+
+def at(day, hour, minute=0, tz=timezone.utc):
+    return datetime(2026, 10, day, hour, minute, tzinfo=tz).timestamp()
+
+
+def test_merge_intervals_joins_overlapping_and_touching():
+    merged = slot_finder.merge_intervals([(5, 7), (1, 3), (3, 4), (2, 3.5), (10, 12)])
+    assert merged == [(1, 4), (5, 7), (10, 12)]
+
+
+def test_merge_intervals_drops_empty_intervals():
+    assert slot_finder.merge_intervals([(4, 4), (6, 5), (1, 2)]) == [(1, 2)]
+
+
+def test_union_merges_across_calendars():
+    busy = {'me': [(1, 3), (8, 9)], 'alice': [(2, 5)], 'bob': [(5, 6), (20, 21)]}
+    assert slot_finder.union(busy) == [(1, 6), (8, 9), (20, 21)]
+
+
+def test_free_intervals_sweeps_windows_once():
+    busy = [(2, 3), (5, 11), (14, 20)]
+    windows = [(0, 4), (6, 10), (12, 16)]
+    assert slot_finder.free_intervals(busy, windows) == [(0, 2), (3, 4), (12, 14)]
+
+
+def test_free_intervals_busy_at_window_edges():
+    assert slot_finder.free_intervals([(0, 2), (8, 10)], [(0, 10)]) == [(2, 8)]
+    assert slot_finder.free_intervals([], [(0, 10)]) == [(0, 10)]
+
+
+def test_working_windows_skip_weekends_and_clip_to_range():
+    # Fri 23 Oct 2026 14:00 to Mon 26 Oct 2026 12:00
+    windows = slot_finder.working_windows(datetime(2026, 10, 23, 14, tzinfo=timezone.utc),
+                                          datetime(2026, 10, 26, 12, tzinfo=timezone.utc),
+                                          timezone.utc, time(9), time(17), WEEKDAYS)
+    assert windows == [(at(23, 14), at(23, 17)), (at(26, 9), at(26, 12))]
+
+
+def test_find_slots_returns_earliest_slot_per_gap():
+    busy = {'me': [(at(19, 9), at(19, 10)), (at(19, 11), at(19, 16))]}
+    slots = slot_finder.find_slots(busy, datetime(2026, 10, 19, tzinfo=timezone.utc),
+                                   datetime(2026, 10, 20, tzinfo=timezone.utc), timedelta(minutes=30),
+                                   timezone.utc, time(9), time(17), WEEKDAYS, timedelta(minutes=30), 10)
+    assert slots == [(at(19, 10), at(19, 10, 30)), (at(19, 16), at(19, 16, 30))]
+
+
+def test_find_slots_skips_gaps_shorter_than_duration():
+    busy = {'me': [(at(19, 9), at(19, 10)), (at(19, 10, 30), at(19, 17))]}
+    slots = slot_finder.find_slots(busy, datetime(2026, 10, 19, tzinfo=timezone.utc),
+                                   datetime(2026, 10, 20, tzinfo=timezone.utc), timedelta(hours=1),
+                                   timezone.utc, time(9), time(17), WEEKDAYS, timedelta(minutes=15), 10)
+    assert slots == []
+
+
+def test_find_slots_align_to_local_time():
+    # Hourly steps in a +05:30 zone start on the local hour, not at :30
+    busy = {'me': [(at(19, 9, 0, IST), at(19, 9, 10, IST))]}
+    slots = slot_finder.find_slots(busy, datetime(2026, 10, 19, tzinfo=IST), datetime(2026, 10, 20, tzinfo=IST),
+                                   timedelta(minutes=30), IST, time(9), time(17), WEEKDAYS,
+                                   timedelta(hours=1), 1)
+    assert slots == [(at(19, 10, 0, IST), at(19, 10, 30, IST))]
+
+
+def test_is_busy_ignores_free_all_day_and_declined_events():
+    timed = {'start': {'dateTime': '2026-10-19T09:00:00Z'}, 'end': {'dateTime': '2026-10-19T10:00:00Z'}}
+    assert slot_finder.is_busy(timed)
+    assert not slot_finder.is_busy({**timed, 'transparency': 'transparent'})
+    assert not slot_finder.is_busy({**timed, 'status': 'cancelled'})
+    assert not slot_finder.is_busy({**timed, 'attendees': [{'self': True, 'responseStatus': 'declined'}]})
+    assert not slot_finder.is_busy({'start': {'date': '2026-10-19'}, 'end': {'date': '2026-10-20'}})
@@ -0,0 +1,75 @@
+import threading
+
+import pytest
+
+import rate_limit
+from sync_daemon import SyncDaemon
+
+
+@pytest.fixture
+def daemon():
+    return SyncDaemon(min_interval=10, max_interval=100, budget=rate_limit.TokenBucket(rate=0.001, capacity=5))
+
+
+def test_idle_polls_back_off_and_changes_reset_the_interval(daemon):
+    results = [{'added': 0}, {'added': 0}, {'added': 2}]
+    daemon.register('mail', lambda: results.pop(0), base_cost=0)
+    task = daemon._tasks['mail']
+
+    daemon._poll(task)
+    daemon._poll(task)
+    assert task.interval == pytest.approx(22.5)
+    daemon._poll(task)
+    assert task.interval == 10
+    assert task.last_success is not None
+
+
+def test_changes_nudge_the_stores_derived_from_them(daemon):
+    daemon.register('gmail', lambda: {'added': 1}, base_cost=0)
+    daemon.register('mail_index', lambda: {'added': 0}, base_cost=0)
+    daemon._tasks['gmail'].triggers.append('mail_index')
+    daemon._poll(daemon._tasks['mail_index'])
+    assert daemon._tasks['mail_index'].next_run > daemon._tasks['gmail'].next_run
+
+    daemon._poll(daemon._tasks['gmail'])
+    assert daemon._tasks['mail_index'].next_run < daemon._tasks['gmail'].next_run
+
+
+def test_an_exhausted_user_quota_does_not_spend_the_daemon_budget(daemon):
+    quota = rate_limit.TokenBucket(rate=0.001, capacity=2)
+    quota.try_acquire(2)
+    daemon.register('gmail', lambda: pytest.fail('polled without quota'), base_cost=2, quota=quota)
+
+    for _ in range(5):
+        daemon._poll(daemon._tasks['gmail'])
+    assert daemon.budget.try_acquire(5)
+
+
+def test_a_nudge_during_a_poll_is_kept(daemon):
+    daemon.register('gmail', lambda: daemon.nudge('gmail') or {'added': 0}, base_cost=0)
+    task = daemon._tasks['gmail']
+    daemon._poll(task)
+    # Changes made while the poll was running may have been missed, so it runs again right away
+    assert task.next_run < task.last_success + task.interval / 2
+
+
+def test_failed_polls_back_off(daemon):
+    def fail():
+        raise ConnectionError('offline')
+
+    daemon.register('calendar', fail, base_cost=0)
+    task = daemon._tasks['calendar']
+    daemon._poll(task)
+    daemon._poll(task)
+    assert task.interval == 40
+    assert task.last_success is None
+
+
+def test_background_thread_polls_until_stopped(daemon):
+    polled = threading.Event()
+    daemon.register('calendar', lambda: polled.set() or {'added': 0}, base_cost=0)
+    daemon.start()
+    try:
+        assert polled.wait(5)
+    finally:
+        daemon.stop()
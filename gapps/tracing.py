@@ -0,0 +1,271 @@
+"""
+Lightweight request-scoped tracing
+
+Spans are tracked with contextvars, so nesting follows the call stack and
+carries over to worker threads when work is submitted through `wrap()`.
+Finished spans are exported off the request path, to a local JSONL file
+(Config.TRACE_FILE, rotated by size) or to an OTLP/HTTP collector
+(Config.TRACE_OTLP_ENDPOINT), and the spans of the current trace can be
+returned as a latency breakdown.
+"""
+
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+from config import Config
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar('current_span', default=None)
+_current_trace: contextvars.ContextVar = contextvars.ContextVar('current_trace', default=None)
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'attributes',
+                 'start_ns', 'end_ns', 'status', 'thread')
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = 'ok'
+        self.thread = threading.current_thread().name
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns or time.time_ns()
+        return round((end_ns - self.start_ns) / 1e6, 3)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start_ns': self.start_ns,
+            'end_ns': self.end_ns,
+            'duration_ms': self.duration_ms,
+            'status': self.status,
+            'thread': self.thread,
+            'attributes': self.attributes,
+        }
+
+
+class Trace:
+    """The spans finished so far for one request"""
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def breakdown(self) -> List[Dict[str, Any]]:
+        """Per-stage latencies, ordered by start time"""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start_ns)
+        names = {s.span_id: s.name for s in spans}
+        return [{
+            'name': s.name,
+            'parent': names.get(s.parent_id),
+            'start_offset_ms': round((s.start_ns - spans[0].start_ns) / 1e6, 3),
+            'duration_ms': s.duration_ms,
+            'status': s.status,
+            'attributes': s.attributes,
+        } for s in spans]
+
+
+class _JsonlExporter:
+    """Append spans to a JSONL file from a background thread, rotating it once it reaches max_bytes"""
+
+    def __init__(self, path: str, max_bytes: int = 0, backups: int = 3, flush_interval: float = 1.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue(maxsize=10000)
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        threading.Thread(target=self._worker, name='trace-writer', daemon=True).start()
+
+    def export(self, span: Span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            # Never block the request path on the disk
+            pass
+
+    def _worker(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                print(f"Error writing traces: {e}")
+
+    def _write(self, spans: List[Span]):
+        lines = ''.join(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + '\n' for span in spans)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+            size = f.tell()
+        if self.max_bytes and size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        """spans.jsonl -> spans.jsonl.1 -> ... -> spans.jsonl.<backups>, dropping the oldest"""
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+class _OtlpExporter:
+    """Send spans to an OTLP/HTTP JSON endpoint from a background thread"""
+
+    def __init__(self, endpoint: str, batch_size: int = 64, flush_interval: float = 2.0):
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue(maxsize=10000)
+        threading.Thread(target=self._worker, name='trace-exporter', daemon=True).start()
+
+    def export(self, span: Span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            # Never block the request path on the collector
+            pass
+
+    def _worker(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                self._send(batch)
+            except Exception as e:
+                print(f"Error exporting traces: {e}")
+
+    def _send(self, spans: List[Span]):
+        payload = {'resourceSpans': [{
+            'resource': {'attributes': [_otlp_attribute('service.name', Config.TRACE_SERVICE_NAME)]},
+            'scopeSpans': [{
+                'scope': {'name': 'gapps.tracing'},
+                'spans': [{
+                    'traceId': span.trace_id,
+                    'spanId': span.span_id,
+                    'parentSpanId': span.parent_id or '',
+                    'name': span.name,
+                    'kind': 1,
+                    'startTimeUnixNano': str(span.start_ns),
+                    'endTimeUnixNano': str(span.end_ns),
+                    'attributes': [_otlp_attribute(k, v) for k, v in span.attributes.items()],
+                    'status': {'code': 2 if span.status == 'error' else 1},
+                } for span in spans],
+            }],
+        }]}
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        urllib.request.urlopen(request, timeout=5).close()
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+def _create_exporter():
+    if Config.TRACE_EXPORTER == 'jsonl':
+        return _JsonlExporter(Config.TRACE_FILE, Config.TRACE_FILE_MAX_BYTES, Config.TRACE_FILE_BACKUPS)
+    if Config.TRACE_EXPORTER == 'otlp':
+        return _OtlpExporter(Config.TRACE_OTLP_ENDPOINT)
+    return None
+
+
+_exporter = _create_exporter()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a block of work as a child of the current span"""
+    parent = _current_span.get()
+    trace = _current_trace.get()
+    trace_id = parent.trace_id if parent else (trace.trace_id if trace else os.urandom(16).hex())
+    current = Span(name, trace_id, parent.span_id if parent else None, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = 'error'
+        current.attributes.setdefault('error', str(e))
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current_span.reset(token)
+        if trace is not None:
+            trace.add(current)
+        if _exporter is not None:
+            _exporter.export(current)
+
+
+@contextmanager
+def start_trace(name: str, **attributes):
+    """Start a new trace for a request and yield it, so its breakdown can be returned"""
+    trace = Trace(os.urandom(16).hex())
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(None)
+    try:
+        with span(name, **attributes):
+            yield trace
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+
+
+def wrap(fn: Callable) -> Callable:
+    """Bind fn to the caller's trace context so spans it opens on another thread nest correctly"""
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # Each call gets its own copy: one Context cannot be entered by two threads at once
+        return context.copy().run(fn, *args, **kwargs)
+
+    return run